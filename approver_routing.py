@@ -0,0 +1,113 @@
+# approver_routing.py
+
+import threading
+import datetime
+import time
+
+import pandas as pd
+from firebase_admin import db
+
+from config import APPROVER_ROUTING, APPROVER_ROUTING_CHECK_SECONDS
+
+# 예약의사 → ' -> 승인 : 담당자' / ' -> 참조 : 담당자' 접미사 조회표
+# Firebase 구조: approver_routing/rules/{예약의사} = {"type": "승인", "approver": "김성현"}
+#               approver_routing/version = 마지막 수정 시각 (규칙이 바뀌면 캐시 무효화)
+# version이 있으면 관리자가 저장한 규칙을 그대로 사용합니다. (규칙을 모두 지웠으면 빈 규칙, Firebase는 빈 노드를 저장하지 않음)
+# version이 없을 때(한 번도 저장하지 않음)만 config.APPROVER_ROUTING 기본값을 사용합니다.
+# 규칙은 한 번만 dict로 컴파일해 프로세스 전역에 보관하고, version은 APPROVER_ROUTING_CHECK_SECONDS마다 한 번만 확인해
+# 바뀌었을 때만 다시 읽습니다.
+
+ROUTING_PATH = "approver_routing"
+APPROVER_SUFFIX_COLUMN = "_approver_suffix"
+
+_routing_lock = threading.Lock()
+_compiled_routing = {"version": None, "lookup": None, "checked_at": 0.0}
+_READ_FAILED = object() # version 읽기 실패 표시 (어떤 version과도 같지 않음)
+
+# --- 1. 컴파일 ---
+def compile_routing(rules):
+    """{예약의사: (구분, 담당자)} 규칙을 {예약의사: 접미사} 조회 dict로 변환합니다."""
+    return {
+        doctor.strip(): f" -> {route_type} : {approver}"
+        for doctor, (route_type, approver) in rules.items()
+        if doctor and doctor.strip() and approver
+    }
+
+def _load_saved_rules(version):
+    """version(저장 여부)에 따라 Firebase 규칙(비어 있을 수 있음) 또는 기본 규칙을 반환합니다."""
+    if version is None:
+        return dict(APPROVER_ROUTING)
+    return _rules_from_firebase(db.reference(f"{ROUTING_PATH}/rules").get())
+
+def _rules_from_firebase(rules_node):
+    """Firebase rules 노드를 {예약의사: (구분, 담당자)} 형태로 변환합니다."""
+    return {
+        doctor: (rule.get("type", "승인"), rule.get("approver", ""))
+        for doctor, rule in (rules_node or {}).items() if isinstance(rule, dict)
+    }
+
+
+# --- 2. 조회 ---
+def get_approver_lookup():
+    """
+    컴파일된 접미사 조회 dict를 반환합니다.
+    Firebase의 version은 APPROVER_ROUTING_CHECK_SECONDS마다 한 번만 확인하고, 바뀌었을 때만 규칙 전체를 다시 읽어 컴파일합니다.
+    읽기에 실패하면 이전에 컴파일한 조회 dict를 그대로 쓰고 다음 확인 주기에 다시 읽습니다.
+    (컴파일한 적 없이 Firebase를 사용할 수 없으면 config.APPROVER_ROUTING 기본값 사용)
+    """
+    with _routing_lock:
+        if _compiled_routing["lookup"] is not None and time.monotonic() - _compiled_routing["checked_at"] < APPROVER_ROUTING_CHECK_SECONDS:
+            return _compiled_routing["lookup"]
+
+    try:
+        version = db.reference(f"{ROUTING_PATH}/version").get()
+    except Exception:
+        version = _READ_FAILED # '저장한 적 없음'(None)과 구분
+
+    with _routing_lock:
+        _compiled_routing["checked_at"] = time.monotonic()
+        previous = _compiled_routing["lookup"]
+        if previous is not None and (version is _READ_FAILED or _compiled_routing["version"] == version):
+            return previous
+
+        rules = APPROVER_ROUTING
+        if version is not _READ_FAILED:
+            try:
+                rules = _load_saved_rules(version)
+            except Exception:
+                if previous is not None:
+                    return previous # version을 갱신하지 않으므로 다음 확인 주기에 다시 읽음
+                version = _READ_FAILED
+        # 읽기에 실패해 기본값을 쓴 경우 어떤 version과도 같지 않게 기록해, 다음 확인 때 저장된 규칙을 다시 읽습니다.
+        _compiled_routing.update({"version": version, "lookup": compile_routing(rules)})
+        return _compiled_routing["lookup"]
+
+def load_routing_rules():
+    """관리자 편집용 현재 규칙 목록 ({예약의사: (구분, 담당자)})을 반환합니다. (저장한 적이 없으면 기본 규칙)"""
+    try:
+        return _load_saved_rules(db.reference(f"{ROUTING_PATH}/version").get())
+    except Exception:
+        return dict(APPROVER_ROUTING)
+
+def save_routing_rules(rules):
+    """
+    규칙을 Firebase에 저장하고 version을 갱신해 모든 프로세스의 캐시를 무효화합니다.
+    (다른 프로세스에는 version 확인 주기 안에 반영, 빈 규칙도 version이 남아 '규칙 없음'으로 유지됨)
+    """
+    db.reference(ROUTING_PATH).set({
+        "rules": {doctor.strip(): {"type": route_type, "approver": approver} for doctor, (route_type, approver) in rules.items() if doctor and doctor.strip()},
+        "version": datetime.datetime.now().isoformat(timespec="seconds"),
+    })
+    with _routing_lock:
+        _compiled_routing.update({"version": None, "lookup": None, "checked_at": 0.0})
+
+
+# --- 3. 적용 ---
+def add_approver_suffix_column(df, lookup=None):
+    """예약의사별 접미사를 OCS 행마다 한 번만 계산해 '_approver_suffix' 컬럼으로 추가합니다."""
+    lookup = lookup if lookup is not None else get_approver_lookup()
+    if '예약의사' in df.columns:
+        df[APPROVER_SUFFIX_COLUMN] = df['예약의사'].astype(str).str.strip().map(lookup).fillna("")
+    else:
+        df[APPROVER_SUFFIX_COLUMN] = pd.Series("", index=df.index, dtype=object)
+    return df
@@ -0,0 +1,191 @@
+# batch_runner.py
+
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import time
+
+import excel_utils
+import batch_utils
+import ocs_cache
+import ocs_history
+import dispatch_outbox
+from firebase_utils import get_db_refs
+from notification_utils import (
+    create_match_state, get_match_results, build_dispatch_plan, execute_dispatch_plan, get_sender_credentials
+)
+
+# Streamlit 화면 없이 OCS 파이프라인(복호화 → 정렬/스타일링 → 분석 → 매칭 → 알림 전송)을 실행하는 명령행 진입점
+# 야간 전송 등 예약 작업(cron 등)에서 웹 프로세스 밖에서 CPU를 모두 사용해 실행합니다.
+# 설정은 웹 앱과 같은 .streamlit/secrets.toml을 사용하며, 발신 계정은 GMAIL_SENDER/GMAIL_APP_PASSWORD 환경 변수로도 줄 수 있습니다.
+#
+# 사용 예:
+#   python batch_runner.py ocs_1020.xlsx --password 1234               # 처리/분석만 (알림 전송 안 함)
+#   python batch_runner.py ocs_1020.xlsx --password 1234 --dispatch    # 매칭된 사용자에게 메일/캘린더 전송
+#   python batch_runner.py ./incoming --watch --interval 300 --dispatch   # 폴더를 감시하며 새 파일만 처리
+#   (비밀번호는 OCS_FILE_PASSWORD 환경 변수로도 줄 수 있습니다)
+
+OCS_FILE_PATTERNS = ("*.xlsx", "*.xlsm")
+STATE_FILE = ".batch_runner_state.json"
+logger = logging.getLogger("batch_runner")
+
+# --- 1. 진행 상황 보고 ---
+def log_reporter(stage, message, **details):
+    """
+    기본 보고 함수: 로그로 출력합니다.
+    report(stage, message, **details) 형식의 함수를 run_pipeline에 넘기면 원하는 곳(알림 봇, 모니터링 등)으로 보낼 수 있습니다.
+    stage: 'process' | 'analysis' | 'match' | 'dispatch' | 'done' | 'error'
+    """
+    level = logging.ERROR if stage == "error" or details.get("ok") is False else logging.INFO
+    logger.log(level, "[%s] %s%s", stage, message, f" {details}" if details else "")
+
+
+# --- 2. 파이프라인 ---
+def _load_registration_snapshot(db_ref_func, users_ref, doctor_users_ref):
+    """매칭/스타일링에 쓰는 등록 스냅샷 (학생, 환자, 치과의사)을 한 번 읽습니다."""
+    return users_ref.get() or {}, db_ref_func("patients").get() or {}, doctor_users_ref.get() or {}
+
+def _dispatch_file(result, upload_id, snapshot, db_ref_func, dry_run, report):
+    """한 파일의 매칭 결과로 전송 계획을 만들고 (dry_run이 아니면) outbox를 사용해 전송합니다. upload_id: 업로드 내용 해시"""
+    all_users_meta, all_patients_data, all_doctors_meta = snapshot
+    file_name = result["file_name"]; is_daily = excel_utils.is_daily_schedule(file_name)
+
+    matched_users, matched_doctors = get_match_results(create_match_state(result["dfs"], all_users_meta, all_patients_data, all_doctors_meta))
+    report("match", f"{file_name}: 학생 {len(matched_users)}명, 치과의사 {len(matched_doctors)}명 매칭")
+
+    sender, sender_pw = get_sender_credentials()
+    plan = build_dispatch_plan(matched_users, matched_doctors, file_name, is_daily, sender, upload_id=upload_id)
+    report("dispatch", f"{file_name}: 전송 계획 생성", **plan["stats"])
+    if dry_run:
+        return plan["stats"]
+
+    def _report_item(item, channel, ok, detail):
+        report("dispatch", f"{item['kind']} {item['name']} {channel}", ok=ok, detail=str(detail) if detail else "")
+
+    outbox = dispatch_outbox.open_outbox(db_ref_func, upload_id, file_name, is_daily)
+    results = execute_dispatch_plan(plan["items"], sender, sender_pw, report=_report_item, outbox=outbox)
+    summary = {
+        "emails_ok": sum(r["email_ok"] for r in results), "events_sent": sum(r["events_sent"] for r in results),
+        "skipped": sum(r["skipped"] for r in results), "recipients": len(results),
+    }
+    report("dispatch", f"{file_name}: 전송 완료", **summary)
+    return summary
+
+def run_pipeline(paths, password, output_dir=None, dispatch=False, dry_run=False, max_workers=None, report=log_reporter):
+    """
+    OCS 파일들을 처리합니다. 여러 파일은 프로세스 풀에서 병렬로 처리합니다.
+    반환값: 파일별 요약 리스트 [{'file_name', 'error', 'analysis', 'dispatch'}, ...]
+    """
+    users_ref, doctor_users_ref, db_ref_func = get_db_refs()
+    if db_ref_func is None:
+        raise RuntimeError("Firebase 초기화 실패: secrets 설정을 확인하세요.")
+    snapshot = _load_registration_snapshot(db_ref_func, users_ref, doctor_users_ref)
+    registered_pids = excel_utils.build_registered_pids(snapshot[1])
+
+    files = []; modified_dates = {}; upload_ids = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+        modified_dates[os.path.basename(path)] = datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+        # 웹 화면과 같은 내용 해시를 쓰므로, 같은 파일을 화면/배치 어느 쪽에서 보내도 같은 전송 기록(outbox)을 사용합니다.
+        upload_ids[os.path.basename(path)] = ocs_cache.compute_upload_cache_id(files[-1][1], password)
+    report("process", f"{len(files)}개 파일 처리 시작")
+
+    def _on_file_done(done_count, total_count, result):
+        ok = result["error"] is None
+        report("process", f"({done_count}/{total_count}) {result['file_name']}", ok=ok, **({} if ok else {"error": result["error"]}))
+    results = batch_utils.run_batch_processing(files, password, registered_pids, max_workers=max_workers, progress_callback=_on_file_done)
+
+    summaries = []
+    for result in results:
+        summary = {"file_name": result["file_name"], "error": result["error"], "analysis": result["analysis"], "dispatch": None}
+        summaries.append(summary)
+        if result["error"]:
+            continue
+        try:
+            if output_dir and result["styled_bytes"]:
+                os.makedirs(output_dir, exist_ok=True)
+                output_name = result["file_name"].replace(".xlsx", "_processed.xlsx").replace(".xlsm", "_processed.xlsm")
+                with open(os.path.join(output_dir, output_name), "wb") as f:
+                    f.write(result["styled_bytes"])
+
+            # 여러 날짜의 파일을 한 번에 처리해도 파일마다 자기 진료 날짜의 이력에 기록합니다. (알 수 없으면 파일 수정 날짜)
+            schedule_date = excel_utils.get_schedule_date(result["dfs"], result["file_name"]) or modified_dates[result["file_name"]]
+            if ocs_history.publish_analysis(db_ref_func, result["file_name"], result["analysis"], date_str=schedule_date):
+                report("analysis", f"{result['file_name']}: {schedule_date} 분석 결과 저장", **{dept: counts for dept, counts in result["analysis"].items()})
+
+            if dispatch or dry_run:
+                summary["dispatch"] = _dispatch_file(result, upload_ids[result["file_name"]], snapshot, db_ref_func, dry_run, report)
+        except Exception as e:
+            summary["error"] = str(e)
+            report("error", f"{result['file_name']}: {e}")
+
+    report("done", f"{len(summaries)}개 파일 완료", failed=sum(1 for s in summaries if s["error"]))
+    return summaries
+
+
+# --- 3. 폴더 감시 ---
+def _list_ocs_files(directory):
+    """폴더 안의 OCS 엑셀 파일 경로 목록"""
+    return sorted(path for pattern in OCS_FILE_PATTERNS for path in glob.glob(os.path.join(directory, pattern)))
+
+def _file_signature(path):
+    """처리 여부 판단용 파일 서명 (크기 + 수정 시각)"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+def watch_directory(directory, password, interval, report=log_reporter, **pipeline_kwargs):
+    """폴더를 주기적으로 확인해 새로 들어오거나 바뀐 파일만 처리합니다. 처리 기록은 폴더 안 상태 파일에 남깁니다."""
+    state_path = os.path.join(directory, STATE_FILE)
+    processed = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            processed = json.load(f)
+
+    report("process", f"{directory} 감시 시작 ({interval}초 간격)")
+    while True:
+        pending = [path for path in _list_ocs_files(directory) if processed.get(os.path.basename(path)) != _file_signature(path)]
+        if pending:
+            summaries = run_pipeline(pending, password, report=report, **pipeline_kwargs)
+            failed_names = {s["file_name"] for s in summaries if s["error"]}
+            for path in pending:
+                if os.path.basename(path) not in failed_names: # 실패한 파일은 다음 주기에 다시 시도
+                    processed[os.path.basename(path)] = _file_signature(path)
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(processed, f, ensure_ascii=False, indent=2)
+        time.sleep(interval)
+
+
+# --- 4. 명령행 ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OCS 파일 일괄 처리 (복호화 → 스타일링 → 분석 → 매칭 → 알림 전송)")
+    parser.add_argument("path", help="OCS 엑셀 파일 또는 폴더")
+    parser.add_argument("--password", default=os.environ.get("OCS_FILE_PASSWORD"), help="엑셀 파일 비밀번호 (기본: OCS_FILE_PASSWORD)")
+    parser.add_argument("--output-dir", help="스타일링된 엑셀을 저장할 폴더")
+    parser.add_argument("--dispatch", action="store_true", help="매칭된 사용자에게 메일/캘린더 알림 전송")
+    parser.add_argument("--dry-run", action="store_true", help="전송 계획만 만들고 전송하지 않음")
+    parser.add_argument("--watch", action="store_true", help="폴더를 감시하며 새 파일을 계속 처리")
+    parser.add_argument("--interval", type=int, default=300, help="폴더 감시 간격(초)")
+    parser.add_argument("--workers", type=int, default=None, help="파일 병렬 처리 프로세스 수 (기본: CPU 수)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    pipeline_kwargs = {"output_dir": args.output_dir, "dispatch": args.dispatch, "dry_run": args.dry_run, "max_workers": args.workers}
+
+    if os.path.isdir(args.path):
+        if args.watch:
+            watch_directory(args.path, args.password, args.interval, **pipeline_kwargs)
+            return 0
+        paths = _list_ocs_files(args.path)
+    else:
+        paths = [args.path]
+
+    summaries = run_pipeline(paths, args.password, **pipeline_kwargs)
+    return 1 if any(summary["error"] for summary in summaries) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+# batch_utils.py
+
+import io
+import os
+import json
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import excel_utils
+import upload_io
+from notification_utils import get_matching_data
+from notification_templates import visible_columns
+
+# --- 1. 워커 프로세스 작업 ---
+def process_ocs_file_job(file_name, file_bytes, password, registered_pids_with_depts):
+    """
+    (워커 프로세스) OCS 파일 하나를 복호화 → 파싱/정렬 → 스타일링 → 분석까지 처리합니다.
+    Firebase 연결은 워커에서 만들지 않고, 메인 프로세스가 읽은 등록 스냅샷을 전달받아 사용합니다.
+    """
+    try:
+        memory_profile = []
+        raw_file_io = excel_utils.load_excel(io.BytesIO(file_bytes), password, profile=memory_profile)
+        excel_data_dfs, styled_excel_file = excel_utils.process_excel_file_and_style(
+            raw_file_io, None, registered_pids_with_depts, parallel_sheets=False, profile=memory_profile # 이미 파일 단위로 병렬 처리 중
+        )
+        return {
+            "file_name": file_name,
+            "dfs": excel_data_dfs,
+            "styled_bytes": upload_io.read_all(styled_excel_file),
+            "analysis": excel_utils.run_analysis(excel_data_dfs),
+            "memory_profile": memory_profile,
+            "error": None,
+        }
+    except Exception as e:
+        return {"file_name": file_name, "dfs": {}, "styled_bytes": None, "analysis": {}, "memory_profile": [], "error": str(e)}
+
+
+# --- 2. 배치 실행 ---
+def run_batch_processing(files, password, registered_pids_with_depts, max_workers=None, progress_callback=None):
+    """
+    여러 OCS 파일을 프로세스 풀에서 병렬로 처리합니다.
+    files: [(파일명, 파일 bytes), ...]
+    progress_callback(완료 수, 전체 수, 결과)가 주어지면 파일이 끝날 때마다 호출합니다.
+    반환값: 파일명 순으로 정렬된 결과 리스트
+    """
+    if not files:
+        return []
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(files)))
+    results = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(process_ocs_file_job, file_name, file_bytes, password, registered_pids_with_depts)
+            for file_name, file_bytes in files
+        ]
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.append(result)
+            if progress_callback: progress_callback(done_count, len(files), result)
+
+    return sorted(results, key=lambda r: r["file_name"])
+
+
+def merge_batch_match_results(results, all_users_meta, all_patients_data, all_doctors_meta):
+    """파일별 매칭 결과를 '파일/구분/수신자' 컬럼이 붙은 하나의 DataFrame으로 합칩니다."""
+    merged_frames = []
+    for result in results:
+        if result["error"] or not result["dfs"]:
+            continue
+        matched_users, matched_doctors = get_matching_data(result["dfs"], all_users_meta, all_patients_data, all_doctors_meta)
+        for kind, matches in [("학생", matched_users), ("치과의사", matched_doctors)]:
+            for match in matches:
+                df = visible_columns(match["data"]).copy()
+                df.insert(0, "이메일", match["email"])
+                df.insert(0, "수신자", match["name"])
+                df.insert(0, "구분", kind)
+                df.insert(0, "파일", result["file_name"])
+                merged_frames.append(df)
+
+    if not merged_frames:
+        return pd.DataFrame(columns=["파일", "구분", "수신자", "이메일"])
+    return pd.concat(merged_frames, ignore_index=True)
+
+
+def build_batch_zip(results, merged_matches_df):
+    """스타일링된 엑셀, 통합 매칭 결과(CSV), 파일별 분석 결과(JSON)를 zip으로 묶습니다."""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for result in results:
+            if result["styled_bytes"]:
+                output_filename = result["file_name"].replace(".xlsx", "_processed.xlsx").replace(".xlsm", "_processed.xlsm")
+                zf.writestr(f"styled/{output_filename}", result["styled_bytes"])
+
+        zf.writestr("match_results.csv", merged_matches_df.to_csv(index=False).encode("utf-8-sig"))
+
+        analysis_by_file = {
+            result["file_name"]: ({"error": result["error"]} if result["error"] else result["analysis"])
+            for result in results
+        }
+        zf.writestr("analysis.json", json.dumps(analysis_by_file, ensure_ascii=False, indent=2))
+
+    zip_buffer.seek(0)
+    return zip_buffer
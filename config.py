@@ -3,8 +3,11 @@
 import datetime
 
 # --- 전역 상수 정의 ---
-# 환자 데이터의 진료과 플래그 키 목록 (DB에 저장되는 T/F 플래그)
+# 환자 데이터의 진료과 플래그 키 목록 (이전 형식: 진료과마다 T/F 플래그 저장)
 PATIENT_DEPT_FLAGS = ["보철", "외과", "내과", "소치", "교정", "원진실", "보존", "치주"] 
+# 환자 등록 진료과 bitmask (patients/{user}/{PID}/depts 정수 하나로 저장). 이미 저장된 값의 의미가 바뀌므로 비트 값은 절대 바꾸지 말고 추가만 할 것
+PATIENT_DEPT_BITS = {"보철": 1, "외과": 2, "내과": 4, "소치": 8, "교정": 16, "원진실": 32, "보존": 64, "치주": 128}
+PATIENT_DEPT_MASK_FIELD = "depts"
 # 등록 시 선택할 수 있는 모든 진료과
 DEPARTMENTS_FOR_REGISTRATION = ["교정", "내과", "보존", "보철", "소치", "외과", "치주", "원진실"]
 # Google Calendar Scope
@@ -38,3 +41,81 @@ PROFESSORS_DICT = {
     '보철': ['곽재영', '김성균', '임영준', '김명주', '권호범', '여인성', '윤형인', '박지만', '이재현', '조준호'],
     '교정': [], '내과': [], '원진실': [], '원스톱': [], '임플란트': [], '병리': []
 }
+
+# OCS 분석 규칙 (진료과별 오전/오후 시간대 및 집계 조건)
+# - 시간대: ('시작', '종료') 'HH:MM' 형식, 종료가 None이면 제한 없음 (경계 포함)
+# - count: 집계 조건 목록 (모두 만족하는 환자만 집계)
+#   'non_professor' = 교수님(PROFESSORS_DICT) 외 예약의사 환자, TREATMENT_CATEGORIES의 키 = 진료내역 분류 조건
+# 새 진료과 통계는 이 딕셔너리에 항목을 추가하면 됩니다.
+ANALYSIS_RULES = {
+    '소치': {'오전': ('08:00', '12:50'), '오후': ('13:00', None), 'count': ['non_professor']},
+    '보존': {'오전': ('08:00', '12:30'), '오후': ('12:50', None), 'count': ['non_professor']},
+    '교정': {'오전': ('08:00', '12:30'), '오후': ('12:50', None), 'count': ['bonding']},
+}
+
+# 진료내역 분류 (treatment_classifier가 한 번만 컴파일해 OCS 수집 단계에서 모든 행에 '_tx_{분류}' 플래그로 표시)
+# - include 정규식에 해당하고 exclude 정규식에 해당하지 않는 행 (대소문자 무시)
+# - departments: 분류를 적용할 진료과 목록 (None이면 모든 진료과)
+# - bold: True면 스타일링 시 진료내역 셀을 굵게 표시 (등록 환자 회색 배경 행은 제외)
+# ANALYSIS_RULES의 count 조건에 분류 키를 쓰면 같은 플래그로 집계합니다.
+TREATMENT_CATEGORIES = {
+    'bonding': {'include': r'bonding|본딩', 'exclude': r'debonding', 'departments': ['교정'], 'bold': True},
+}
+
+# 진료과 시트가 이 개수 이상이면 시트별 파싱/정렬/스타일 계산을 프로세스 풀에서 병렬로 수행
+SHEET_PARALLEL_MIN_SHEETS = 4
+
+# 처리된 OCS 업로드의 암호화된 컬럼형(Arrow) 캐시 위치 및 보관 개수
+OCS_CACHE_DIR = ".ocs_cache"
+OCS_CACHE_MAX_ENTRIES = 30
+
+# 예약의사별 승인/참조 담당자 기본 라우팅 (캘린더 제목 뒤 ' -> 승인 : 담당자' 형식으로 표시)
+# 형식: {예약의사: (구분('승인'/'참조'), 담당자)}
+# Firebase 'approver_routing' 노드에 규칙이 저장되어 있으면 그 내용이 우선합니다. (관리자 화면에서 수정)
+APPROVER_ROUTING = {
+    '백승학': ('승인', '김성현'), '임원희': ('승인', '문찬연'), '이신재': ('승인', '이상민'), '안석준': ('승인', '이상민'),
+    '양일형': ('승인', '이소윤'), '안정섭': ('승인', '문찬연'),
+    '김동학': ('참조', '임영준'), '김상헌': ('참조', '권호범'), '송창열': ('참조', '곽재영'), '차채령': ('참조', '여인성'),
+    '최병훈': ('참조', '김성균'), '김형준': ('참조', '곽재영'), '박광일': ('참조', '박지만'), '안세홍': ('참조', '김명주'),
+    '이가영': ('참조', '윤형인'), '이지훈': ('참조', '조준호'),
+}
+# 다른 프로세스/관리자가 저장한 라우팅 변경을 확인하는 주기(초). 이 간격 안에서는 Firebase를 조회하지 않고 캐시를 사용합니다.
+APPROVER_ROUTING_CHECK_SECONDS = 30
+
+# 외부 전송 백엔드 속도 제한 (토큰 버킷, 계정별): rate = 초당 요청 수, burst = 한 번에 몰아서 보낼 수 있는 최대 요청 수
+# 제한(429/5xx/SMTP 4xx)에 걸리면 해당 계정의 속도를 절반으로 낮추고, 성공할 때마다 원래 속도로 조금씩 회복합니다.
+RATE_LIMITS = {
+    'smtp': {'rate': 1.0, 'burst': 5, 'min_rate': 0.1},
+    'calendar': {'rate': 5.0, 'burst': 10, 'min_rate': 0.5},
+}
+# 재시도: 최대 시도 횟수, 지수 백오프 기본/최대 대기 시간(초)
+RATE_LIMIT_MAX_ATTEMPTS = 5
+RATE_LIMIT_BACKOFF_BASE = 1.0
+RATE_LIMIT_BACKOFF_MAX = 30.0
+
+# 학생 환자 목록 페이지 크기 / 서버 검색 최대 결과 수
+PATIENT_PAGE_SIZE = 30
+PATIENT_SEARCH_LIMIT = 50
+
+# 관리자 계정 목록(users_index/doctor_users_index) 페이지 크기 / 이름·이메일 검색 최대 결과 수
+USER_PAGE_SIZE = 50
+USER_SEARCH_LIMIT = 50
+
+# 모든 관리자 세션이 공유하는 처리된 OCS 상태 메모리 캐시 한도 (바이트, LRU 제거 / 디스크 사본은 ocs_cache)
+OCS_STATE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 백그라운드 자동 전송 작업 (동시 실행 작업 수, 진행 상황 새로고침 간격(초), 메모리에 남길 완료 작업 수)
+DISPATCH_JOB_WORKERS = 2
+DISPATCH_JOB_POLL_SECONDS = 2
+DISPATCH_JOB_HISTORY = 20
+
+# OCS 업로드 메모리 예산: 이 크기를 넘는 파일은 거부하고(바이트), 복호화/스타일링 중간 파일은
+# OCS_SPOOL_MAX_MEMORY_BYTES까지만 메모리에 두고 넘으면 임시 파일(디스크)로 내립니다.
+OCS_UPLOAD_MAX_BYTES = 200 * 1024 * 1024
+OCS_SPOOL_MAX_MEMORY_BYTES = 16 * 1024 * 1024
+# 단계별 메모리 보고에 tracemalloc 최대 할당량도 포함할지 (켜면 처리 속도가 느려지며, 값은 프로세스 전체 기준)
+OCS_MEMORY_TRACE = False
+
+# OCS 업로드 시 스타일링/매칭/분석 어디에도 필요 없는 진료과 시트를 건너뛸지 기본값 (관리자 화면에서 변경 가능)
+# 건너뛴 시트는 처리된 엑셀 다운로드에도 포함되지 않습니다.
+OCS_PRUNE_IRRELEVANT_SHEETS = True
@@ -0,0 +1,95 @@
+# dept_codes.py
+
+from functools import lru_cache
+
+from config import PATIENT_DEPT_FLAGS, PATIENT_DEPT_BITS, PATIENT_DEPT_MASK_FIELD, PATIENT_DEPT_TO_SHEET_MAP
+
+# 환자 등록 진료과를 진료과별 T/F 플래그 대신 정수 bitmask 하나로 저장/조회합니다.
+# 예: 교정 + 보철 → {"환자이름": ..., "진료번호": ..., "depts": 17}
+# 이전 형식(진료과별 플래그, 값 True/'True'/'true') 레코드도 patient_mask()로 그대로 읽으며,
+# migrate_patients()로 한 번에 새 형식으로 바꿀 수 있습니다.
+
+LEGACY_FLAG_KEYS = [dept.lower() for dept in PATIENT_DEPT_FLAGS]
+_LEGACY_TRUE_VALUES = (True, 'True', 'true')
+
+# --- 1. 인코딩 / 디코딩 ---
+def dept_bit(dept):
+    """진료과 이름의 비트 (등록할 수 없는 진료과는 0)"""
+    return PATIENT_DEPT_BITS.get(dept, 0)
+
+def encode_departments(departments):
+    """진료과 이름 목록 → bitmask (알 수 없는 이름은 무시)"""
+    mask = 0
+    for dept in departments or ():
+        mask |= dept_bit(str(dept).strip())
+    return mask
+
+@lru_cache(maxsize=None)
+def decode_mask(mask):
+    """bitmask → 진료과 이름 튜플 (PATIENT_DEPT_BITS 순서)"""
+    return tuple(dept for dept, bit in PATIENT_DEPT_BITS.items() if mask & bit)
+
+def patient_mask(patient_info):
+    """환자 레코드의 진료과 bitmask. 새 형식(depts)이 없으면 이전 형식의 진료과 플래그로 계산합니다."""
+    if not isinstance(patient_info, dict):
+        return 0
+    mask = patient_info.get(PATIENT_DEPT_MASK_FIELD)
+    if isinstance(mask, int) and not isinstance(mask, bool):
+        return mask
+    mask = 0
+    for dept, bit in PATIENT_DEPT_BITS.items():
+        if patient_info.get(dept.lower()) in _LEGACY_TRUE_VALUES: mask |= bit
+    return mask
+
+def patient_departments(patient_info):
+    """환자 레코드의 등록 진료과 이름 목록 (화면 표시용)"""
+    return list(decode_mask(patient_mask(patient_info)))
+
+def has_department(patient_info, dept):
+    """환자 레코드에 해당 진료과가 등록되어 있는지 확인합니다."""
+    return bool(patient_mask(patient_info) & dept_bit(dept))
+
+def build_patient_record(name, pid, departments):
+    """새 형식 환자 레코드"""
+    return {"환자이름": name, "진료번호": pid, PATIENT_DEPT_MASK_FIELD: encode_departments(departments)}
+
+
+# --- 2. OCS 시트 진료과 판별 (스타일링/매칭 공용) ---
+@lru_cache(maxsize=None)
+def sheet_search_mask(sheet_dept):
+    """
+    이 시트 진료과를 매칭 대상으로 찾는 환자 등록 진료과들의 bitmask.
+    (PATIENT_DEPT_TO_SHEET_MAP 기준, 예: 임플란트 시트 → 보철|치주|외과) 환자 mask와 AND 한 번으로 매칭 대상 여부를 판별합니다.
+    """
+    mask = 0
+    for dept, bit in PATIENT_DEPT_BITS.items():
+        if sheet_dept in PATIENT_DEPT_TO_SHEET_MAP.get(dept, [dept]): mask |= bit
+    return mask
+
+
+# --- 3. 이전 형식 변환 ---
+def is_legacy_record(patient_info):
+    """진료과별 플래그가 남아 있거나 bitmask가 없는 이전 형식 레코드인지 확인합니다."""
+    if not isinstance(patient_info, dict):
+        return False
+    return PATIENT_DEPT_MASK_FIELD not in patient_info or any(key in patient_info for key in LEGACY_FLAG_KEYS)
+
+def migrate_patients(patients_ref, chunk_size=500):
+    """
+    patients 트리 전체를 새 형식으로 바꿉니다. (bitmask 저장 + 진료과 플래그 삭제)
+    다중 경로 업데이트를 chunk_size개 레코드 단위로 보냅니다. 반환값: 변환한 레코드 수
+    """
+    updates = {}; migrated = 0
+    for user_key, user_patients in (patients_ref.get() or {}).items():
+        if not isinstance(user_patients, dict): continue
+        for pid_key, patient_info in user_patients.items():
+            if not is_legacy_record(patient_info): continue
+            updates[f"{user_key}/{pid_key}/{PATIENT_DEPT_MASK_FIELD}"] = patient_mask(patient_info)
+            for flag_key in LEGACY_FLAG_KEYS:
+                if flag_key in patient_info: updates[f"{user_key}/{pid_key}/{flag_key}"] = None
+            migrated += 1
+            if migrated % chunk_size == 0:
+                patients_ref.update(updates); updates = {}
+    if updates:
+        patients_ref.update(updates)
+    return migrated
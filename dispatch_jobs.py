@@ -0,0 +1,112 @@
+# dispatch_jobs.py
+
+import datetime
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+import dispatch_outbox
+from config import DISPATCH_JOB_WORKERS, DISPATCH_JOB_HISTORY
+from notification_utils import execute_dispatch_plan
+
+# 자동 알림 전송을 백그라운드 작업으로 실행합니다.
+# 관리자 화면의 스크립트 실행과 분리되므로, 전송 중에 위젯을 눌러 페이지가 다시 실행되어도 작업은 끝까지 진행됩니다.
+# 작업 상태는 프로세스 공유 레지스트리(st.cache_resource)에 작업 ID로 보관하고, 화면은 ID로 진행 상황을 주기적으로 읽습니다.
+# 전송 기록(outbox)은 그대로 사용하므로, 프로세스가 재시작되어 작업이 사라져도 다시 전송하면 이어서 보냅니다.
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# --- 1. 프로세스 공유 레지스트리 ---
+@st.cache_resource
+def _get_registry():
+    """{'lock', 'executor': 작업 스레드 풀, 'jobs': OrderedDict(job_id -> 작업 상태)}"""
+    return {"lock": threading.Lock(), "executor": ThreadPoolExecutor(max_workers=DISPATCH_JOB_WORKERS), "jobs": OrderedDict()}
+
+def _prune_finished_jobs(registry):
+    """(잠금 상태에서 호출) 완료된 작업이 DISPATCH_JOB_HISTORY개를 넘으면 오래된 것부터 제거합니다."""
+    finished = [job_id for job_id, job in registry["jobs"].items() if job["status"] != STATUS_RUNNING]
+    for job_id in finished[:max(0, len(finished) - DISPATCH_JOB_HISTORY)]:
+        del registry["jobs"][job_id]
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+# --- 2. 작업 실행 ---
+def _run_job(job_id, plan, sender, sender_pw, db_ref_func):
+    """작업 스레드: 전송 계획을 실행하며 수신자별 결과와 카운터를 작업 상태에 반영합니다."""
+    registry = _get_registry()
+    job = registry["jobs"][job_id]
+
+    def _report(item, channel, ok, detail):
+        skipped = bool(ok and detail)
+        with registry["lock"]:
+            counter = ("emails" if channel == "email" else "calendars") + ("_skipped" if skipped else "_ok" if ok else "_failed")
+            job["counts"][counter] += 1
+            job["log"].append({
+                "구분": item["kind"], "수신자": item["name"], "이메일": item["email"],
+                "채널": "메일" if channel == "email" else "캘린더",
+                "결과": "건너뜀" if skipped else "완료" if ok else "실패" if detail is not None else "미연동",
+                "상세": str(detail) if detail else "", "시각": _now(),
+            })
+            # 수신자마다 캘린더 결과가 항상 마지막에 한 번 보고되므로, 이를 수신자 처리 완료로 셉니다.
+            if channel == "calendar": job["done"] += 1
+
+    try:
+        outbox = dispatch_outbox.open_outbox(db_ref_func, plan["upload_id"], plan["file_name"], plan["is_daily"])
+        execute_dispatch_plan(plan["items"], sender, sender_pw, report=_report, outbox=outbox)
+        final_status, error = STATUS_DONE, None
+    except Exception as e:
+        final_status, error = STATUS_FAILED, str(e)
+    with registry["lock"]:
+        job["status"] = final_status; job["error"] = error; job["finished_at"] = _now()
+
+def submit_dispatch_job(plan, sender, sender_pw, db_ref_func):
+    """
+    전송 계획(build_dispatch_plan 결과)을 백그라운드 작업으로 제출하고 작업 ID를 반환합니다.
+    같은 파일/전송 종류의 작업이 이미 실행 중이면 새로 만들지 않고 그 작업 ID를 반환합니다. (중복 전송 방지)
+    """
+    registry = _get_registry()
+    with registry["lock"]:
+        running_job_id = _find_running_job_id(registry, plan["file_name"], plan["is_daily"])
+        if running_job_id:
+            return running_job_id
+        job_id = uuid.uuid4().hex[:12]
+        registry["jobs"][job_id] = {
+            "job_id": job_id, "file_name": plan["file_name"], "is_daily": plan["is_daily"], "status": STATUS_RUNNING,
+            "total": len(plan["items"]), "done": 0,
+            "counts": {f"{channel}_{result}": 0 for channel in ("emails", "calendars") for result in ("ok", "failed", "skipped")},
+            "log": [], "error": None, "started_at": _now(), "finished_at": None,
+        }
+        _prune_finished_jobs(registry)
+    registry["executor"].submit(_run_job, job_id, plan, sender, sender_pw, db_ref_func)
+    return job_id
+
+
+# --- 3. 조회 ---
+def _find_running_job_id(registry, file_name, is_daily):
+    """(잠금 상태에서 호출) 해당 파일/전송 종류로 실행 중인 작업 ID"""
+    for job_id, job in registry["jobs"].items():
+        if job["status"] == STATUS_RUNNING and job["file_name"] == file_name and job["is_daily"] == is_daily:
+            return job_id
+    return None
+
+def find_running_job(file_name, is_daily):
+    """다른 세션에서 시작한 작업도 찾을 수 있도록 파일/전송 종류로 실행 중인 작업 ID를 찾습니다."""
+    registry = _get_registry()
+    with registry["lock"]:
+        return _find_running_job_id(registry, file_name, is_daily)
+
+def get_job(job_id):
+    """작업 상태의 복사본을 반환합니다. (화면 표시 중에 작업 스레드가 값을 바꿔도 안전) 없으면 None"""
+    registry = _get_registry()
+    with registry["lock"]:
+        job = registry["jobs"].get(job_id)
+        if job is None:
+            return None
+        return {**job, "counts": dict(job["counts"]), "log": list(job["log"])}
@@ -0,0 +1,99 @@
+# dispatch_outbox.py
+
+import datetime
+import hashlib
+
+# 자동 알림 전송 기록(outbox)을 Firebase에 보관해, 중단된 전송을 이어서 할 때 이미 보낸 항목을 건너뜁니다.
+# 메일/일정 본문은 저장하지 않고(환자 정보), 같은 OCS 파일로 다시 만든 전송 계획의 항목 ID로 상태만 대조합니다.
+# 전송 ID는 파일명이 아니라 업로드 내용 해시(ocs_cache.compute_upload_cache_id)로 만듭니다.
+# (같은 이름으로 내용이 바뀐 파일을 올리면 새 outbox, 이름만 바꿔 다시 올리면 같은 outbox)
+# Firebase 구조:
+#   dispatch_outbox/{dispatch_id}/meta = {file_name, is_daily, created_at, updated_at}
+#   dispatch_outbox/{dispatch_id}/items/{item_id} = {status: sending|sent|failed, kind, name, detail, updated_at}
+# item_id: 메일 '{구분}__{safe_key}__mail', 캘린더 일정 '{구분}__{safe_key}__ev_{일정 해시}' (구분: student | doctor)
+#   학생과 치과의사 계정은 같은 이메일 키를 쓸 수 있으므로 수신자 구분을 ID에 넣습니다.
+
+OUTBOX_PATH = "dispatch_outbox"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+KIND_CODES = {"학생": "student", "치과의사": "doctor"}
+
+# --- 1. ID ---
+def compute_dispatch_id(upload_id, is_daily):
+    """업로드 내용 해시와 전송 종류(당일/사전)로 전송 ID를 만듭니다. 같은 파일을 다시 전송하면 같은 outbox를 사용합니다."""
+    return hashlib.sha1(f"{upload_id}|{bool(is_daily)}".encode("utf-8")).hexdigest()[:16]
+
+def _recipient_key(plan_item):
+    """수신자 구분(학생/치과의사)과 이메일 키를 합친 항목 ID 접두어"""
+    return f"{KIND_CODES.get(plan_item['kind'], plan_item['kind'])}__{plan_item['safe_key']}"
+
+def email_item_id(plan_item):
+    """수신자 메일 항목 ID"""
+    return f"{_recipient_key(plan_item)}__mail"
+
+def event_item_id(plan_item, event):
+    """캘린더 일정 항목 ID (일정 제목/시작 시각 기준이므로 같은 일정은 한 번만 등록)"""
+    event_key = f"{event['summary']}|{event['start']['dateTime']}"
+    return f"{_recipient_key(plan_item)}__ev_{hashlib.sha1(event_key.encode('utf-8')).hexdigest()[:12]}"
+
+
+# --- 2. 열기 / 상태 기록 ---
+def open_outbox(db_ref_func, upload_id, file_name, is_daily):
+    """
+    전송 outbox를 열고 기존 항목 상태를 한 번에 읽어 둡니다. (file_name은 기록 표시용)
+    반환 형식: {'dispatch_id', 'db_ref_func', 'statuses': {item_id: status}}
+    """
+    dispatch_id = compute_dispatch_id(upload_id, is_daily)
+    outbox_ref = db_ref_func(f"{OUTBOX_PATH}/{dispatch_id}")
+    meta_ref = outbox_ref.child("meta")
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    if meta_ref.get() is None:
+        meta_ref.set({"file_name": file_name, "is_daily": bool(is_daily), "created_at": now, "updated_at": now})
+
+    items = outbox_ref.child("items").get() or {}
+    return {
+        "dispatch_id": dispatch_id,
+        "db_ref_func": db_ref_func,
+        "statuses": {item_id: (entry or {}).get("status") for item_id, entry in items.items()},
+    }
+
+def is_sent(outbox, item_id):
+    """이미 전송 완료된 항목인지 확인합니다."""
+    return outbox is not None and outbox["statuses"].get(item_id) == STATUS_SENT
+
+def record_statuses(outbox, plan_item, statuses):
+    """
+    항목 상태를 한 번의 다중 경로 업데이트로 기록합니다.
+    statuses: {item_id: (status, detail)}
+    """
+    if outbox is None or not statuses:
+        return
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    updates = {
+        f"items/{item_id}": {
+            "status": status, "kind": plan_item["kind"], "name": plan_item["name"],
+            "detail": str(detail) if detail else "", "updated_at": now,
+        }
+        for item_id, (status, detail) in statuses.items()
+    }
+    updates["meta/updated_at"] = now
+    outbox["db_ref_func"](f"{OUTBOX_PATH}/{outbox['dispatch_id']}").update(updates)
+    outbox["statuses"].update({item_id: status for item_id, (status, _) in statuses.items()})
+
+
+# --- 3. 조회 / 초기화 ---
+def summarize_outbox(db_ref_func, upload_id, is_daily):
+    """관리자 화면 표시용: 해당 파일 전송 기록의 상태별 항목 수를 반환합니다. 기록이 없으면 None."""
+    outbox_ref = db_ref_func(f"{OUTBOX_PATH}/{compute_dispatch_id(upload_id, is_daily)}")
+    if outbox_ref.child("meta").get() is None:
+        return None
+    counts = {STATUS_SENT: 0, STATUS_FAILED: 0, STATUS_SENDING: 0}
+    for entry in (outbox_ref.child("items").get() or {}).values():
+        status = (entry or {}).get("status")
+        if status in counts: counts[status] += 1
+    return counts
+
+def reset_outbox(db_ref_func, upload_id, is_daily):
+    """해당 파일의 전송 기록을 삭제합니다. (처음부터 다시 전송)"""
+    db_ref_func(f"{OUTBOX_PATH}/{compute_dispatch_id(upload_id, is_daily)}").delete()
@@ -5,59 +5,59 @@ import pandas as pd
 import io
 import msoffcrypto
 import re
+import os
+import datetime
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl import load_workbook
 from openpyxl.styles import Font, PatternFill
-from config import PROFESSORS_DICT, SHEET_KEYWORD_TO_DEPARTMENT_MAP
+import upload_io
+from pid_utils import canonicalize_pid_series, canonicalize_pids, add_pid_key_column
+import treatment_classifier
+import dept_codes
+import hashlib
+from config import (
+    PROFESSORS_DICT, SHEET_KEYWORD_TO_DEPARTMENT_MAP, ANALYSIS_RULES, TREATMENT_CATEGORIES,
+    SHEET_PARALLEL_MIN_SHEETS, PATIENT_DEPT_TO_SHEET_MAP
+)
 
 # --- Firebase 연동 함수 ---
+def build_registered_pids(all_patients_by_user):
+    """
+    patients 트리 스냅샷에서 정규화된 진료번호(정수 PID 키)별 등록 진료과 bitmask(dept_codes)를 만듭니다.
+    Firebase 구조: {user_key: {PID: {depts: 17, ...}, ...}} (이전 형식 {교정: true, ...} 레코드도 함께 읽음)
+    반환 형식: {10203: 0b1010000, 334455: 0b1000, ...} → 진료과 확인은 mask & dept_codes.dept_bit(진료과)
+    """
+    pid_keys = []; pid_masks = []
+    if all_patients_by_user:
+        # 1. 사용자별 환자 목록 순회 (user_key: 'asteriajimin619_at_gmail_dot_com')
+        for user_key, user_patients in all_patients_by_user.items():
+            
+            if user_patients and isinstance(user_patients, dict):
+                # 2. 환자 진료번호(PID)별 정보 순회 (pid_key: '100203')
+                for pid_key, patient_info in user_patients.items(): 
+                    
+                    # PID와 patient_info 유효성 검사
+                    if not pid_key or not isinstance(pid_key, str) or not isinstance(patient_info, dict):
+                        continue
+                    pid_keys.append(pid_key); pid_masks.append(dept_codes.patient_mask(patient_info))
+
+    # 3. PID 키를 한 번에 정규화하여 같은 환자의 진료과를 합칩니다. (여러 학생이 등록한 경우 OR)
+    registered_pids_with_depts = {}
+    for pid, mask in zip(canonicalize_pids(pid_keys), pid_masks):
+        if pid is None or not mask: continue
+        registered_pids_with_depts[pid] = registered_pids_with_depts.get(pid, 0) | mask
+    return registered_pids_with_depts
+
 def load_all_registered_pids(db_ref_func):
     """
     Firebase에서 모든 사용자가 등록한 환자의 진료번호(PID)와 등록된 진료과 목록을 로드합니다.
-    Firebase 구조: {user_key: {PID: {교정: true, ...}, ...}}
-    반환 형식: {'PID1': ['교정', '보존'], 'PID2': ['소치'], ...}
+    반환 형식: build_registered_pids와 같음 ({정수 PID 키: 진료과 bitmask})
     """
     try:
         all_patients_by_user = db_ref_func("patients").get() 
-        registered_pids_with_depts = {}
-        
-        standard_dept_names = set(SHEET_KEYWORD_TO_DEPARTMENT_MAP.values())
-        standard_dept_keys = {name.lower() for name in standard_dept_names} # 소문자 진료과 키 셋
-        
-        if all_patients_by_user:
-            # 1. 사용자별 환자 목록 순회 (user_key: 'asteriajimin619_at_gmail_dot_com')
-            for user_key, user_patients in all_patients_by_user.items():
-                
-                if user_patients and isinstance(user_patients, dict):
-                    # 2. 환자 진료번호(PID)별 정보 순회 (pid_key: '100203')
-                    for pid_key, patient_info in user_patients.items(): 
-                        
-                        # PID와 patient_info 유효성 검사
-                        if not pid_key or not isinstance(pid_key, str) or not isinstance(patient_info, dict):
-                            continue
-                        
-                        pid = pid_key.strip()
-                        current_depts = registered_pids_with_depts.get(pid, set())
-                        
-                        # 3. 진료과 플래그 확인: patient_info의 모든 키를 순회하며 표준 진료과 이름과 매칭
-                        for key, value in patient_info.items():
-                            # 키를 소문자로 변환하여 표준 진료과 키와 일치하는지 확인
-                            key_lower = str(key).lower()
-                            
-                            # 해당 키가 표준 진료과 키 목록에 포함되고, 값이 True인지 확인
-                            if key_lower in standard_dept_keys and value in [True, 'true']:
-                                # 표준화된 진료과 이름(예: '교정')을 찾아서 Set에 추가
-                                for dept_name in standard_dept_names:
-                                    if dept_name.lower() == key_lower:
-                                        current_depts.add(dept_name)
-                                        break
-                                
-                        registered_pids_with_depts[pid] = current_depts
-            
-            # 🚨 디버깅을 위해 추가 (실제 운영 시 주석 처리 권장)
-            # st.info(f"🚨 디버그: Firebase에서 총 {len(registered_pids_with_depts)}개의 유니크 PID를 로드했습니다. (예시: {list(registered_pids_with_depts.keys())[:3]})")
-
-        # Set을 List로 변환하여 반환
-        return {pid: list(depts) for pid, depts in registered_pids_with_depts.items()}
+        # 🚨 디버깅을 위해 추가 (실제 운영 시 주석 처리 권장)
+        # st.info(f"🚨 디버그: Firebase에서 총 {len(all_patients_by_user or {})}명의 환자 목록을 로드했습니다.")
+        return build_registered_pids(all_patients_by_user)
     except Exception as e:
         # st.error(f"🚨 디버그 오류: Firebase 환자 데이터 로드 중 오류 발생: {e}")
         return {} # 오류 발생 시 빈 딕셔너리 반환
@@ -68,6 +68,31 @@ def is_daily_schedule(file_name):
     pattern = r'^ocs_\d{4}\.(?:xlsx|xlsm)$'
     return re.match(pattern, file_name, re.IGNORECASE) is not None
     
+def get_schedule_date(excel_data_dfs, file_name, today=None):
+    """
+    OCS 파일의 진료(예약) 날짜를 'YYYY-MM-DD'로 반환합니다. (분석 이력/주간·월간 집계 키)
+    1. 시트들의 예약일시 컬럼에서 가장 많이 나온 날짜
+    2. 예약일시가 없으면 ocs_MMDD 파일 이름 (연도는 오늘과 가장 가까운 해)
+    둘 다 없으면 None (호출 측에서 업로드 날짜 사용)
+    """
+    date_columns = [df['예약일시'] for df in (excel_data_dfs or {}).values() if '예약일시' in df.columns]
+    if date_columns:
+        date_raw = pd.concat(date_columns).astype(str).str.strip().str.replace(r'[-.]', '/', regex=True).str[:10]
+        schedule_dates = pd.to_datetime(date_raw, format='%Y/%m/%d', errors='coerce').dropna()
+        if not schedule_dates.empty:
+            return schedule_dates.dt.date.mode().iloc[0].isoformat()
+
+    if is_daily_schedule(file_name):
+        today = today or datetime.date.today()
+        month, day = int(file_name[4:6]), int(file_name[6:8])
+        candidates = []
+        for year in (today.year - 1, today.year, today.year + 1):
+            try: candidates.append(datetime.date(year, month, day))
+            except ValueError: continue
+        if candidates:
+            return min(candidates, key=lambda date: abs(date - today)).isoformat()
+    return None
+
 def is_encrypted_excel(file_path):
     """엑셀 파일이 암호화되었는지 확인합니다."""
     try:
@@ -77,40 +102,30 @@ def is_encrypted_excel(file_path):
         return False
 
 # --- 엑셀 로드 및 복호화 ---
-def load_excel(file, password=None):
-    """업로드된 엑셀 파일을 로드하고 필요시 복호화합니다."""
+def load_excel(file, password=None, profile=None):
+    """
+    업로드된 엑셀 파일을 로드하고 필요시 복호화합니다.
+    반환값: 엑셀 스트림 (암호화되지 않은 파일은 입력 스트림 그대로, 암호화된 파일은 복호화된 임시 파일)
+    원본 전체를 bytes로 다시 복사하지 않고, 복호화 결과는 메모리 한도를 넘으면 디스크 임시 파일로 내려갑니다.
+    """
+    upload_io.check_upload_size(upload_io.stream_size(file))
     try:
+        # 파일이 암호화되었는지 확인
+        is_encrypted = is_encrypted_excel(file)
         file.seek(0)
-        file_bytes = file.read()
+        if not is_encrypted:
+            return file
         
-        input_stream = io.BytesIO(file_bytes)
-        decrypted_bytes_io = None
+        if not password:
+            raise ValueError("암호화된 파일입니다. 비밀번호를 입력해주세요.")
         
-        # 파일이 암호화되었는지 확인
-        is_encrypted = False
-        try:
-            if msoffcrypto.OfficeFile(input_stream).is_encrypted():
-                is_encrypted = True
-        except:
-            pass
-        
-        if is_encrypted:
-            if not password:
-                raise ValueError("암호화된 파일입니다. 비밀번호를 입력해주세요.")
-            
-            decrypted_bytes_io = io.BytesIO()
-            input_stream.seek(0)
-            
-            office_file = msoffcrypto.OfficeFile(input_stream)
+        with upload_io.profile_stage(profile, "복호화"):
+            decrypted_file = upload_io.new_spooled_file()
+            office_file = msoffcrypto.OfficeFile(file)
             office_file.load_key(password=password)
-            office_file.decrypt(decrypted_bytes_io)
-            
-            decrypted_bytes_io.seek(0)
-            return pd.ExcelFile(decrypted_bytes_io), decrypted_bytes_io
-
-        else:
-            input_stream.seek(0)
-            return pd.ExcelFile(input_stream), input_stream
+            office_file.decrypt(decrypted_file)
+        decrypted_file.seek(0)
+        return decrypted_file
             
     except Exception as e:
         raise ValueError(f"엑셀 로드 또는 복호화 실패: {e}")
@@ -166,236 +181,439 @@ def process_sheet_v8(df, professors_list, sheet_key):
         final_rows.append(row)
 
     final_df = pd.DataFrame(final_rows, columns=df.columns)
-    final_df = final_df[[col for col in required_cols if col in final_df.columns]]
+    # 진료내역 분류 플래그는 스타일 계획에서 읽도록 함께 남깁니다. (엑셀에 쓸 때는 제외)
+    final_df = final_df[[col for col in required_cols if col in final_df.columns] + treatment_classifier.flag_columns(final_df)]
     return final_df
 
-def process_excel_file_and_style(file_bytes_io, db_ref_func):
-    """엑셀 파일을 읽고, 정렬/스타일링을 적용한 후, 분석용 DataFrame 딕셔너리를 반환합니다."""
+# --- 스타일링 헬퍼 ---
+# 등록 환자 행에 적용하는 회색 배경
+GRAY_FILL = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
+NO_FILL = PatternFill(fill_type=None)
+PID_COLUMN_CANDIDATES = ['진료번호', '환자번호', '차트번호', 'PID']
+
+def _resolve_sheet_department(sheet_name):
+    """시트 이름에서 표준화된 진료과 이름(예: '교정', '소치')을 추출합니다. (긴 키워드 우선)"""
+    sheet_name_lower = sheet_name.strip().lower()
+    for keyword, department_name in sorted(SHEET_KEYWORD_TO_DEPARTMENT_MAP.items(), key=lambda item: len(item[0]), reverse=True):
+        if keyword.lower() in sheet_name_lower:
+            return department_name
+    return None
+
+def _get_style_context(header_values, sheet_name):
+    """스타일링에 필요한 헤더 맵, 시트 진료과, PID 컬럼 인덱스(1부터)를 반환합니다."""
+    # 헤더 값을 문자열로 변환하고 공백을 제거하여 안정적인 딕셔너리 생성
+    header = {str(value).strip(): idx + 1 for idx, value in enumerate(header_values)}
+    sheet_dept = _resolve_sheet_department(sheet_name)
+    
+    # PID 컬럼 인덱스 찾기
+    pid_col_idx = None
+    for key in PID_COLUMN_CANDIDATES:
+        if header.get(key):
+            pid_col_idx = header.get(key)
+            break
+    return header, sheet_dept, pid_col_idx
+
+def _classify_row_style(first_value, pid_key, is_bold_treatment, sheet_dept, registered_pids_with_depts):
+    """
+    한 행의 스타일 판정: (등록 환자 회색 배경 여부, 진료내역 굵게 표시 여부)
+    pid_key는 pid_utils로 정규화된 정수 PID 키, is_bold_treatment는 treatment_classifier의 굵게 표시 분류 해당 여부입니다.
+    전체 스타일링(스타일 계획)과 증분 재스타일링이 같은 규칙을 쓰도록 한 곳에 모읍니다.
+    """
+    # 매칭 조건 강화: 1. PID가 등록되어 있고, 2. 현재 시트 진료과 비트가 등록 진료과 bitmask에 켜져 있어야 함
+    registered_mask = registered_pids_with_depts.get(pid_key, 0) if pid_key is not None else 0
+    is_registered_patient = bool(
+        registered_mask & dept_codes.dept_bit(sheet_dept) and 
+        str(first_value).strip() not in ["", "<교수님>"]
+    )
+
+    # 진료내역 강조 (회색 배경이 적용되지 않은 경우에만)
+    return is_registered_patient, bool(is_bold_treatment) and not is_registered_patient
+
+def _style_data_row(row, pid_key, header, sheet_dept, pid_col_idx, registered_pids_with_depts, reset=False):
+    """
+    워크시트의 한 행에 등록 환자 회색 배경 / 교수님 구분자 / 진료내역 강조 스타일을 적용합니다.
+    reset=True이면 기존 배경과 진료내역 강조를 먼저 지운 뒤 다시 계산합니다 (증분 재스타일링용).
+    반환값: 등록 환자 여부
+    """
+    treatment_idx = header.get('진료내역')
+    treatment_cell = row[treatment_idx - 1] if treatment_idx and len(row) >= treatment_idx else None
+    is_registered_patient, is_bold_treatment = False, False
+    
+    if pid_col_idx and len(row) >= pid_col_idx:
+        is_registered_patient, is_bold_treatment = _classify_row_style(
+            row[0].value, pid_key, treatment_classifier.is_bold_treatment(treatment_cell.value if treatment_cell else None, sheet_dept),
+            sheet_dept, registered_pids_with_depts
+        )
+
+    # 환자 등록 여부에 따른 회색 스타일링
+    if is_registered_patient:
+        for cell in row:
+            cell.fill = GRAY_FILL # 회색 배경 적용
+    elif reset:
+        for cell in row:
+            cell.fill = NO_FILL
+                
+    # 교수님 섹션 구분자 스타일링
+    if row[0].value == "<교수님>":
+        for cell in row:
+            if cell.value:
+                cell.font = Font(bold=True)
+
+    # 진료내역 강조 스타일
+    if treatment_cell is not None:
+        if is_bold_treatment:
+            treatment_cell.font = Font(bold=True)
+        elif reset and is_registered_patient:
+            treatment_cell.font = Font()
+
+    return is_registered_patient
+
+def _build_style_plan(processed_df, sheet_name, registered_pids_with_depts):
+    """
+    정렬된 DataFrame에서 엑셀 행 번호 기준 스타일 계획을 만듭니다.
+    워크북을 다시 읽지 않고, 워커 프로세스에서도 계산할 수 있도록 순수 데이터만 반환합니다.
+    """
+    bold_treatments = treatment_classifier.bold_mask(processed_df).tolist() # 수집 단계에서 붙인 분류 플래그
+    processed_df = processed_df.drop(columns=treatment_classifier.flag_columns(processed_df))
+    header, sheet_dept, pid_col_idx = _get_style_context(processed_df.columns, sheet_name)
+    plan = {"gray_rows": [], "bold_rows": [], "bold_cells": []}
+    if not pid_col_idx or not sheet_dept:
+        return plan
+
+    treatment_idx = header.get('진료내역')
+    # 💡 [최적화] PID는 셀마다 문자열 정규화하지 않고 시트 단위로 한 번에 정수 키로 변환합니다.
+    pid_keys = canonicalize_pid_series(processed_df.iloc[:, pid_col_idx - 1])
+    pid_keys = [None if pd.isna(pid) else int(pid) for pid in pid_keys]
+    for offset, values in enumerate(processed_df.itertuples(index=False, name=None)):
+        row_idx = offset + 2 # 헤더가 1행
+        is_registered_patient, is_bold_treatment = _classify_row_style(
+            values[0], pid_keys[offset], bool(treatment_idx) and bold_treatments[offset],
+            sheet_dept, registered_pids_with_depts
+        )
+        if is_registered_patient: plan["gray_rows"].append(row_idx)
+        if values[0] == "<교수님>": plan["bold_rows"].append(row_idx)
+        if is_bold_treatment: plan["bold_cells"].append((row_idx, treatment_idx))
+    return plan
+
+def _apply_style_plan(ws, plan):
+    """스타일 계획을 openpyxl 워크시트에 적용합니다."""
+    for row_idx in plan["gray_rows"]:
+        for cell in ws[row_idx]:
+            cell.fill = GRAY_FILL # 회색 배경 적용
+    for row_idx in plan["bold_rows"]:
+        for cell in ws[row_idx]:
+            if cell.value:
+                cell.font = Font(bold=True)
+    for row_idx, col_idx in plan["bold_cells"]:
+        ws.cell(row=row_idx, column=col_idx).font = Font(bold=True)
+
+# --- 처리할 시트 선별 ---
+def _sheet_keyword_departments(sheet_name):
+    """시트 이름에 들어 있는 모든 키워드의 진료과 (스타일링/매칭의 시트 진료과 판별 방식을 모두 포함하는 보수적 후보)"""
+    sheet_name_lower = sheet_name.strip().lower()
+    return {dept for keyword, dept in SHEET_KEYWORD_TO_DEPARTMENT_MAP.items() if keyword.lower() in sheet_name_lower}
+
+def _analysis_sheet_department(sheet_name):
+    """분석 대상 시트의 진료과 (공백을 제거한 시트 이름이 키워드와 정확히 일치하고 ANALYSIS_RULES에 있는 진료과), 아니면 None"""
+    processed_sheet_name = sheet_name.replace(" ", "").lower()
+    for keyword, dept in SHEET_KEYWORD_TO_DEPARTMENT_MAP.items():
+        if dept in ANALYSIS_RULES and processed_sheet_name == keyword.replace(" ", "").lower():
+            return dept
+    return None
+
+def build_sheet_relevance(registered_pids_with_depts, all_patients_data, all_doctors_meta):
+    """
+    등록 스냅샷과 치과의사 명단으로 이번 처리에 필요한 진료과를 정합니다.
+    반환 형식: {'styling': 등록 환자가 있는 진료과, 'matching': 학생/치과의사 매칭이 찾는 시트 진료과}
+    (분석 대상 진료과는 ANALYSIS_RULES로 항상 포함)
+    """
+    styling_mask = 0
+    for mask in (registered_pids_with_depts or {}).values():
+        styling_mask |= mask
+    styling_depts = set(dept_codes.decode_mask(styling_mask))
+
+    # 매칭 쪽 진료과 판정(notification_utils)과 같은 bitmask/시트 매핑을 사용합니다.
+    matching_mask = 0
+    for user_patients in (all_patients_data or {}).values():
+        if not isinstance(user_patients, dict): continue
+        for patient_info in user_patients.values():
+            matching_mask |= dept_codes.patient_mask(patient_info)
+    matching_flags = set(dept_codes.decode_mask(matching_mask))
+    for doctor_info in (all_doctors_meta or {}).values():
+        if doctor_info: matching_flags.add(doctor_info.get("department", "미지정"))
+
+    matching_depts = set()
+    for dept in matching_flags:
+        matching_depts.update(PATIENT_DEPT_TO_SHEET_MAP.get(dept, [dept]))
+    return {"styling": styling_depts, "matching": matching_depts}
+
+def sheet_relevance_signature(sheet_relevance):
+    """시트 선별 결과가 같은지 비교하기 위한 짧은 서명 (선별하지 않으면 'all')"""
+    if sheet_relevance is None:
+        return "all"
+    key = "|".join(",".join(sorted(sheet_relevance[part])) for part in ("styling", "matching"))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+
+def _is_sheet_relevant(sheet_name, sheet_key, sheet_relevance):
+    """스타일링(등록 환자 진료과), 매칭(학생/치과의사 진료과), 분석 중 하나라도 이 시트가 필요한지 확인합니다."""
+    if sheet_relevance is None or _analysis_sheet_department(sheet_name):
+        return True
+    return sheet_key in sheet_relevance["styling"] or bool(_sheet_keyword_departments(sheet_name) & sheet_relevance["matching"])
+
+# --- 시트 단위 처리 (순차/병렬 공용) ---
+def _process_sheet_values(values, sheet_name_raw, sheet_key, registered_pids_with_depts):
+    """
+    시트 한 장의 셀 값(행 리스트)을 정제 → 정렬 → 스타일 계획까지 처리합니다.
+    반환값: (정제된 DataFrame, 정렬된 DataFrame 또는 None, 스타일 계획 또는 None). 처리 대상이 아니면 None.
+    """
+    while values and (values[0] is None or all((v is None or str(v).strip() == "") for v in values[0])):
+        values.pop(0)
+    if len(values) < 2: return None
+
+    df = pd.DataFrame(values)
+    if df.empty or df.iloc[0].isnull().all(): return None
+
+    df.columns = df.iloc[0]
+    df = df.drop([0]).reset_index(drop=True)
+    df = df.fillna("").astype(str)
+
+    if '예약의사' not in df.columns: return None
+    df['예약의사'] = df['예약의사'].str.strip().str.replace(" 교수님", "", regex=False)
+    # 진료내역 분류 플래그를 한 번에 붙여 둡니다. (스타일링과 분석이 같은 플래그를 사용)
+    treatment_classifier.add_treatment_flags(df, sheet_key)
+    
+    cleaned_df = df.copy() 
+    if '예약시간' in df.columns:
+        # 분석용: 예약시간을 한 번만 분 단위 정수로 변환해 둡니다.
+        cleaned_df['_예약분'] = parse_time_minutes(df['예약시간'])
+    # 매칭용: 정규화된 정수 PID 키를 수집 단계에서 한 번만 계산해 둡니다.
+    add_pid_key_column(cleaned_df)
+
+    professors_list = PROFESSORS_DICT.get(sheet_key, [])
+    
+    try:
+        # 정렬된 데이터프레임 생성
+        processed_df = process_sheet_v8(df, professors_list, sheet_key)
+    except Exception as e:
+        return cleaned_df, None, None
+    return cleaned_df, processed_df, _build_style_plan(processed_df, sheet_name_raw, registered_pids_with_depts)
+
+# 워커 프로세스 전역 (initializer에서 한 번만 설정되는 읽기 전용 공유 데이터)
+_WORKER_WORKBOOK_PATH = None
+_WORKER_REGISTERED_PIDS = None
+
+def _init_sheet_worker(workbook_path, registered_pids_with_depts):
+    """(워커 프로세스) 원본 엑셀 임시 파일 경로와 등록 PID 맵을 읽기 전용으로 보관합니다."""
+    global _WORKER_WORKBOOK_PATH, _WORKER_REGISTERED_PIDS
+    _WORKER_WORKBOOK_PATH = workbook_path
+    _WORKER_REGISTERED_PIDS = registered_pids_with_depts
+
+def _process_sheet_in_worker(sheet_name_raw, sheet_key):
+    """(워커 프로세스) read-only 모드로 해당 시트의 셀만 파싱한 뒤 시트 단위 처리를 수행합니다."""
+    wb = load_workbook(_WORKER_WORKBOOK_PATH, read_only=True, keep_vba=False, data_only=True)
+    try:
+        ws = wb[sheet_name_raw]
+        ws.reset_dimensions() # 잘못 기록된 시트 크기 정보로 행/열이 잘리지 않도록
+        values = list(ws.values)
+    finally:
+        wb.close()
+    return sheet_name_raw, _process_sheet_values(values, sheet_name_raw, sheet_key, _WORKER_REGISTERED_PIDS)
+
+def _copy_sheet_values(source_ws, target_ws):
+    """(건너뛴 시트) read-only 원본 시트의 셀 값을 행 단위로 그대로 옮겨 씁니다."""
+    source_ws.reset_dimensions()
+    for row in source_ws.values:
+        target_ws.append(row)
+
+def process_excel_file_and_style(file_bytes_io, db_ref_func, registered_pids_with_depts=None, parallel_sheets=None, max_workers=None, profile=None,
+                                 sheet_relevance=None, skipped_sheets=None):
+    """
+    엑셀 파일을 읽고, 정렬/스타일링을 적용한 후, 분석용 DataFrame 딕셔너리를 반환합니다.
+    registered_pids_with_depts를 넘기면 Firebase를 다시 조회하지 않고 해당 스냅샷을 사용합니다.
+    parallel_sheets=True이면 진료과 시트를 프로세스 풀에서 동시에 파싱/정렬/스타일 계산합니다.
+    (None이면 대상 시트가 SHEET_PARALLEL_MIN_SHEETS개 이상일 때 자동으로 병렬 처리)
+    스타일링된 엑셀은 메모리 한도를 넘으면 디스크로 내려가는 임시 파일로 반환합니다. (bytes가 필요하면 upload_io.read_all)
+    profile(list)을 넘기면 단계별 소요 시간/메모리 사용량을 기록합니다.
+    sheet_relevance(build_sheet_relevance 결과)를 넘기면 스타일링/매칭/분석 어디에도 필요 없는 진료과 시트는
+    셀을 읽지 않고 건너뛰며, 건너뛴 시트 이름은 skipped_sheets(list)에 추가합니다.
+    """
     file_bytes_io.seek(0)
-    output_buffer_for_styling = io.BytesIO()
 
     try:
-        wb_raw = load_workbook(filename=file_bytes_io, keep_vba=False, data_only=True)
+        wb_raw = load_workbook(filename=file_bytes_io, read_only=True, keep_vba=False, data_only=True)
     except Exception as e:
         raise ValueError(f"엑셀 워크북 로드 실패: {e}")
 
     # 1. Firebase에서 등록된 모든 환자 진료번호(PID)와 등록된 진료과 로드
-    registered_pids_with_depts = load_all_registered_pids(db_ref_func)
-    
-    # 2. 회색 스타일 정의
-    gray_fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
+    if registered_pids_with_depts is None:
+        registered_pids_with_depts = load_all_registered_pids(db_ref_func)
     
-    processed_sheets_dfs = {}
-    cleaned_raw_dfs = {}
-    
-    # 1. 시트별 데이터 처리 및 정렬
+    # 시트 이름 매핑 (진료과 시트만 처리 대상, 선별 시 필요한 시트만)
+    # read-only 워크북은 셀을 순회할 때만 시트 XML을 읽으므로, 건너뛴 시트는 정렬/분석용으로 파싱하지 않습니다.
+    target_sheets = []; skipped = []; department_sheets = []
     for sheet_name_raw in wb_raw.sheetnames:
-        sheet_name_lower = sheet_name_raw.strip().lower()
-
-        # 시트 이름 매핑
-        sheet_key = None
-        for keyword, department_name in sorted(SHEET_KEYWORD_TO_DEPARTMENT_MAP.items(), key=lambda item: len(item[0]), reverse=True):
-            if keyword.lower() in sheet_name_lower:
-                sheet_key = department_name
-                break
+        sheet_key = _resolve_sheet_department(sheet_name_raw)
         if not sheet_key: continue
+        department_sheets.append(sheet_name_raw)
+        if _is_sheet_relevant(sheet_name_raw, sheet_key, sheet_relevance): target_sheets.append((sheet_name_raw, sheet_key))
+        else: skipped.append(sheet_name_raw)
+    if skipped_sheets is not None: skipped_sheets.extend(skipped)
+
+    if parallel_sheets is None:
+        parallel_sheets = len(target_sheets) >= SHEET_PARALLEL_MIN_SHEETS
+
+    # 2. 시트별 데이터 처리 및 정렬 (+ 스타일 계획)
+    sheet_results = {}
+    parallel = bool(parallel_sheets and len(target_sheets) > 1)
+    with upload_io.profile_stage(profile, f"시트 파싱/정렬 ({len(target_sheets)}개{', 병렬' if parallel else ''})"):
+        if parallel:
+            wb_raw.close()
+            # 워커에는 원본 bytes 대신 임시 파일 경로만 넘깁니다. (부모/워커 프로세스마다 원본 전체 복사본을 만들지 않음)
+            workbook_path = upload_io.copy_to_temp_path(file_bytes_io)
+            try:
+                workers = max(1, min(max_workers or os.cpu_count() or 1, len(target_sheets)))
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_sheet_worker, initargs=(workbook_path, registered_pids_with_depts)) as executor:
+                    futures = [executor.submit(_process_sheet_in_worker, name, key) for name, key in target_sheets]
+                    for future in futures:
+                        sheet_name_raw, result = future.result()
+                        sheet_results[sheet_name_raw] = result
+            finally:
+                os.remove(workbook_path)
+        else:
+            for sheet_name_raw, sheet_key in target_sheets:
+                ws = wb_raw[sheet_name_raw]
+                ws.reset_dimensions()
+                sheet_results[sheet_name_raw] = _process_sheet_values(list(ws.values), sheet_name_raw, sheet_key, registered_pids_with_depts)
+            wb_raw.close()
 
-        ws = wb_raw[sheet_name_raw]
-        values = list(ws.values)
-        while values and (values[0] is None or all((v is None or str(v).strip() == "") for v in values[0])):
-            values.pop(0)
-        if len(values) < 2: continue
-
-        df = pd.DataFrame(values)
-        if df.empty or df.iloc[0].isnull().all(): continue
-
-        df.columns = df.iloc[0]
-        df = df.drop([0]).reset_index(drop=True)
-        df = df.fillna("").astype(str)
-
-        if '예약의사' not in df.columns: continue
-        df['예약의사'] = df['예약의사'].str.strip().str.replace(" 교수님", "", regex=False)
-        
-        cleaned_raw_dfs[sheet_name_raw] = df.copy() 
-
-        professors_list = PROFESSORS_DICT.get(sheet_key, [])
-        
-        try:
-            # 정렬된 데이터프레임 생성
-            processed_df = process_sheet_v8(df.copy(), professors_list, sheet_key)
+    processed_sheets_dfs = {}
+    cleaned_raw_dfs = {}
+    style_plans = {}
+    for sheet_name_raw, _ in target_sheets: # 원본 시트 순서 유지
+        result = sheet_results.get(sheet_name_raw)
+        if result is None: continue
+        cleaned_df, processed_df, style_plan = result
+        cleaned_raw_dfs[sheet_name_raw] = cleaned_df
+        if processed_df is not None:
             processed_sheets_dfs[sheet_name_raw] = processed_df
-        except Exception as e:
-            continue
+            style_plans[sheet_name_raw] = style_plan
 
     if not processed_sheets_dfs:
-        if cleaned_raw_dfs:
+        if cleaned_raw_dfs or skipped: # 선별로 모두 건너뛴 경우에도 전체 시트를 다시 읽지 않음
             return cleaned_raw_dfs, None
         file_bytes_io.seek(0)
         all_sheet_dfs = pd.read_excel(file_bytes_io, sheet_name=None)
         return all_sheet_dfs, None
 
-    # 2. 정렬된 데이터로 새 엑셀 파일 생성 및 스타일링
-    with pd.ExcelWriter(output_buffer_for_styling, engine='openpyxl') as writer:
-        for sheet_name_raw, df in processed_sheets_dfs.items():
-            df.to_excel(writer, sheet_name=sheet_name_raw, index=False)
+    # 3. 정렬된 데이터로 새 엑셀 파일 생성 및 스타일링
+    # 💡 [최적화] 저장 후 다시 읽지 않고, 쓰는 중인 워크시트에 스타일 계획을 바로 적용합니다.
+    # 건너뛴 시트도 다운로드 파일에서 빠지지 않도록 원본 값 그대로(정렬/스타일 없이) 같은 순서로 옮겨 씁니다.
+    output_buffer_for_styling = upload_io.new_spooled_file()
+    with upload_io.profile_stage(profile, "엑셀 쓰기/스타일링"):
+        wb_skipped = None
+        if skipped:
+            file_bytes_io.seek(0)
+            wb_skipped = load_workbook(filename=file_bytes_io, read_only=True, keep_vba=False, data_only=True)
+        try:
+            with pd.ExcelWriter(output_buffer_for_styling, engine='openpyxl') as writer:
+                for sheet_name_raw in department_sheets:
+                    if sheet_name_raw in processed_sheets_dfs:
+                        df = processed_sheets_dfs[sheet_name_raw]
+                        df.drop(columns=treatment_classifier.flag_columns(df)).to_excel(writer, sheet_name=sheet_name_raw, index=False)
+                        _apply_style_plan(writer.sheets[sheet_name_raw], style_plans[sheet_name_raw])
+                    elif wb_skipped is not None and sheet_name_raw in skipped:
+                        _copy_sheet_values(wb_skipped[sheet_name_raw], writer.book.create_sheet(sheet_name_raw))
+        finally:
+            if wb_skipped is not None: wb_skipped.close()
 
     output_buffer_for_styling.seek(0)
-    wb_styled = load_workbook(output_buffer_for_styling, keep_vba=False, data_only=True)
+    return cleaned_raw_dfs, output_buffer_for_styling
+
+def restyle_registered_pids(styled_bytes_io, changed_pids, registered_pids_with_depts):
+    """
+    이미 스타일링된 엑셀에서 등록 상태가 바뀐 PID 행만 다시 스타일링합니다.
+    (업로드 이후 환자 등록/삭제가 있을 때 전체 재처리 없이 회색 배경만 갱신)
+    changed_pids=None이면 모든 행을 현재 등록 상태로 다시 스타일링합니다.
+    """
+    if not styled_bytes_io or (changed_pids is not None and not changed_pids):
+        return styled_bytes_io
+
+    if changed_pids is not None:
+        changed_pids = {pid for pid in canonicalize_pids(changed_pids) if pid is not None}
+    styled_bytes_io.seek(0)
+    wb_styled = load_workbook(styled_bytes_io, keep_vba=False, data_only=True)
 
-    # 스타일링 로직
     for sheet_name in wb_styled.sheetnames:
         ws = wb_styled[sheet_name]
-        
-        # 헤더 값을 문자열로 변환하고 공백을 제거하여 안정적인 딕셔너리 생성
-        header = {str(cell.value).strip(): idx + 1 for idx, cell in enumerate(ws[1])}
-        
-        # 시트 이름에서 현재 진료과(sheet_dept) 추출
-        sheet_dept = None
-        sheet_name_lower = sheet_name.strip().lower()
-        for keyword, department_name in sorted(SHEET_KEYWORD_TO_DEPARTMENT_MAP.items(), key=lambda item: len(item[0]), reverse=True):
-            if keyword.lower() in sheet_name_lower:
-                sheet_dept = department_name # 표준화된 진료과 이름 (예: '교정', '소치')
-                break
-        
-        # PID 컬럼 인덱스 찾기
-        pid_col_idx = None
-        for key in ['진료번호', '환자번호', '차트번호', 'PID']:
-            if header.get(key):
-                pid_col_idx = header.get(key)
-                break
-        
-        # PID 컬럼을 찾지 못했거나 진료과가 매칭되지 않았으면 스킵
+        header, sheet_dept, pid_col_idx = _get_style_context([cell.value for cell in ws[1]], sheet_name)
         if not pid_col_idx or not sheet_dept:
             continue
 
-        for row_idx, row in enumerate(ws.iter_rows(min_row=2, max_row=ws.max_row), start=2):
-            
-            is_registered_patient = False
-            
-            # 환자 등록 여부에 따른 회색 스타일링
-            if pid_col_idx and len(row) >= pid_col_idx:
-                 pid_cell = row[pid_col_idx - 1]
-                 pid_raw_value = pid_cell.value
-
-                 # 💡 PID 형식 통일 로직 수정 (앞의 0을 제거하고 숫자로만 변환)
-                 pid_str = str(pid_raw_value).strip()
-                 
-                 # .0이 붙은 float 문자열을 int로 변환
-                 if pid_str.endswith('.0'):
-                    pid_str = pid_str[:-2]
-                    
-                 # Scientific notation (예: 1.02896E+07) 처리
-                 if 'E' in pid_str.upper():
-                    try:
-                        pid_str = str(int(float(pid_str)))
-                    except ValueError:
-                        pass # 변환 실패 시 기존 문자열 유지
-                
-                 # 최종적으로 숫자만 추출하고, 앞의 0을 제거하기 위해 int로 변환 후 다시 문자열로 변환
-                 pid_value_digits = "".join(filter(str.isdigit, pid_str))
-                 
-                 # 🚨 핵심 수정: 정수로 변환 후 다시 문자열로 만들어 앞의 0을 완전히 제거
-                 try:
-                     pid_value = str(int(pid_value_digits)) 
-                 except ValueError:
-                     pid_value = pid_value_digits # 숫자가 아닐 경우 기존 값 유지
-
-                 # 매칭 조건 강화: 1. PID가 등록되어 있고, 2. 현재 시트 진료과가 등록된 진료과 목록에 포함되어야 함
-                 registered_depts = registered_pids_with_depts.get(pid_value)
-                 
-                 if (registered_depts and 
-                     sheet_dept in registered_depts and 
-                     str(row[0].value).strip() not in ["", "<교수님>"]):
-                    
-                    is_registered_patient = True
-                    for cell in row:
-                        cell.fill = gray_fill # 회색 배경 적용
-                        
-            # 교수님 섹션 구분자 스타일링
-            if row[0].value == "<교수님>":
-                for cell in row:
-                    if cell.value:
-                        cell.font = Font(bold=True)
-
-            # 교정 Bonding 강조 스타일
-            if sheet_name.strip() == "교정" and '진료내역' in header:
-                idx = header['진료내역'] - 1
-                if len(row) > idx:
-                    cell = row[idx]
-                    text = str(cell.value).strip().lower()
-                    
-                    if ('bonding' in text or '본딩' in text) and 'debonding' not in text:
-                        # 회색 배경이 적용되지 않은 경우에만 폰트 스타일 적용
-                        if not is_registered_patient: 
-                            cell.font = Font(bold=True)
-
-    final_output_bytes = io.BytesIO()
-    wb_styled.save(final_output_bytes)
-    final_output_bytes.seek(0)
-    
-    return cleaned_raw_dfs, final_output_bytes
+        rows = [row for row in ws.iter_rows(min_row=2, max_row=ws.max_row) if len(row) >= pid_col_idx]
+        pid_keys = canonicalize_pids(row[pid_col_idx - 1].value for row in rows)
+        for row, pid_key in zip(rows, pid_keys):
+            if changed_pids is not None and pid_key not in changed_pids:
+                continue
+            _style_data_row(row, pid_key, header, sheet_dept, pid_col_idx, registered_pids_with_depts, reset=True)
+
+    restyled_output_bytes = io.BytesIO()
+    wb_styled.save(restyled_output_bytes)
+    restyled_output_bytes.seek(0)
+    return restyled_output_bytes
 
 # --- OCS 데이터 분석 ---
+def parse_time_minutes(time_series):
+    """'HH:MM' 형식의 예약시간을 자정 기준 분(int)으로 변환합니다. 형식이 다르면 -1."""
+    parts = time_series.astype(str).str.strip().str.extract(r'^(\d{1,2}):(\d{2})')
+    minutes = pd.to_numeric(parts[0], errors='coerce') * 60 + pd.to_numeric(parts[1], errors='coerce')
+    return minutes.fillna(-1).astype('int32')
+
+def _hhmm_to_minutes(hhmm):
+    """설정의 'HH:MM' 문자열을 분으로 변환합니다."""
+    if hhmm is None: return None
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def _analysis_count_mask(df, dept, count_rules):
+    """설정된 집계 조건을 모두 만족하는 행의 마스크를 만듭니다."""
+    mask = pd.Series(True, index=df.index)
+    for rule in count_rules:
+        if rule == 'non_professor':
+            mask &= ~df['예약의사'].isin(PROFESSORS_DICT.get(dept, []))
+        elif rule in TREATMENT_CATEGORIES:
+            # 수집 단계에서 붙인 분류 플래그 사용 (플래그가 없는 이전 캐시 데이터는 여기서 분류)
+            flag_col = treatment_classifier.flag_column(rule)
+            flags = df[flag_col] if flag_col in df.columns else treatment_classifier.classify_treatments(df['진료내역'], dept)[flag_col]
+            mask &= flags.eq(True)
+        else:
+            raise ValueError(f"알 수 없는 분석 집계 조건: {rule}")
+    return mask
+
 def run_analysis(df_dict):
-    """OCS 데이터를 기반으로 소치/보존/교정의 통계를 분석합니다."""
+    """OCS 데이터를 기반으로 ANALYSIS_RULES에 정의된 진료과별 오전/오후 통계를 분석합니다."""
     analysis_results = {}
     
-    # 분석에 필요한 시트 이름 매핑
-    sheet_department_map = {
-        '소치': '소치', '소아치과': '소치', '소아 치과': '소치', '보존': '보존', '보존과': '보존', '치과보존과': '보존',
-        '교정': '교정', '교정과': '교정', '치과교정과': '교정'
-    }
-    
+    # 분석 대상 시트 매핑: 공백을 제거한 시트 이름이 진료과 키워드와 정확히 일치하는 경우
     mapped_dfs = {}
     for sheet_name, df in df_dict.items():
-        processed_sheet_name = sheet_name.replace(" ", "").lower()
-        for key, dept in sheet_department_map.items():
-            if processed_sheet_name == key.replace(" ", "").lower():
-                if all(col in df.columns for col in ['예약의사', '예약시간', '진료내역']):
-                     mapped_dfs[dept] = df.copy()
-                break
-
-    # 1. 소치 분석
-    if '소치' in mapped_dfs:
-        df = mapped_dfs['소치']
-        non_professors_df = df[~df['예약의사'].isin(PROFESSORS_DICT.get('소치', []))]
-        non_professors_df['예약시간'] = non_professors_df['예약시간'].astype(str).str.strip()
-        non_professors_df = non_professors_df[non_professors_df['예약시간'].str.contains(':')] 
-        
-        # 오전: 08:00 ~ 12:50
-        morning_patients = non_professors_df[(non_professors_df['예약시간'] >= '08:00') & (non_professors_df['예약시간'] <= '12:50')].shape[0]
-        # 오후: 13:00 이후
-        afternoon_patients = non_professors_df[non_professors_df['예약시간'] >= '13:00'].shape[0]
-        
-        analysis_results['소치'] = {'오전': morning_patients, '오후': afternoon_patients}
-
-    # 2. 보존 분석
-    if '보존' in mapped_dfs:
-        df = mapped_dfs['보존']
-        non_professors_df = df[~df['예약의사'].isin(PROFESSORS_DICT.get('보존', []))]
-        non_professors_df['예약시간'] = non_professors_df['예약시간'].astype(str).str.strip()
-        non_professors_df = non_professors_df[non_professors_df['예약시간'].str.contains(':')]
-
-        # 오전: 08:00 ~ 12:30
-        morning_patients = non_professors_df[(non_professors_df['예약시간'] >= '08:00') & (non_professors_df['예약시간'] <= '12:30')].shape[0]
-        # 오후: 12:50 이후
-        afternoon_patients = non_professors_df[non_professors_df['예약시간'] >= '12:50'].shape[0]
-        
-        analysis_results['보존'] = {'오전': morning_patients, '오후': afternoon_patients}
-
-    # 3. 교정 분석 (Bonding)
-    if '교정' in mapped_dfs:
-        df = mapped_dfs['교정']
-        # Bonding이 포함되고 debonding이 없는 환자 필터링
-        bonding_patients_df = df[df['진료내역'].str.contains('bonding|본딩', case=False, na=False) & ~df['진료내역'].str.contains('debonding', case=False, na=False)]
-        bonding_patients_df['예약시간'] = bonding_patients_df['예약시간'].astype(str).str.strip()
-        bonding_patients_df = bonding_patients_df[bonding_patients_df['예약시간'].str.contains(':')]
-
-        # 오전: 08:00 ~ 12:30
-        morning_bonding_patients = bonding_patients_df[(bonding_patients_df['예약시간'] >= '08:00') & (bonding_patients_df['예약시간'] <= '12:30')].shape[0]
-        # 오후: 12:50 이후
-        afternoon_bonding_patients = bonding_patients_df[bonding_patients_df['예약시간'] >= '12:50'].shape[0]
-        
-        analysis_results['교정'] = {'오전': morning_bonding_patients, '오후': afternoon_bonding_patients}
+        dept = _analysis_sheet_department(sheet_name)
+        if dept and all(col in df.columns for col in ['예약의사', '예약시간', '진료내역']):
+            mapped_dfs[dept] = df
+
+    for dept, rule in ANALYSIS_RULES.items():
+        if dept not in mapped_dfs: continue
+        df = mapped_dfs[dept]
+
+        # 예약시간은 시트당 한 번만 분 단위 정수로 변환 (수집 단계에서 만든 '_예약분' 컬럼 재사용)
+        minutes = df['_예약분'] if '_예약분' in df.columns else parse_time_minutes(df['예약시간'])
+        counted = _analysis_count_mask(df, dept, rule.get('count', [])) & (minutes >= 0)
+
+        dept_result = {}
+        for period in ['오전', '오후']:
+            start, end = (_hhmm_to_minutes(t) for t in rule[period])
+            period_mask = counted & (minutes >= start)
+            if end is not None: period_mask &= (minutes <= end)
+            dept_result[period] = int(period_mask.sum())
+        analysis_results[dept] = dept_result
         
     return analysis_results
@@ -0,0 +1,80 @@
+# hangul_search.py
+
+# 한글 이름 검색 인덱스 (부분 문자열/접두어, 초성, 분류 필터)
+# 예: '김철', '철수', 'ㄱㅊㅅ', 'ㄱ철ㅅ' 모두 '김철수'를 찾습니다.
+# 이름은 짧으므로 이름과 초성 문자열의 모든 부분 문자열을 미리 키로 만들어 두고, 검색은 dict 조회로 처리합니다.
+
+CHOSEONG_LIST = ['ㄱ', 'ㄲ', 'ㄴ', 'ㄷ', 'ㄸ', 'ㄹ', 'ㅁ', 'ㅂ', 'ㅃ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅉ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
+CHOSEONG_SET = set(CHOSEONG_LIST)
+_HANGUL_START, _HANGUL_END, _SYLLABLES_PER_CHOSEONG = 0xAC00, 0xD7A3, 588
+
+# --- 1. 초성 ---
+def to_choseong(text):
+    """한글 음절을 초성으로 바꾼 문자열을 반환합니다. (한글 음절이 아닌 문자는 그대로)"""
+    return "".join(
+        CHOSEONG_LIST[(ord(ch) - _HANGUL_START) // _SYLLABLES_PER_CHOSEONG] if _HANGUL_START <= ord(ch) <= _HANGUL_END else ch
+        for ch in text
+    )
+
+def normalize_query(text):
+    """검색어/이름 정규화: 공백 제거 + 소문자"""
+    return "".join(str(text or "").split()).lower()
+
+def _substrings(text):
+    """모든 부분 문자열 집합 (접두어 포함)"""
+    return {text[start:end] for start in range(len(text)) for end in range(start + 1, len(text) + 1)}
+
+def _matches_at(name, query, start):
+    """검색어가 이름의 start 위치부터 글자별로 맞는지 확인합니다. (음절은 그대로, 초성은 해당 음절의 초성과 비교)"""
+    window = name[start:start + len(query)]
+    return len(window) == len(query) and all(q == n or (q in CHOSEONG_SET and to_choseong(n) == q) for q, n in zip(query, window))
+
+def _matches_mixed(name, query):
+    """'ㄱ철ㅅ'처럼 초성과 음절이 섞인 검색어가 이름의 연속된 부분과 맞는지 확인합니다."""
+    return any(_matches_at(name, query, start) for start in range(len(name) - len(query) + 1))
+
+
+# --- 2. 인덱스 ---
+def build_search_index(items, name_field="name", facet_field=None):
+    """
+    항목 목록으로 검색 인덱스를 만듭니다. (목록이 바뀔 때만 다시 만들면 됩니다)
+    반환 형식: {'items', 'names', 'text': {부분 문자열: {idx}}, 'choseong': {초성 부분 문자열: {idx}}, 'facets': {분류값: {idx}}}
+    """
+    index = {"items": list(items), "names": [], "text": {}, "choseong": {}, "facets": {}}
+    for idx, item in enumerate(index["items"]):
+        name = normalize_query(item.get(name_field, ""))
+        index["names"].append(name)
+        for key in _substrings(name):
+            index["text"].setdefault(key, set()).add(idx)
+        for key in _substrings(to_choseong(name)):
+            index["choseong"].setdefault(key, set()).add(idx)
+        if facet_field:
+            index["facets"].setdefault(item.get(facet_field), set()).add(idx)
+    return index
+
+def search(index, query, facet=None, records=None):
+    """
+    검색어(부분 문자열/접두어/초성/혼합)와 분류 필터로 항목을 찾습니다.
+    정확히 일치 → 접두어 일치 → 부분 일치 순으로 정렬하며(정규화한 이름 기준, 초성/혼합 검색어 포함), 검색어가 비어 있으면 분류 필터만 적용합니다.
+    records: 인덱스를 만들 때와 같은 순서의 원본 레코드 목록. 주면 인덱스 항목 대신 원본 레코드를 반환합니다.
+    """
+    query = normalize_query(query)
+    if not query:
+        matched = set(range(len(index["items"])))
+    elif all(ch in CHOSEONG_SET for ch in query):
+        matched = set(index["choseong"].get(query, ()))
+    elif not any(ch in CHOSEONG_SET for ch in query):
+        matched = set(index["text"].get(query, ()))
+    else:
+        candidates = index["choseong"].get(to_choseong(query), ())
+        matched = {idx for idx in candidates if _matches_mixed(index["names"][idx], query)}
+
+    if facet is not None:
+        matched &= index["facets"].get(facet, set())
+
+    def _rank(idx):
+        name = index["names"][idx]
+        if _matches_at(name, query, 0): return (0 if len(name) == len(query) else 1, idx)
+        return (2, idx)
+    results = records if records is not None else index["items"]
+    return [results[idx] for idx in sorted(matched, key=_rank)]
@@ -0,0 +1,105 @@
+# notification_templates.py
+
+import html
+from string import Template
+
+import pandas as pd
+
+# 알림 메일 본문 렌더링 (자동 전송 / 학생 수동 전송 / 치과의사 수동 전송 공용)
+# 템플릿은 모듈 로드 시 한 번만 만들고, 날짜/시간 포맷은 OCS 시트(DataFrame)마다 한 번만 벡터 연산으로 계산합니다.
+
+# --- 1. 컬럼 정의 ---
+EMAIL_COLUMNS = ['환자명', '진료번호', '예약의사', '진료내역', '예약일시', '예약시간', '등록과']
+DOCTOR_EMAIL_COLUMNS = ['환자명', '진료번호', '예약의사', '진료내역', '예약일시', '예약시간']
+# 렌더링용 파생 컬럼 (화면/엑셀 출력에서는 숨김)
+MMDD_COLUMN = '_mmdd'
+HHMM_COLUMN = '_hhmm'
+
+# --- 2. 미리 만든 템플릿 ---
+_TABLE_STYLE = """
+<style>
+table {width: 100%; border-collapse: collapse; font-family: Arial, sans-serif; font-size: 14px;}
+th, td {border: 1px solid #dddddd; text-align: left; padding: 8px;}
+th {background-color: #f2f2f2; font-weight: bold;}
+</style>
+"""
+_BODY_TEMPLATE = Template("""
+<p>안녕하세요, ${recipient}.</p>
+<p>${intro}</p>
+<div class='table-container'>${table_style}${table}</div>
+<br>
+<br>
+<div style='font-family: sans-serif; font-size: 14px; line-height: 1.6; color: #333;'>
+${summary}
+</div>
+<br>
+<br>
+<p>확인 부탁드립니다.</p>
+""")
+_TABLE_TEMPLATE = Template('<table border="1" class="dataframe">\n<thead>\n<tr>${header}</tr>\n</thead>\n<tbody>\n${rows}\n</tbody>\n</table>')
+
+
+# --- 3. 파생 컬럼 (OCS 시트당 한 번) ---
+def add_render_columns(df):
+    """예약일시/예약시간으로 요약 줄에 쓰는 MMDD, HHMM 컬럼을 벡터 연산으로 추가합니다."""
+    if df.empty:
+        df[MMDD_COLUMN] = pd.Series(dtype=str); df[HHMM_COLUMN] = pd.Series(dtype=str)
+        return df
+
+    date_digits = df.get('예약일시', pd.Series("", index=df.index)).astype(str).str.replace(r'[^0-9]', '', regex=True)
+    df[MMDD_COLUMN] = date_digits.str[-4:].where(date_digits.str.len() >= 4, "0000")
+
+    time_digits = df.get('예약시간', pd.Series("", index=df.index)).astype(str).str.replace(r'[^0-9]', '', regex=True)
+    df[HHMM_COLUMN] = time_digits.str.zfill(4).where(time_digits.str.len() <= 4, time_digits.str[:4])
+    return df
+
+
+def visible_columns(df):
+    """'_'로 시작하는 내부 파생 컬럼을 제외한 DataFrame을 반환합니다. (화면 표시/내보내기용)"""
+    return df[[col for col in df.columns if not str(col).startswith('_')]]
+
+
+# --- 4. 렌더링 ---
+def render_table_html(records, columns):
+    """레코드 목록으로 HTML 표를 만듭니다."""
+    header = "".join(f"<th>{html.escape(col)}</th>" for col in columns)
+    rows = "\n".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(record.get(col, '')))}</td>" for col in columns) + "</tr>"
+        for record in records
+    )
+    return _TABLE_TEMPLATE.substitute(header=header, rows=rows)
+
+
+def render_summary_lines(df_matched, user_number, user_name):
+    """
+    '진료의사,MMDD,HHMM,환자이름,환자번호,사용자번호,사용자이름' 형식의 요약 줄을 벡터 연산으로 만듭니다.
+    """
+    if df_matched.empty:
+        return []
+    if MMDD_COLUMN not in df_matched.columns or HHMM_COLUMN not in df_matched.columns:
+        df_matched = add_render_columns(df_matched.copy())
+
+    def _col(name):
+        return df_matched.get(name, pd.Series("", index=df_matched.index)).astype(str).str.strip()
+
+    suffix = f",{str(user_number).strip()},{str(user_name).strip()}"
+    lines = (_col('예약의사') + "," + df_matched[MMDD_COLUMN] + "," + df_matched[HHMM_COLUMN] + ","
+             + _col('환자명') + "," + _col('진료번호') + suffix)
+    return lines.tolist()
+
+
+def render_notification_email(user_name, user_number, df_matched, intro, recipient=None, columns=EMAIL_COLUMNS):
+    """
+    알림 메일 본문(표 + 요약 텍스트)을 만듭니다.
+    반환값: (HTML 본문, 표에 사용한 레코드 목록)
+    """
+    columns = [col for col in columns if col in df_matched.columns]
+    records = df_matched[columns].to_dict('records')
+    body = _BODY_TEMPLATE.substitute(
+        recipient=recipient or f"{user_name}님",
+        intro=intro,
+        table_style=_TABLE_STYLE,
+        table=render_table_html(records, columns),
+        summary="<br>".join(render_summary_lines(df_matched, user_number, user_name)),
+    )
+    return body, records
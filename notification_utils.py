@@ -1,16 +1,24 @@
 # notification_utils.py
 import re
+import os
 import streamlit as st
 import pandas as pd
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import datetime
+import time
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request # 💡 토큰 갱신을 위해 추가됨
 from firebase_utils import load_google_creds_from_firebase, recover_email, save_google_creds_to_firebase # 💡 저장 함수 추가됨
-from config import PATIENT_DEPT_FLAGS, PATIENT_DEPT_TO_SHEET_MAP, SHEET_KEYWORD_TO_DEPARTMENT_MAP
+from notification_templates import add_render_columns, render_notification_email
+from approver_routing import get_approver_lookup, add_approver_suffix_column
+import dispatch_outbox
+import dept_codes
+import rate_limiter
+from pid_utils import PID_KEY_COLUMN, canonicalize_pids, add_pid_key_column
+from config import PATIENT_DEPT_TO_SHEET_MAP, SHEET_KEYWORD_TO_DEPARTMENT_MAP
 
 # --- 유효성 검사 ---
 def is_valid_email(email):
@@ -19,24 +27,39 @@ def is_valid_email(email):
     return re.match(email_regex, email) is not None
 
 # --- 이메일 전송 ---
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 587
+
+def build_email_message(receiver, sender, body, subject):
+    """HTML 본문으로 전송할 메일(MIME 메시지)을 만듭니다."""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = receiver
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+def open_smtp_connection(sender, password):
+    """SMTP 서버에 로그인된 연결을 엽니다. (여러 메일을 보낼 때 연결 하나를 재사용)"""
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    server.starttls()
+    server.login(sender, password)
+    return server
+
 def send_email(receiver, rows, sender, password, date_str=None, custom_message=None):
     """
     이메일을 전송하는 범용 함수입니다.
     custom_message가 있으면 그것을 본문으로 사용합니다 (표 + 텍스트 데이터 포함).
     """
     try:
-        msg = MIMEMultipart()
-        msg['From'] = sender
-        msg['To'] = receiver
-
         if custom_message:
-            msg['Subject'] = "단체 메일 알림" if date_str is None else f"[치과 내원 알림] {date_str} 예약 내역"
+            subject = "단체 메일 알림" if date_str is None else f"[치과 내원 알림] {date_str} 예약 내역"
             body = custom_message
         else:
             subject_prefix = ""
             if date_str:
                 subject_prefix = f"{date_str}일에 내원하는 "
-            msg['Subject'] = f"{subject_prefix}등록 환자 내원 알림"
+            subject = f"{subject_prefix}등록 환자 내원 알림"
             
             if rows is not None and isinstance(rows, list):
                 rows_df = pd.DataFrame(rows)
@@ -46,63 +69,32 @@ def send_email(receiver, rows, sender, password, date_str=None, custom_message=N
             else:
                  body = "내원 환자 정보가 없습니다."
 
-        msg.attach(MIMEText(body, 'html'))
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender, password)
-        server.send_message(msg)
-        server.quit()
+        msg = build_email_message(receiver, sender, body, subject)
+
+        def _send():
+            server = open_smtp_connection(sender, password)
+            try: server.send_message(msg)
+            finally: server.quit()
+        rate_limiter.call_with_backoff('smtp', sender, _send)
         return True
     except Exception as e:
         return str(e)
 
 # --- Google Calendar 이벤트 생성 ---
-def create_calendar_event(service, patient_name, pid, department, reservation_datetime, doctor_name, treatment_details, is_daily, user_name="", user_number=""):
+def build_calendar_event(patient_name, pid, department, reservation_datetime, doctor_name, treatment_details, is_daily, user_name="", user_number="", approver_suffix=None):
     """
-    Google Calendar에 단일 이벤트를 생성합니다.
+    캘린더 이벤트 본문(dict)을 만듭니다. (API 호출 없음)
     승인 담당자 정보를 괄호 밖 화살표 포맷으로 추가합니다.
     """
     seoul_tz = datetime.timezone(datetime.timedelta(hours=9))
     event_start = reservation_datetime.replace(tzinfo=seoul_tz)
     event_end = event_start + datetime.timedelta(minutes=30)
     
-    # [수정] 승인 담당자 매핑 로직
-    approver_suffix = ""
+    # 승인 담당자 접미사: 매칭 단계에서 OCS 행마다 계산해 둔 값을 사용 (없으면 라우팅 조회표에서 찾음)
     clean_doctor_name = doctor_name.strip()
-    
-    if clean_doctor_name == '백승학':
-        approver_suffix = ' -> 승인 : 김성현'
-    elif clean_doctor_name == '임원희':
-        approver_suffix = ' -> 승인 : 문찬연'
-    elif clean_doctor_name == '이신재':
-        approver_suffix = ' -> 승인 : 이상민'
-    elif clean_doctor_name == '안석준':
-        approver_suffix = ' -> 승인 : 이상민'
-    elif clean_doctor_name == '양일형':
-        approver_suffix = ' -> 승인 : 이소윤'
-    elif clean_doctor_name == '안정섭':
-        approver_suffix = ' -> 승인 : 문찬연'
-    elif clean_doctor_name == '김동학':
-        approver_suffix = ' -> 참조 : 임영준'
-    elif clean_doctor_name == '김상헌':
-        approver_suffix = ' -> 참조 : 권호범'
-    elif clean_doctor_name == '송창열':
-        approver_suffix = ' -> 참조 : 곽재영'
-    elif clean_doctor_name == '차채령':
-        approver_suffix = ' -> 참조 : 여인성'
-    elif clean_doctor_name == '최병훈':
-        approver_suffix = ' -> 참조 : 김성균'
-    elif clean_doctor_name == '김형준':
-        approver_suffix = ' -> 참조 : 곽재영'
-    elif clean_doctor_name == '박광일':
-        approver_suffix = ' -> 참조 : 박지만'
-    elif clean_doctor_name == '안세홍':
-        approver_suffix = ' -> 참조 : 김명주'
-    elif clean_doctor_name == '이가영':
-        approver_suffix = ' -> 참조 : 윤형인'
-    elif clean_doctor_name == '이지훈':
-        approver_suffix = ' -> 참조 : 조준호'
+    if approver_suffix is None:
+        approver_suffix = get_approver_lookup().get(clean_doctor_name, "")
+
     # 1. 제목 포맷팅: 시간(HHMM)만 표시
     # 예: ❓내원 : 1400 홍길동 (교정과, 백승학) -> 승인 : 손승현
     time_hhmm = event_start.strftime("%H%M")
@@ -121,7 +113,7 @@ def create_calendar_event(service, patient_name, pid, department, reservation_da
     
     description_text = f"{header_info}\n\n환자명 : {patient_name}\n진료번호 : {pid}\n진료내역 : {treatment_details}\n진료의사 : {clean_doctor_name}\n"
 
-    event = {
+    return {
         'summary': summary_text,
         'location': pid,
         'description': description_text,
@@ -135,8 +127,17 @@ def create_calendar_event(service, patient_name, pid, department, reservation_da
         },
     }
 
+def create_calendar_event(service, patient_name, pid, department, reservation_datetime, doctor_name, treatment_details, is_daily, user_name="", user_number="", approver_suffix=None, calendar_account=None):
+    """
+    Google Calendar에 단일 이벤트를 생성합니다.
+    calendar_account(사용자 키)별로 속도 제한을 적용하며, 일시적 오류는 백오프 후 재시도합니다.
+    """
+    event = build_calendar_event(
+        patient_name, pid, department, reservation_datetime, doctor_name, treatment_details, is_daily,
+        user_name=user_name, user_number=user_number, approver_suffix=approver_suffix
+    )
     try:
-        service.events().insert(calendarId='primary', body=event).execute()
+        rate_limiter.call_with_backoff('calendar', calendar_account, service.events().insert(calendarId='primary', body=event).execute)
         return True
     except HttpError as error:
         st.error(f"캘린더 이벤트 생성 중 오류 발생: {error}")
@@ -144,12 +145,32 @@ def create_calendar_event(service, patient_name, pid, department, reservation_da
     except Exception as e:
         st.error(f"알 수 없는 오류 발생: {e}")
         return False
+
+def load_calendar_service(safe_key):
+    """
+    사용자의 저장된 Google 인증 정보로 Calendar 서비스를 만듭니다. (만료된 토큰은 갱신 후 저장)
+    연동되지 않았거나 유효하지 않으면 None을 반환합니다.
+    """
+    creds = load_google_creds_from_firebase(safe_key)
+    
+    # 💡 [핵심 추가] 만료된 토큰 자동 갱신
+    if creds and creds.expired and creds.refresh_token:
+        try:
+            creds.refresh(Request())
+            save_google_creds_to_firebase(safe_key, creds)
+        except Exception: return None # 갱신 실패 = 재연동 필요
+        
+    if creds and creds.valid and not creds.expired:
+        return build('calendar', 'v3', credentials=creds)
+    return None
         
 # --- 매칭 로직 ---
 
 def standardize_df_for_matching(df):
     """Excel DataFrame의 핵심 컬럼을 매칭을 위해 표준화합니다."""
     df = df.copy()
+    # 수집 단계에서 계산해 둔 정수 PID 키는 문자열 변환 전에 따로 보관합니다.
+    pid_keys = df.pop(PID_KEY_COLUMN) if PID_KEY_COLUMN in df.columns else None
     
     df.columns = [str(col).strip() for col in df.columns]
     current_cols = df.columns
@@ -167,6 +188,7 @@ def standardize_df_for_matching(df):
 
         df.columns = new_header
         df = df[1:].reset_index(drop=True)
+        pid_keys = None # 헤더가 바뀌었으므로 PID 키를 다시 계산
         current_cols = df.columns
         df.columns = [str(col).strip() for col in df.columns]
     
@@ -174,7 +196,9 @@ def standardize_df_for_matching(df):
          return pd.DataFrame(columns=required_cols) 
 
     df = df.fillna("").astype(str)
-    df['진료번호'] = df['진료번호'].str.strip().str.zfill(8)
+    if pid_keys is not None: df[PID_KEY_COLUMN] = pid_keys
+    else: add_pid_key_column(df)
+    df['진료번호'] = df['진료번호'].str.strip().str.zfill(8) # 표시용 (매칭은 정수 PID 키로 비교)
     df['환자명'] = df['환자명'].str.strip()
         
     if '예약의사' in df.columns:
@@ -182,69 +206,126 @@ def standardize_df_for_matching(df):
         df['예약의사'] = df['예약의사'].str.replace("'", "", regex=False).str.replace("‘", "", regex=False).str.replace("’", "", regex=False).str.strip()
 
     df = df[df['진료번호'] != '']
-    final_cols = list(set(df.columns) & set(['예약일시', '예약시간', '진료번호', '환자명', '예약의사', '진료내역', '등록과']))
+    final_cols = list(set(df.columns) & set(['예약일시', '예약시간', '진료번호', '환자명', '예약의사', '진료내역', '등록과', PID_KEY_COLUMN]))
     return df[[col for col in final_cols if col in df.columns]].reset_index(drop=True)
 
 
-def get_matching_data(excel_data_dfs, all_users_meta, all_patients_data, all_doctors_meta):
+def _find_sheet_department(sheet_name_excel_raw):
+    """매칭용 시트 진료과 판별 (키워드 매핑 순서상 첫 일치)"""
+    for keyword, department_name in SHEET_KEYWORD_TO_DEPARTMENT_MAP.items():
+        if keyword.lower() in sheet_name_excel_raw.strip().lower(): return department_name
+    return None
+
+
+def _build_patient_row_index(df_sheet):
+    """(환자명, 정수 PID 키) → 시트 내 첫 행 위치 dict를 만듭니다. (학생별 매칭을 행 순회 없이 조회)"""
+    row_index = {}
+    if PID_KEY_COLUMN not in df_sheet.columns: return row_index
+    for pos, (patient_name, pid) in enumerate(zip(df_sheet['환자명'].tolist(), df_sheet[PID_KEY_COLUMN].tolist())):
+        if pd.isna(pid): continue
+        row_index.setdefault((patient_name, int(pid)), pos)
+    return row_index
+
+
+def _standardize_excel_dfs(excel_data_dfs):
     """
-    Excel 데이터와 Firebase 사용자/환자/의사 데이터를 매칭합니다.
+    시트별 DataFrame을 표준화하고 시트 진료과, 환자 행 인덱스, 메일/캘린더용 파생 컬럼(날짜, 승인 담당자)을 한 번만 계산해 둡니다.
+    반환 형식: {시트명: (표준화 DataFrame, 시트 진료과, (환자명, PID 키) → 행 위치)}
+    """
+    approver_lookup = get_approver_lookup()
+    standardized_dfs = {}
+    for sheet_name, df in excel_data_dfs.items():
+        df_sheet = add_approver_suffix_column(add_render_columns(standardize_df_for_matching(df)), approver_lookup)
+        standardized_dfs[sheet_name] = (df_sheet, _find_sheet_department(sheet_name), _build_patient_row_index(df_sheet))
+    return standardized_dfs
+
+
+# 같은 예약으로 보는 기준 컬럼 / 중복을 합칠 때 값을 이어 붙이는 컬럼
+APPOINTMENT_KEY_COLUMNS = [PID_KEY_COLUMN, '예약일시', '예약시간', '예약의사']
+APPOINTMENT_MERGE_COLUMNS = ['시트', '등록과']
+
+def _merge_labels(values):
+    """'보철, 치주' 형식 값들을 순서를 유지하며 중복 없이 합칩니다."""
+    merged = []
+    for value in values:
+        for label in str(value).split(", "):
+            if label and label not in merged: merged.append(label)
+    return ", ".join(merged)
+
+def deduplicate_appointments(df_matched):
+    """
+    여러 시트에서 매칭된 같은 예약(PID, 예약일시, 예약시간, 예약의사)을 한 행으로 합칩니다.
+    (PATIENT_DEPT_TO_SHEET_MAP으로 보철/치주/외과 환자가 임플란트/원스톱 시트에서도 매칭되는 경우)
+    첫 행을 남기고 시트/등록과 값은 이어 붙입니다. 반환값: (합친 DataFrame, 제거된 중복 행 수)
     """
-    matched_users = []; matched_doctors_data = []
+    if df_matched.empty or not all(col in df_matched.columns for col in APPOINTMENT_KEY_COLUMNS):
+        return df_matched, 0
+    df = df_matched.reset_index(drop=True)
+    # PID 키가 없는 행(NA)은 서로 다른 예약으로 취급합니다.
+    group_ids = df.groupby(APPOINTMENT_KEY_COLUMNS, sort=False).ngroup()
+    group_ids = group_ids.where(group_ids >= 0, -1 - pd.Series(range(len(df)), index=df.index))
+    is_first = ~group_ids.duplicated()
+    if is_first.all():
+        return df_matched, 0
 
-    standardized_dfs = {
-        sheet_name: standardize_df_for_matching(df)
-        for sheet_name, df in excel_data_dfs.items()
+    deduped = df[is_first].copy()
+    for col in APPOINTMENT_MERGE_COLUMNS:
+        if col in df.columns:
+            deduped[col] = group_ids[is_first].map(df[col].groupby(group_ids).agg(_merge_labels))
+    return deduped.reset_index(drop=True), len(df) - len(deduped)
+
+
+def _match_single_user(uid_safe, registered_patients_for_this_user, all_users_meta, standardized_dfs):
+    """한 학생의 등록 환자 목록을 OCS 시트와 매칭합니다. 매칭이 없으면 None을 반환합니다."""
+    user_email = recover_email(uid_safe); user_display_name = user_email
+    user_number = "" 
+
+    if all_users_meta and uid_safe in all_users_meta:
+        meta = all_users_meta[uid_safe]
+        if "name" in meta: user_display_name = meta["name"]
+        if "email" in meta: user_email = meta["email"]
+        if "number" in meta: user_number = str(meta["number"])
+    
+    registered_patients_data = []
+    if registered_patients_for_this_user:
+        patient_items = list(registered_patients_for_this_user.items())
+        # 등록 환자 PID 키는 사용자 단위로 한 번에 정수 키로 정규화합니다.
+        for pid, (pid_key, val) in zip(canonicalize_pids(pid_key for pid_key, _ in patient_items), patient_items): 
+            if pid is None or not isinstance(val, dict): continue
+            registered_patients_data.append({"환자명": val.get("환자이름", "").strip(), "PID": pid, "등록과_mask": dept_codes.patient_mask(val)})
+    
+    # 시트별로 '이 시트를 찾는 등록 진료과' bitmask를 한 번만 구해 두고, 환자마다 AND 한 번으로 판별합니다.
+    sheet_masks = [
+        (sheet_name_excel_raw, df_sheet, row_index, dept_codes.sheet_search_mask(excel_sheet_department))
+        for sheet_name_excel_raw, (df_sheet, excel_sheet_department, row_index) in standardized_dfs.items()
+    ]
+    matched_rows_for_user = []
+    for registered_patient in registered_patients_data:
+        registered_mask = registered_patient["등록과_mask"]
+        match_key = (registered_patient["환자명"], registered_patient["PID"])
+
+        for sheet_name_excel_raw, df_sheet, row_index, sheet_mask in sheet_masks: 
+            if registered_mask & sheet_mask and match_key in row_index:
+                matched_row_copy = df_sheet.iloc[row_index[match_key]].copy(); matched_row_copy["시트"] = sheet_name_excel_raw
+                matched_row_copy["등록과"] = ", ".join(dept_codes.decode_mask(registered_mask)); matched_rows_for_user.append(matched_row_copy)
+    
+    if not matched_rows_for_user:
+        return None
+
+    matched_df, merged_rows = deduplicate_appointments(pd.DataFrame(matched_rows_for_user))
+    return {
+        "email": user_email, 
+        "name": user_display_name, 
+        "number": user_number, 
+        "data": matched_df, 
+        "merged_rows": merged_rows,
+        "safe_key": uid_safe
     }
 
-    # 1. 학생 매칭
-    if all_patients_data:
-        for uid_safe, registered_patients_for_this_user in all_patients_data.items():
-            user_email = recover_email(uid_safe); user_display_name = user_email
-            user_number = "" 
-
-            if all_users_meta and uid_safe in all_users_meta:
-                meta = all_users_meta[uid_safe]
-                if "name" in meta: user_display_name = meta["name"]
-                if "email" in meta: user_email = meta["email"]
-                if "number" in meta: user_number = str(meta["number"])
-            
-            registered_patients_data = []
-            if registered_patients_for_this_user:
-                for pid_key, val in registered_patients_for_this_user.items(): 
-                    registered_depts = [
-                        dept.capitalize() for dept in PATIENT_DEPT_FLAGS + ['치주'] 
-                        if val.get(dept.lower()) is True or val.get(dept.lower()) == 'True' or val.get(dept.lower()) == 'true'
-                    ]
-                    registered_patients_data.append({"환자명": val.get("환자이름", "").strip(), "진료번호": pid_key.strip().zfill(8), "등록과_리스트": registered_depts})
-            
-            matched_rows_for_user = []
-            for registered_patient in registered_patients_data:
-                registered_depts = registered_patient["등록과_리스트"]; sheets_to_search = set()
-                for dept in registered_depts: sheets_to_search.update(PATIENT_DEPT_TO_SHEET_MAP.get(dept, [dept]))
-
-                for sheet_name_excel_raw, df_sheet in standardized_dfs.items(): 
-                    excel_sheet_department = None
-                    for keyword, department_name in SHEET_KEYWORD_TO_DEPARTMENT_MAP.items():
-                        if keyword.lower() in sheet_name_excel_raw.strip().lower(): excel_sheet_department = department_name; break
-                    
-                    if excel_sheet_department in sheets_to_search:
-                        for _, excel_row in df_sheet.iterrows():
-                            if (registered_patient["환자명"] == excel_row.get("환자명", "") and registered_patient["진료번호"] == excel_row.get("진료번호", "")):
-                                matched_row_copy = excel_row.copy(); matched_row_copy["시트"] = sheet_name_excel_raw
-                                matched_row_copy["등록과"] = ", ".join(registered_depts); matched_rows_for_user.append(matched_row_copy); break
-            
-            if matched_rows_for_user:
-                combined_matched_df = pd.DataFrame(matched_rows_for_user)
-                matched_users.append({
-                    "email": user_email, 
-                    "name": user_display_name, 
-                    "number": user_number, 
-                    "data": combined_matched_df, 
-                    "safe_key": uid_safe
-                })
 
-    # 2. 치과의사 매칭
+def _match_doctors(all_doctors_meta, standardized_dfs):
+    """치과의사 계정별로 본인이 예약의사인 OCS 행을 매칭합니다."""
+    matched_doctors_data = []
     doctors = []
     if all_doctors_meta:
         for safe_key, user_info in all_doctors_meta.items():
@@ -261,220 +342,292 @@ def get_matching_data(excel_data_dfs, all_users_meta, all_patients_data, all_doc
     if doctors and standardized_dfs:
         for res in doctors:
             doctor_dept = res['department']; sheets_to_search = PATIENT_DEPT_TO_SHEET_MAP.get(doctor_dept, [doctor_dept])
-            matched_rows_for_doctor = [] 
+            matched_frames_for_doctor = [] 
             
-            for sheet_name_excel_raw, df_sheet in standardized_dfs.items(): 
-                excel_sheet_department = None
-                for keyword, department_name in SHEET_KEYWORD_TO_DEPARTMENT_MAP.items():
-                    if keyword.lower() in sheet_name_excel_raw.strip().lower(): excel_sheet_department = department_name; break
-                
-                if excel_sheet_department in sheets_to_search:
-                    for _, excel_row in df_sheet.iterrows():
-                        if excel_row.get('예약의사', '') == res['name']:
-                            matched_rows_for_doctor.append(excel_row.copy())
+            for sheet_name_excel_raw, (df_sheet, excel_sheet_department, _) in standardized_dfs.items(): 
+                if excel_sheet_department in sheets_to_search and '예약의사' in df_sheet.columns:
+                    doctor_rows = df_sheet[df_sheet['예약의사'] == res['name']]
+                    if not doctor_rows.empty: matched_frames_for_doctor.append(doctor_rows.assign(시트=sheet_name_excel_raw))
             
-            if matched_rows_for_doctor:
-                 res['data'] = pd.DataFrame(matched_rows_for_doctor) 
+            if matched_frames_for_doctor:
+                 res['data'], res['merged_rows'] = deduplicate_appointments(pd.concat(matched_frames_for_doctor))
                  matched_doctors_data.append(res)
                  
-    return matched_users, matched_doctors_data
+    return matched_doctors_data
 
-# --- 자동 알림 실행 ---
-def run_auto_notifications(matched_users, matched_doctors, excel_data_dfs, file_name, is_daily, db_ref):
+
+def create_match_state(excel_data_dfs, all_users_meta, all_patients_data, all_doctors_meta):
     """
-    자동으로 모든 매칭 사용자에게 메일(표+텍스트) 및 캘린더 일정을 전송하는 핵심 로직
+    현재 OCS 파일에 대한 매칭 결과를 증분 갱신이 가능한 상태(dict)로 만듭니다.
+    관리자 세션에 보관해 두고 apply_registration_deltas()로 변경분만 반영합니다.
     """
-    sender = st.secrets["gmail"]["sender"]; sender_pw = st.secrets["gmail"]["app_password"]
-    
-    # --- [핵심] 텍스트 생성 헬퍼 함수 ---
-    def generate_email_body_with_text(user_name, user_number, df_matched, file_name):
-        # 1. HTML Table 생성
-        email_cols = ['환자명', '진료번호', '예약의사', '진료내역', '예약일시', '예약시간', '등록과']
-        df_for_mail = df_matched[[col for col in email_cols if col in df_matched.columns]]
-        
-        table_style = """
-        <style>
-        table {width: 100%; border-collapse: collapse; font-family: Arial, sans-serif; font-size: 14px;}
-        th, td {border: 1px solid #dddddd; text-align: left; padding: 8px;}
-        th {background-color: #f2f2f2; font-weight: bold;}
-        </style>
-        """
-        html_table = df_for_mail.to_html(index=False, escape=False)
-        
-        # 2. 텍스트 데이터 생성
-        text_lines = []
-        u_num = str(user_number).strip()
-        u_name = str(user_name).strip()
-
-        for _, row in df_matched.iterrows():
-            try:
-                # 데이터 추출
-                raw_date = str(row.get('예약일시', '')).strip().replace('-', '/').replace('.', '/')
-                raw_time = str(row.get('예약시간', '')).strip()
-                doctor = str(row.get('예약의사', '')).strip()
-                name = str(row.get('환자명', '')).strip()
-                pid = str(row.get('진료번호', '')).strip()
-
-                # [수정] 승인 담당자 매핑 로직 (이메일 텍스트용)
-                approver_suffix = ""
-                clean_doctor = doctor.strip()
-                
-                if clean_doctor == '백승학':
-                    approver_suffix = ' -> 승인 : 김성현'
-                elif clean_doctor == '임원희':
-                    approver_suffix = ' -> 승인 : 문찬연'
-                elif clean_doctor == '이신재':
-                    approver_suffix = ' -> 승인 : 이상민'
-                elif clean_doctor == '안석준':
-                    approver_suffix = ' -> 승인 : 이상민'
-                elif clean_doctor == '양일형':
-                    approver_suffix = ' -> 승인 : 이소윤'
-                elif clean_doctor == '안정섭':
-                    approver_suffix = ' -> 승인 : 문찬연'
-                elif clean_doctor == '김동학':
-                    approver_suffix = ' -> 참조 : 임영준'
-                elif clean_doctor == '김상헌':
-                    approver_suffix = ' -> 참조 : 권호범'
-                elif clean_doctor == '송창열':
-                    approver_suffix = ' -> 참조 : 곽재영'
-                elif clean_doctor == '차채령':
-                    approver_suffix = ' -> 참조 : 여인성'
-                elif clean_doctor == '최병훈':
-                    approver_suffix = ' -> 참조 : 김성균'
-                elif clean_doctor == '김형준':
-                    approver_suffix = ' -> 참조 : 곽재영'
-                elif clean_doctor == '박광일':
-                    approver_suffix = ' -> 참조 : 박지만'
-                elif clean_doctor == '안세홍':
-                    approver_suffix = ' -> 참조 : 김명주'
-                elif clean_doctor == '이가영':
-                    approver_suffix = ' -> 참조 : 윤형인'
-                elif clean_doctor == '이지훈':
-                    approver_suffix = ' -> 참조 : 조준호'
-                
-                # 날짜/시간 포맷팅 (MMDD, HHMM)
-                date_digits = re.sub(r'[^0-9]', '', raw_date)
-                mmdd = date_digits[-4:] if len(date_digits) >= 4 else "0000"
-                
-                time_digits = re.sub(r'[^0-9]', '', raw_time)
-                hhmm = time_digits.zfill(4) if len(time_digits) <= 4 else time_digits[:4]
-                
-                # [수정] 라인 생성: 맨 끝에 화살표와 함께 승인담당자 추가
-                # 형식: 진료의사,날짜,시간,환자이름,환자번호,사용자번호,사용자이름 -> 승인 : 담당자
-                line = f"{clean_doctor},{mmdd},{hhmm},{name},{pid},{u_num},{u_name}"
-                text_lines.append(line)
-            except Exception:
-                continue 
-            
-        formatted_text_html = "<br>".join(text_lines)
-        
-        # 3. 최종 본문 결합
-        full_body = f"""
-        <p>안녕하세요, {user_name}님.</p>
-        <p>{file_name} 분석 결과, 내원 예정인 환자 진료 정보입니다.</p>
-        <div class='table-container'>{table_style}{html_table}</div>
-        <br>
-        <br>
-        <div style='font-family: sans-serif; font-size: 14px; line-height: 1.6; color: #333;'>
-        {formatted_text_html}
-        </div>
-        <br>
-        <br>
-        <p>확인 부탁드립니다.</p>
-        """
-        return full_body, df_for_mail.to_dict('records')
-
-    # 1. 학생(일반 사용자) 자동 전송
-    st.markdown("### 📚 학생(일반 사용자) 자동 전송 결과")
-    if matched_users:
-        for user_match_info in matched_users:
-            real_email = user_match_info['email']; df_matched = user_match_info['data']
-            user_name = user_match_info['name']; user_safe_key = user_match_info['safe_key']
-            user_number = user_match_info.get('number', '') 
-            
-            # 본문 생성 (번호 포함)
-            email_body, rows_as_dict = generate_email_body_with_text(user_name, user_number, df_matched, file_name)
-            
-            try:
-                send_email(receiver=real_email, rows=rows_as_dict, sender=sender, password=sender_pw, custom_message=email_body, date_str=file_name) 
-                st.write(f"✔️ **메일:** {user_name} ({real_email})에게 전송 완료.")
-            except Exception as e: st.error(f"❌ **메일:** {user_name} ({real_email})에게 전송 실패: {e}")
+    standardized_dfs = _standardize_excel_dfs(excel_data_dfs)
+    all_patients_data = all_patients_data or {}
 
-            # 캘린더 등록
-            creds = load_google_creds_from_firebase(user_safe_key)
-            
-            # 💡 [핵심 추가] 만료된 토큰 자동 갱신
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                    save_google_creds_to_firebase(user_safe_key, creds)
-                except: pass
-                
-            if creds and creds.valid and not creds.expired:
-                try:
-                    service = build('calendar', 'v3', credentials=creds)
-                    for _, row in df_matched.iterrows():
-                        reservation_date_raw = str(row.get('예약일시', '')).strip().replace('-', '/').replace('.', '/')
-                        reservation_time_raw = str(row.get('예약시간', '')).strip()
-                        if reservation_date_raw and reservation_time_raw:
-                            try:
-                                full_datetime_str = f"{reservation_date_raw} {reservation_time_raw}"
-                                reservation_datetime = datetime.datetime.strptime(full_datetime_str, '%Y/%m/%d %H:%M')
-                                
-                                create_calendar_event(
-                                    service, row.get('환자명', 'N/A'), row.get('진료번호', ''), row.get('등록과', ''), 
-                                    reservation_datetime, row.get('예약의사', ''), row.get('진료내역', ''), is_daily,
-                                    user_name=user_name, user_number=user_number
-                                )
-                            except: pass
-                    st.write(f"✔️ **캘린더:** {user_name}에게 일정 추가 완료.")
-                except Exception as e: st.warning(f"⚠️ **캘린더:** {user_name} 일정 추가 중 오류: {e}")
-            else: st.warning(f"⚠️ **캘린더:** {user_name}님은 Google Calendar 계정이 연동되지 않았습니다.")
-    else: st.info("매칭된 학생(사용자)이 없습니다.")
-
-    # 2. 치과의사 자동 전송
-    st.markdown("### 🧑‍⚕️ 치과의사 자동 전송 결과")
-    if matched_doctors:
-        for res in matched_doctors:
-            df_matched = res['data']
-            doc_name = res['name']
-            doc_number = res.get('number', '')
-
-            # 본문 생성 (번호 포함)
-            email_body, rows_as_dict = generate_email_body_with_text(doc_name, doc_number, df_matched, file_name)
-            
-            try:
-                send_email(receiver=res['email'], rows=rows_as_dict, sender=sender, password=sender_pw, custom_message=email_body, date_str=file_name)
-                st.write(f"✔️ **메일:** Dr. {res['name']}에게 전송 완료!")
-            except Exception as e: st.error(f"❌ **메일:** Dr. {res['name']}에게 전송 실패: {e}")
+    user_matches = {}
+    for uid_safe, registered_patients_for_this_user in all_patients_data.items():
+        user_matches[uid_safe] = _match_single_user(uid_safe, registered_patients_for_this_user, all_users_meta, standardized_dfs)
 
-            creds = load_google_creds_from_firebase(res['safe_key'])
-            
-            # 💡 [핵심 추가] 만료된 토큰 자동 갱신
-            if creds and creds.expired and creds.refresh_token:
+    return {
+        "standardized_dfs": standardized_dfs,
+        "patients_snapshot": all_patients_data,
+        "doctors_snapshot": all_doctors_meta,
+        "user_matches": user_matches,
+        "matched_doctors": _match_doctors(all_doctors_meta, standardized_dfs),
+    }
+
+
+def apply_registration_deltas(match_state, all_users_meta, all_patients_data, all_doctors_meta):
+    """
+    새 patients/doctor_users 스냅샷과 보관된 스냅샷을 비교해 바뀐 사용자만 다시 매칭합니다.
+    반환값: (다시 매칭한 사용자 키 집합, 등록 상태가 바뀐 PID 집합)
+    """
+    old_patients = match_state["patients_snapshot"]
+    new_patients = all_patients_data or {}
+    changed_users = set(); changed_pids = set()
+
+    for uid_safe in set(old_patients) | set(new_patients):
+        old_user_patients = old_patients.get(uid_safe) or {}
+        new_user_patients = new_patients.get(uid_safe) or {}
+        if old_user_patients == new_user_patients: continue
+
+        changed_users.add(uid_safe)
+        for pid_key in set(old_user_patients) | set(new_user_patients):
+            if old_user_patients.get(pid_key) != new_user_patients.get(pid_key):
+                changed_pids.add(str(pid_key).strip())
+
+        if new_user_patients:
+            match_state["user_matches"][uid_safe] = _match_single_user(uid_safe, new_user_patients, all_users_meta, match_state["standardized_dfs"])
+        else:
+            match_state["user_matches"].pop(uid_safe, None)
+
+    if all_doctors_meta != match_state["doctors_snapshot"]:
+        match_state["matched_doctors"] = _match_doctors(all_doctors_meta, match_state["standardized_dfs"])
+        match_state["doctors_snapshot"] = all_doctors_meta
+
+    match_state["patients_snapshot"] = new_patients
+    return changed_users, changed_pids
+
+
+def get_match_results(match_state):
+    """매칭 상태에서 (매칭된 학생 목록, 매칭된 치과의사 목록)을 꺼냅니다."""
+    matched_users = [match for match in match_state["user_matches"].values() if match]
+    return matched_users, match_state["matched_doctors"]
+
+
+def get_matching_data(excel_data_dfs, all_users_meta, all_patients_data, all_doctors_meta):
+    """
+    Excel 데이터와 Firebase 사용자/환자/의사 데이터를 매칭합니다.
+    """
+    match_state = create_match_state(excel_data_dfs, all_users_meta, all_patients_data, all_doctors_meta)
+    return get_match_results(match_state)
+
+# --- 자동 알림: 전송 계획 ---
+def parse_reservation_datetimes(df):
+    """예약일시/예약시간 컬럼을 벡터 연산으로 datetime Series로 변환합니다. (형식 오류/빈 값은 NaT)"""
+    if df.empty or '예약일시' not in df.columns or '예약시간' not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    date_raw = df['예약일시'].astype(str).str.strip().str.replace(r'[-.]', '/', regex=True)
+    time_raw = df['예약시간'].astype(str).str.strip()
+    reservation_datetimes = pd.to_datetime(date_raw + " " + time_raw, format='%Y/%m/%d %H:%M', errors='coerce')
+    return reservation_datetimes.where((date_raw != '') & (time_raw != ''))
+
+
+def _build_recipient_plan(kind, match_info, email_intro, file_name, is_daily, sender, department=None):
+    """수신자 한 명의 메일 메시지와 캘린더 이벤트 본문을 모두 만듭니다."""
+    df_matched = match_info['data']
+    name = match_info['name']; number = match_info.get('number', '')
+
+    # 본문 생성 (번호 포함)
+    email_body, _ = render_notification_email(name, number, df_matched, email_intro)
+    subject = f"[치과 내원 알림] {file_name} 예약 내역"
+    email_raw = build_email_message(match_info['email'], sender, email_body, subject).as_string()
+
+    reservation_datetimes = parse_reservation_datetimes(df_matched)
+    events = []
+    for row, reservation_datetime in zip(df_matched.to_dict('records'), reservation_datetimes.tolist()):
+        if pd.isna(reservation_datetime): continue
+        events.append(build_calendar_event(
+            row.get('환자명', 'N/A'), row.get('진료번호', ''), department if department is not None else row.get('등록과', ''),
+            reservation_datetime.to_pydatetime(), row.get('예약의사', ''), row.get('진료내역', ''), is_daily,
+            user_name=name, user_number=number, approver_suffix=row.get('_approver_suffix')
+        ))
+
+    return {
+        "kind": kind,
+        "safe_key": match_info['safe_key'],
+        "name": name,
+        "email": match_info['email'],
+        "subject": subject,
+        "email_raw": email_raw,
+        "events": events,
+        "skipped_rows": len(df_matched) - len(events), # 예약일시/시간 형식 오류로 캘린더에서 제외된 행
+    }
+
+
+def build_dispatch_plan(matched_users, matched_doctors, file_name, is_daily, sender, upload_id=None):
+    """
+    자동 전송할 모든 메일 메시지와 캘린더 이벤트를 네트워크 호출 없이 미리 만듭니다.
+    upload_id: 업로드 내용 해시 (ocs_cache.compute_upload_cache_id) — 전송 기록(outbox) ID에 사용
+    반환 형식: {'items': [수신자별 계획, ...], 'stats': {수신자/메일/일정 수, 메일 크기, 생성 시간}}
+    """
+    started_at = time.perf_counter()
+    email_intro = f"{file_name} 분석 결과, 내원 예정인 환자 진료 정보입니다."
+
+    items = [
+        _build_recipient_plan("학생", user_match_info, email_intro, file_name, is_daily, sender)
+        for user_match_info in (matched_users or [])
+    ] + [
+        _build_recipient_plan("치과의사", res, email_intro, file_name, is_daily, sender, department=res.get('department', 'N/A'))
+        for res in (matched_doctors or [])
+    ]
+
+    stats = {
+        "recipients": len(items),
+        "emails": len(items),
+        "calendar_events": sum(len(item["events"]) for item in items),
+        "skipped_rows": sum(item["skipped_rows"] for item in items),
+        "merged_rows": sum(match_info.get("merged_rows", 0) for match_info in list(matched_users or []) + list(matched_doctors or [])),
+        "email_bytes": sum(len(item["email_raw"].encode('utf-8')) for item in items),
+        "build_seconds": round(time.perf_counter() - started_at, 3),
+    }
+    return {"file_name": file_name, "upload_id": upload_id, "is_daily": is_daily, "items": items, "stats": stats}
+
+
+def summarize_dispatch_plan(plan):
+    """미리보기(dry-run) 표시용: 수신자별 메일 크기와 캘린더 일정 수를 DataFrame으로 만듭니다."""
+    return pd.DataFrame([
+        {
+            "구분": item["kind"], "수신자": item["name"], "이메일": item["email"],
+            "메일 크기(KB)": round(len(item["email_raw"].encode('utf-8')) / 1024, 1),
+            "캘린더 일정": len(item["events"]), "제외된 행": item["skipped_rows"],
+        }
+        for item in plan["items"]
+    ], columns=["구분", "수신자", "이메일", "메일 크기(KB)", "캘린더 일정", "제외된 행"])
+
+
+# --- 자동 알림: 전송 실행 ---
+def execute_dispatch_plan(plan_items, sender, password, report=None, outbox=None):
+    """
+    미리 만든 전송 계획을 실행합니다. SMTP 연결 하나를 모든 메일에 재사용합니다.
+    outbox(dispatch_outbox.open_outbox)가 주어지면 항목마다 상태를 기록하고, 이미 전송된 메일/일정은 건너뜁니다.
+    report(item, channel, ok, detail)가 주어지면 메일/캘린더 처리 결과마다 호출합니다. (channel: 'email' | 'calendar')
+    메일은 발신 계정, 일정은 수신자 계정 단위로 속도 제한을 지키며, 제한/일시적 오류는 백오프 후 재시도합니다.
+    반환값: [{'safe_key', 'kind', 'email_ok', 'calendar_ok', 'events_sent', 'skipped'}, ...]
+    """
+    report = report or (lambda item, channel, ok, detail: None)
+    results = []; smtp_server = None
+
+    def _send_mail(item):
+        nonlocal smtp_server
+        if smtp_server is None: smtp_server = open_smtp_connection(sender, password)
+        try: smtp_server.sendmail(sender, [item["email"]], item["email_raw"].encode('utf-8'))
+        except smtplib.SMTPServerDisconnected:
+            smtp_server = None; raise # 재시도 시 다시 연결
+
+    try:
+        for item in plan_items:
+            result = {"safe_key": item["safe_key"], "kind": item["kind"], "email_ok": False, "calendar_ok": False, "events_sent": 0, "skipped": 0}
+
+            mail_id = dispatch_outbox.email_item_id(item)
+            if dispatch_outbox.is_sent(outbox, mail_id):
+                result["email_ok"] = True; result["skipped"] += 1
+                report(item, "email", True, "이미 전송됨")
+            else:
+                dispatch_outbox.record_statuses(outbox, item, {mail_id: (dispatch_outbox.STATUS_SENDING, None)})
                 try:
-                    creds.refresh(Request())
-                    save_google_creds_to_firebase(res['safe_key'], creds)
-                except: pass
-                
-            if creds and creds.valid and not creds.expired:
+                    rate_limiter.call_with_backoff('smtp', sender, _send_mail, item)
+                    result["email_ok"] = True
+                    dispatch_outbox.record_statuses(outbox, item, {mail_id: (dispatch_outbox.STATUS_SENT, None)})
+                    report(item, "email", True, None)
+                except Exception as e:
+                    dispatch_outbox.record_statuses(outbox, item, {mail_id: (dispatch_outbox.STATUS_FAILED, e)})
+                    report(item, "email", False, e)
+
+            pending_events = [
+                (event_id, event) for event_id, event in
+                ((dispatch_outbox.event_item_id(item, event), event) for event in item["events"])
+                if not dispatch_outbox.is_sent(outbox, event_id)
+            ]
+            result["skipped"] += len(item["events"]) - len(pending_events)
+            if item["events"] and not pending_events:
+                result["calendar_ok"] = True; report(item, "calendar", True, "이미 등록됨")
+                results.append(result); continue
+
+            service = load_calendar_service(item["safe_key"])
+            if service is None:
+                report(item, "calendar", False, None) # 계정 미연동
+            else:
                 try:
-                    service = build('calendar', 'v3', credentials=creds)
-                    for _, row in df_matched.iterrows():
-                        reservation_date_raw = str(row.get('예약일시', '')).strip().replace('-', '/').replace('.', '/')
-                        reservation_time_raw = str(row.get('예약시간', '')).strip()
-                        if reservation_date_raw and reservation_time_raw:
-                            try:
-                                full_datetime_str = f"{reservation_date_raw} {reservation_time_raw}"
-                                reservation_datetime = datetime.datetime.strptime(full_datetime_str, '%Y/%m/%d %H:%M')
-                                
-                                create_calendar_event(
-                                    service, row.get('환자명', 'N/A'), row.get('진료번호', ''), res.get('department', 'N/A'), 
-                                    reservation_datetime, row.get('예약의사', ''), row.get('진료내역', ''), is_daily,
-                                    user_name=doc_name, user_number=doc_number
-                                )
-                            except: pass
-                    st.write(f"✔️ **캘린더:** Dr. {res['name']}에게 일정 추가 완료.")
-                except Exception as e: st.warning(f"⚠️ **캘린더:** Dr. {res['name']} 일정 추가 중 오류: {e}")
-            else: st.warning(f"⚠️ **캘린더:** Dr. {res['name']}님은 Google Calendar 계정이 연동되지 않았습니다.")
-    else: st.info("매칭된 치과의사 계정이 없습니다.")
+                    for event_id, event in pending_events:
+                        # 일정마다 등록 직후 상태를 기록해, 중간에 중단되어도 이미 등록한 일정은 다시 만들지 않습니다.
+                        dispatch_outbox.record_statuses(outbox, item, {event_id: (dispatch_outbox.STATUS_SENDING, None)})
+                        try:
+                            rate_limiter.call_with_backoff('calendar', item["safe_key"], service.events().insert(calendarId='primary', body=event).execute)
+                        except HttpError as error:
+                            dispatch_outbox.record_statuses(outbox, item, {event_id: (dispatch_outbox.STATUS_FAILED, error)}); continue
+                        result["events_sent"] += 1
+                        dispatch_outbox.record_statuses(outbox, item, {event_id: (dispatch_outbox.STATUS_SENT, None)})
+                    failed_count = len(pending_events) - result["events_sent"]
+                    result["calendar_ok"] = failed_count == 0
+                    report(item, "calendar", failed_count == 0, f"{failed_count}/{len(pending_events)}건 일정 생성 실패" if failed_count else None)
+                except Exception as e: report(item, "calendar", False, e)
+            results.append(result)
+    finally:
+        if smtp_server is not None:
+            try: smtp_server.quit()
+            except Exception: pass
+    return results
+
+
+# --- 자동 알림 실행 ---
+def get_sender_credentials():
+    """발신 Gmail 계정 (환경 변수 GMAIL_SENDER/GMAIL_APP_PASSWORD가 있으면 우선, 없으면 Secrets의 [gmail])"""
+    sender = os.environ.get("GMAIL_SENDER"); sender_pw = os.environ.get("GMAIL_APP_PASSWORD")
+    if sender and sender_pw:
+        return sender, sender_pw
+    return st.secrets["gmail"]["sender"], st.secrets["gmail"]["app_password"]
+
+
+def _report_dispatch_to_streamlit(item, channel, ok, detail):
+    """전송 결과를 기존 자동 전송 화면 문구로 출력합니다."""
+    label = item["name"] if item["kind"] == "학생" else f"Dr. {item['name']}"
+    if ok and detail:
+        channel_label = "메일" if channel == "email" else "캘린더"
+        st.write(f"⏭️ **{channel_label}:** {label} - {detail} (건너뜀)")
+    elif channel == "email":
+        if ok: st.write(f"✔️ **메일:** {label} ({item['email']})에게 전송 완료.")
+        else: st.error(f"❌ **메일:** {label} ({item['email']})에게 전송 실패: {detail}")
+    elif ok: st.write(f"✔️ **캘린더:** {label}에게 일정 추가 완료.")
+    elif detail is None: st.warning(f"⚠️ **캘린더:** {label}님은 Google Calendar 계정이 연동되지 않았습니다.")
+    else: st.warning(f"⚠️ **캘린더:** {label} 일정 추가 중 오류: {detail}")
+
+
+def run_auto_notifications(matched_users, matched_doctors, excel_data_dfs, file_name, is_daily, db_ref, dry_run=False, upload_id=None):
+    """
+    자동으로 모든 매칭 사용자에게 메일(표+텍스트) 및 캘린더 일정을 전송하는 핵심 로직
+    1) 전송 계획(메일/일정 본문)을 모두 만든 뒤 2) 계획을 실행합니다. dry_run=True면 계획만 반환합니다.
+    전송 상태는 outbox에 기록되므로, 중단 후 다시 실행하면 이미 보낸 메일/일정은 건너뜁니다.
+    """
+    sender, sender_pw = get_sender_credentials()
+    plan = build_dispatch_plan(matched_users, matched_doctors, file_name, is_daily, sender, upload_id=upload_id)
+    if dry_run:
+        return plan
+    outbox = dispatch_outbox.open_outbox(db_ref, upload_id, file_name, is_daily)
+
+    sections = [
+        ("학생", "### 📚 학생(일반 사용자) 자동 전송 결과", "매칭된 학생(사용자)이 없습니다."),
+        ("치과의사", "### 🧑‍⚕️ 치과의사 자동 전송 결과", "매칭된 치과의사 계정이 없습니다."),
+    ]
+    for kind, header, empty_message in sections:
+        st.markdown(header)
+        section_items = [item for item in plan["items"] if item["kind"] == kind]
+        if section_items: execute_dispatch_plan(section_items, sender, sender_pw, report=_report_dispatch_to_streamlit, outbox=outbox)
+        else: st.info(empty_message)
+
+    throughput = rate_limiter.get_throughput()
+    st.caption(
+        f"📈 최근 1분 처리량 - 메일 {throughput['smtp']['per_minute']}건 (재시도 {throughput['smtp']['retries']}회), "
+        f"캘린더 {throughput['calendar']['per_minute']}건 (재시도 {throughput['calendar']['retries']}회)"
+    )
+    return plan
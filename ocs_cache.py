@@ -0,0 +1,162 @@
+# ocs_cache.py
+
+import streamlit as st
+import pyarrow as pa
+import datetime
+import io
+import hashlib
+import json
+import os
+import shutil
+from cryptography.fernet import Fernet, InvalidToken
+
+import upload_io
+from config import OCS_CACHE_DIR, OCS_CACHE_MAX_ENTRIES
+
+# 처리된 OCS 업로드를 시트별 Arrow(IPC) 파일로 디스크에 보관합니다.
+# 환자 정보가 포함되므로 모든 데이터 파일은 Fernet으로 암호화하며,
+# Secrets.toml에 [ocs_cache] key가 없으면 캐시를 사용하지 않습니다.
+# 디렉터리 구조: OCS_CACHE_DIR/{cache_id}/manifest.json, sheet_0.arrow.enc, ..., styled.xlsx.enc
+# styled.xlsx.enc는 원본을 upload_io.CHUNK_SIZE 단위로 나눠 암호화한 토큰을 줄바꿈으로 이어 씁니다. (전체 암호문 복사본을 만들지 않음)
+
+MANIFEST_FILE = "manifest.json"
+STYLED_FILE = "styled.xlsx.enc"
+
+# --- 1. 암호화 키 / 캐시 ID ---
+def _get_fernet():
+    """Secrets의 [ocs_cache] key로 Fernet 객체를 만듭니다. 키가 없으면 None."""
+    try:
+        cache_key = st.secrets.get("ocs_cache", {}).get("key")
+    except Exception:
+        cache_key = None
+    return Fernet(cache_key) if cache_key else None
+
+def is_cache_enabled():
+    """암호화 키가 설정되어 캐시를 사용할 수 있는지 확인합니다."""
+    return _get_fernet() is not None
+
+def compute_upload_cache_id(file_bytes, password=None, variant=None):
+    """
+    업로드 원본(bytes 또는 스트림)과 파일 비밀번호로 캐시 ID를 만듭니다. (비밀번호 없이 캐시를 열 수 없도록 함께 해시)
+    스트림은 나눠 읽어 해시하므로 원본 복사본을 만들지 않습니다.
+    variant를 주면(예: 시트 선별 서명) 같은 파일이라도 처리 방식별로 다른 캐시 항목을 사용합니다.
+    """
+    if hasattr(file_bytes, "read"):
+        digest = hashlib.sha256()
+        for chunk in upload_io.iter_chunks(file_bytes): digest.update(chunk)
+    else:
+        digest = hashlib.sha256(file_bytes)
+    digest.update((password or "").encode("utf-8"))
+    if variant: digest.update(f"|{variant}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+# --- 2. Arrow 직렬화 ---
+def _df_to_arrow_bytes(df):
+    """DataFrame을 Arrow IPC 파일 bytes로 변환합니다. (중복/비문자열 컬럼명은 위치 기반 이름으로 저장)"""
+    positional_df = df.copy(deep=False)
+    positional_df.columns = [f"c{idx}" for idx in range(len(df.columns))]
+    table = pa.Table.from_pandas(positional_df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _arrow_bytes_to_df(arrow_bytes, columns):
+    """복호화된 Arrow IPC bytes를 (복사 없이 버퍼를 직접 읽어) DataFrame으로 복원합니다."""
+    table = pa.ipc.open_file(pa.py_buffer(arrow_bytes)).read_all()
+    df = table.to_pandas()
+    df.columns = columns
+    return df
+
+
+# --- 3. 저장 / 로드 ---
+def save_processed_upload(cache_id, file_name, excel_data_dfs, styled_excel_bytes=None, analysis_results=None):
+    """
+    처리된 업로드(시트별 DataFrame, 스타일링된 엑셀, 분석 결과)를 암호화된 컬럼형 파일로 저장합니다.
+    styled_excel_bytes는 스트림(BytesIO 또는 스타일링 결과 임시 파일)이며 나눠 읽어 암호화합니다.
+    """
+    fernet = _get_fernet()
+    if fernet is None or not excel_data_dfs:
+        return False
+
+    entry_dir = os.path.join(OCS_CACHE_DIR, cache_id)
+    try:
+        os.makedirs(entry_dir, exist_ok=True)
+        sheets = []
+        for idx, (sheet_name, df) in enumerate(excel_data_dfs.items()):
+            data_file = f"sheet_{idx}.arrow.enc"
+            with open(os.path.join(entry_dir, data_file), "wb") as f:
+                f.write(fernet.encrypt(_df_to_arrow_bytes(df)))
+            sheets.append({"name": sheet_name, "file": data_file, "rows": len(df), "columns": [str(col) for col in df.columns]})
+
+        if styled_excel_bytes is not None:
+            with open(os.path.join(entry_dir, STYLED_FILE), "wb") as f:
+                for chunk in upload_io.iter_chunks(styled_excel_bytes):
+                    f.write(fernet.encrypt(chunk) + b"\n")
+
+        manifest = {
+            "cache_id": cache_id,
+            "file_name": file_name,
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "sheets": sheets,
+            "has_styled": styled_excel_bytes is not None,
+            "analysis": analysis_results or {},
+        }
+        # manifest는 마지막에 기록: manifest가 있으면 완전히 저장된 항목으로 간주
+        with open(os.path.join(entry_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    except Exception:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return False
+
+    _prune_old_entries()
+    return True
+
+def load_manifest(cache_id):
+    """캐시 항목의 manifest를 읽습니다. 없으면 None."""
+    manifest_path = os.path.join(OCS_CACHE_DIR, cache_id, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def load_processed_upload(cache_id, sheet_names=None):
+    """
+    캐시된 업로드를 복원합니다. sheet_names를 주면 해당 시트만 읽습니다.
+    반환값: (시트별 DataFrame dict, 스타일링된 엑셀 BytesIO 또는 None, manifest) / 캐시가 없으면 None
+    """
+    fernet = _get_fernet()
+    manifest = load_manifest(cache_id)
+    if fernet is None or manifest is None:
+        return None
+
+    entry_dir = os.path.join(OCS_CACHE_DIR, cache_id)
+    try:
+        excel_data_dfs = {}
+        for sheet in manifest["sheets"]:
+            if sheet_names is not None and sheet["name"] not in sheet_names:
+                continue
+            with open(os.path.join(entry_dir, sheet["file"]), "rb") as f:
+                excel_data_dfs[sheet["name"]] = _arrow_bytes_to_df(fernet.decrypt(f.read()), sheet["columns"])
+
+        styled_excel_bytes = None
+        if manifest.get("has_styled"):
+            with open(os.path.join(entry_dir, STYLED_FILE), "rb") as f:
+                styled_excel_bytes = io.BytesIO(b"".join(fernet.decrypt(token.rstrip(b"\n")) for token in f if token.strip()))
+    except (InvalidToken, OSError, pa.ArrowInvalid):
+        return None
+
+    return excel_data_dfs, styled_excel_bytes, manifest
+
+def list_cached_uploads():
+    """캐시된 업로드 manifest 목록을 최신순으로 반환합니다."""
+    if not os.path.isdir(OCS_CACHE_DIR):
+        return []
+    manifests = [load_manifest(cache_id) for cache_id in os.listdir(OCS_CACHE_DIR)]
+    return sorted([m for m in manifests if m], key=lambda m: m.get("created_at", ""), reverse=True)
+
+def _prune_old_entries():
+    """OCS_CACHE_MAX_ENTRIES를 넘는 오래된 캐시 항목을 삭제합니다."""
+    for manifest in list_cached_uploads()[OCS_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(os.path.join(OCS_CACHE_DIR, manifest["cache_id"]), ignore_errors=True)
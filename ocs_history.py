@@ -0,0 +1,109 @@
+# ocs_history.py
+
+import datetime
+
+# OCS 분석 결과의 날짜별 이력과 주간/월간 누적 집계를 Firebase에 관리합니다.
+# Firebase 구조:
+#   ocs_analysis/history/{YYYY-MM-DD} = {file_name, updated_at, counts: {진료과: {오전, 오후}}}
+#   ocs_analysis/aggregates/weekly/{YYYY-Www}  = {진료과: {오전, 오후, 일수}}
+#   ocs_analysis/aggregates/monthly/{YYYY-MM}  = {진료과: {오전, 오후, 일수}}
+# 같은 날짜에 다시 업로드하면 이전 값과의 차이만 집계에 반영하므로 중복 집계되지 않습니다.
+
+HISTORY_PATH = "ocs_analysis/history"
+AGGREGATES_PATH = "ocs_analysis/aggregates"
+PERIODS = ["오전", "오후"]
+
+# --- 1. 집계 키 ---
+def _period_keys(date_str):
+    """'YYYY-MM-DD' 날짜의 주간(ISO 주차) / 월간 집계 키를 반환합니다."""
+    date = datetime.date.fromisoformat(date_str)
+    iso_year, iso_week, _ = date.isocalendar()
+    return {"weekly": f"{iso_year}-W{iso_week:02d}", "monthly": date.strftime("%Y-%m")}
+
+
+def _compute_delta(old_counts, new_counts):
+    """이전/새 분석 결과의 진료과별 차이(오전/오후/일수)를 계산합니다."""
+    old_counts = old_counts or {}; new_counts = new_counts or {}
+    delta = {}
+    for dept in set(old_counts) | set(new_counts):
+        old_dept = old_counts.get(dept) or {}; new_dept = new_counts.get(dept) or {}
+        dept_delta = {period: int(new_dept.get(period, 0)) - int(old_dept.get(period, 0)) for period in PERIODS}
+        dept_delta["일수"] = int(dept in new_counts) - int(dept in old_counts)
+        if any(dept_delta.values()):
+            delta[dept] = dept_delta
+    return delta
+
+
+# --- 2. 기록 ---
+def record_analysis_run(db_ref_func, date_str, file_name, analysis_results):
+    """
+    분석 결과를 날짜별 이력에 저장하고, 이전 값과의 차이만 주간/월간 집계에 트랜잭션으로 반영합니다.
+    이력 교체와 차이 계산은 이력 노드 하나의 트랜잭션 안에서 하므로, 같은 날짜를 동시에 올려도 차이가 중복/누락되지 않습니다.
+    반환값: 집계에 반영된 진료과별 차이 dict
+    """
+    swapped = {}
+    def _swap_history(current):
+        # 충돌 시 트랜잭션 함수가 다시 호출되므로, 마지막(커밋된) 호출의 차이만 남습니다.
+        swapped["delta"] = _compute_delta((current or {}).get("counts"), analysis_results)
+        return {
+            "file_name": file_name,
+            "updated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "counts": analysis_results,
+        }
+
+    db_ref_func(f"{HISTORY_PATH}/{date_str}").transaction(_swap_history)
+    delta = swapped.get("delta") or {}
+
+    if not delta:
+        return delta
+
+    def _apply_delta(current):
+        current = current or {}
+        for dept, dept_delta in delta.items():
+            dept_totals = current.get(dept) or {}
+            for key, value in dept_delta.items():
+                dept_totals[key] = dept_totals.get(key, 0) + value
+            if dept_totals.get("일수", 0) <= 0:
+                current.pop(dept, None) # 해당 기간에 더 이상 기록이 없는 진료과
+            else:
+                current[dept] = dept_totals
+        return current
+
+    for period_type, period_key in _period_keys(date_str).items():
+        db_ref_func(f"{AGGREGATES_PATH}/{period_type}/{period_key}").transaction(_apply_delta)
+    return delta
+
+
+def publish_analysis(db_ref_func, file_name, analysis_results, date_str=None):
+    """
+    분석 결과를 최신 결과(ocs_analysis/latest_*)로 저장하고 날짜별 이력/집계에 반영합니다.
+    date_str은 파일의 진료 날짜(excel_utils.get_schedule_date)이며, 알 수 없을 때만 오늘 날짜를 씁니다.
+    결과가 비어 있으면 저장하지 않고 False를 반환합니다.
+    """
+    if not analysis_results or not any(analysis_results.values()):
+        return False
+    date_str = date_str or datetime.datetime.now().strftime("%Y-%m-%d")
+    db_ref_func("ocs_analysis/latest_result").set(analysis_results)
+    db_ref_func("ocs_analysis/latest_date").set(date_str)
+    db_ref_func("ocs_analysis/latest_file_name").set(file_name)
+    record_analysis_run(db_ref_func, date_str, file_name, analysis_results)
+    return True
+
+
+# --- 3. 조회 ---
+def load_trend(db_ref_func, period_type="weekly"):
+    """
+    미리 계산된 주간/월간 집계 노드 하나만 읽어 진료과별 추세 행 목록을 만듭니다.
+    반환 형식: [{'기간': '2026-W42', '진료과': '소치', '오전': 12, '오후': 9, '일수': 5, '일평균': 4.2}, ...]
+    """
+    aggregates = db_ref_func(f"{AGGREGATES_PATH}/{period_type}").get() or {}
+    trend_rows = []
+    for period_key in sorted(aggregates):
+        for dept, totals in (aggregates[period_key] or {}).items():
+            days = totals.get("일수", 0) or 1
+            trend_rows.append({
+                "기간": period_key, "진료과": dept,
+                "오전": totals.get("오전", 0), "오후": totals.get("오후", 0), "일수": totals.get("일수", 0),
+                "일평균": round((totals.get("오전", 0) + totals.get("오후", 0)) / days, 1),
+            })
+    return trend_rows
@@ -0,0 +1,110 @@
+# ocs_state_cache.py
+
+import io
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+import ocs_cache
+import upload_io
+from config import OCS_STATE_CACHE_MAX_BYTES
+
+# 처리된 OCS 상태(시트별 DataFrame, 스타일링된 엑셀 bytes, 매칭 상태)를 모든 관리자 세션이 공유하는 서버 캐시
+# - 메모리: 프로세스당 하나(st.cache_resource), 바이트 크기 기준 LRU로 OCS_STATE_CACHE_MAX_BYTES 이하 유지
+# - 디스크: ocs_cache(암호화된 Arrow 파일)를 2차 저장소로 사용 → 같은 호스트의 다른 Streamlit 워커 프로세스도 재사용
+# 세션에는 캐시 ID만 보관하므로 관리자 탭을 여러 개 열어도 메모리 사용량이 늘지 않습니다.
+# 공유 데이터이므로 꺼내 쓴 DataFrame은 수정하지 않고, 매칭 상태 갱신은 항목별 잠금 안에서 합니다.
+
+# --- 1. 프로세스 공유 저장소 ---
+@st.cache_resource
+def _get_store():
+    """프로세스 전역 LRU 저장소 {'lock', 'entries': OrderedDict(cache_id -> 항목), 'total_bytes'}"""
+    return {"lock": threading.Lock(), "entries": OrderedDict(), "total_bytes": 0}
+
+def _estimate_bytes(excel_data_dfs, styled_bytes, match_state=None):
+    """항목의 대략적인 메모리 크기 (DataFrame deep 메모리 + 엑셀 bytes + 매칭용 표준화 DataFrame)"""
+    total = sum(int(df.memory_usage(index=True, deep=True).sum()) for df in excel_data_dfs.values())
+    total += len(styled_bytes or b"")
+    if match_state:
+        total += sum(int(std_df.memory_usage(index=True, deep=True).sum()) for std_df, _, _ in match_state["standardized_dfs"].values())
+    return total
+
+def _evict_if_needed(store):
+    """(잠금 상태에서 호출) 한도를 넘으면 가장 오래 사용하지 않은 항목부터 메모리에서 제거합니다. (디스크 사본은 유지)"""
+    while store["total_bytes"] > OCS_STATE_CACHE_MAX_BYTES and len(store["entries"]) > 1:
+        _, evicted = store["entries"].popitem(last=False)
+        store["total_bytes"] -= evicted["size"]
+
+
+# --- 2. 조회 / 저장 ---
+def get_state(cache_id):
+    """
+    공유 캐시에서 처리된 OCS 상태를 꺼냅니다. 메모리에 없으면 디스크 캐시에서 복원해 메모리에 올립니다.
+    반환 형식: {'file_name', 'dfs', 'styled_bytes', 'analysis', 'match_state', 'lock', 'size'} / 없으면 None
+    디스크에서 복원한 항목은 match_state가 None입니다. (현재 등록 상태로 매칭/재스타일링 필요)
+    """
+    if not cache_id:
+        return None
+    store = _get_store()
+    with store["lock"]:
+        entry = store["entries"].get(cache_id)
+        if entry is not None:
+            store["entries"].move_to_end(cache_id)
+            return entry
+
+    cached_upload = ocs_cache.load_processed_upload(cache_id)
+    if not cached_upload:
+        return None
+    excel_data_dfs, styled_excel_bytes, manifest = cached_upload
+    return put_state(
+        cache_id, manifest.get("file_name", ""), excel_data_dfs,
+        styled_excel_bytes.getvalue() if styled_excel_bytes else None, manifest.get("analysis"), persist=False
+    )
+
+def put_state(cache_id, file_name, excel_data_dfs, styled_bytes, analysis_results, persist=True, match_state=None):
+    """
+    처리된 OCS 상태를 공유 캐시에 넣고(persist=True면 디스크 캐시에도 저장) 항목을 반환합니다.
+    styled_bytes는 bytes 또는 스타일링 결과 임시 파일(스트림)입니다. 스트림이면 디스크 캐시에 나눠 쓴 뒤 한 번만 bytes로 읽고 닫습니다.
+    방금 처리한 파일은 스타일링에 쓴 등록 스냅샷으로 만든 match_state를 함께 넘기면 전체 재스타일링을 건너뜁니다.
+    """
+    if persist:
+        styled_stream = styled_bytes if hasattr(styled_bytes, "read") else _as_bytes_io(styled_bytes)
+        ocs_cache.save_processed_upload(cache_id, file_name, excel_data_dfs, styled_stream, analysis_results)
+    if hasattr(styled_bytes, "read"):
+        styled_bytes = upload_io.read_all(styled_bytes) # 메모리 항목에는 다운로드/재스타일링용 bytes 하나만 보관
+
+    entry = {
+        "file_name": file_name, "dfs": excel_data_dfs, "styled_bytes": styled_bytes, "analysis": analysis_results or {},
+        "match_state": match_state, "lock": threading.Lock(), "size": _estimate_bytes(excel_data_dfs, styled_bytes, match_state),
+    }
+    store = _get_store()
+    with store["lock"]:
+        previous = store["entries"].pop(cache_id, None)
+        if previous is not None: store["total_bytes"] -= previous["size"]
+        store["entries"][cache_id] = entry
+        store["total_bytes"] += entry["size"]
+        _evict_if_needed(store)
+    return entry
+
+def update_entry(cache_id, entry, styled_bytes=None, match_state=None):
+    """(항목 잠금 안에서 호출) 재스타일링된 엑셀/매칭 상태를 반영하고 크기를 다시 계산합니다."""
+    if styled_bytes is not None: entry["styled_bytes"] = styled_bytes
+    if match_state is not None: entry["match_state"] = match_state
+    new_size = _estimate_bytes(entry["dfs"], entry["styled_bytes"], entry["match_state"])
+    store = _get_store()
+    with store["lock"]:
+        if store["entries"].get(cache_id) is entry:
+            store["total_bytes"] += new_size - entry["size"]
+        entry["size"] = new_size
+        _evict_if_needed(store)
+
+def get_cache_stats():
+    """관리자 화면 표시용: 메모리에 올라와 있는 항목 수와 총 크기"""
+    store = _get_store()
+    with store["lock"]:
+        return {"entries": len(store["entries"]), "total_bytes": store["total_bytes"], "max_bytes": OCS_STATE_CACHE_MAX_BYTES}
+
+def _as_bytes_io(styled_bytes):
+    """ocs_cache 저장 함수가 BytesIO를 받으므로 변환"""
+    return io.BytesIO(styled_bytes) if styled_bytes is not None else None
@@ -0,0 +1,151 @@
+# patient_store.py
+
+import streamlit as st
+
+import dept_codes
+from config import PATIENT_PAGE_SIZE, PATIENT_SEARCH_LIMIT
+
+# 학생 환자 목록(patients/{user_key})의 페이지 단위 조회/검색과 세션 캐시
+# - 목록: 진료번호(키) 순으로 한 페이지씩 서버에서 가져오고, 가져온 페이지는 세션에 보관합니다.
+# - 검색: 이름(접두어)/진료번호(접두어)는 Firebase 쿼리로 서버에서 찾습니다. (Firebase 규칙에 patients/$user 의 ".indexOn": ["환자이름"] 필요, 없으면 경고 후 전체 목록에서 거름)
+#         진료과는 bitmask(dept_codes)로 저장되어 서버 쿼리가 불가능하므로, 사용자 환자 목록을 한 번 전부 받아 세션에서 거릅니다.
+# - 등록/삭제는 Firebase에 쓰면서 세션 캐시에도 바로 반영(write-through)하므로 전체 목록을 다시 읽지 않습니다.
+
+_PREFIX_END = "\uf8ff" # 접두어 검색 범위 끝 (Firebase 권장 방식)
+
+# --- 1. 세션 캐시 ---
+def get_patient_cache(firebase_key):
+    """현재 사용자의 환자 목록 세션 캐시를 가져옵니다. (다른 사용자로 바뀌면 새로 만듦)"""
+    cache = st.session_state.get("patient_cache")
+    if not cache or cache["owner"] != firebase_key:
+        cache = {"owner": firebase_key, "records": {}, "page_keys": [], "next_cursor": None, "exhausted": False, "searches": {}, "total": None, "all_loaded": False}
+        st.session_state.patient_cache = cache
+    return cache
+
+def _invalidate_listing(cache):
+    """목록 페이지/검색 결과 구성만 초기화합니다. (이미 받은 환자 데이터는 유지)"""
+    cache["page_keys"] = []; cache["next_cursor"] = None; cache["exhausted"] = False; cache["searches"] = {}
+
+
+# --- 2. 조회 ---
+def get_total_count(cache, patients_ref):
+    """등록 환자 수 (키만 가져오는 shallow 조회를 세션당 한 번만 수행)"""
+    if cache["total"] is None:
+        cache["total"] = len(patients_ref.get(shallow=True) or {})
+    return cache["total"]
+
+def load_page(cache, patients_ref, page_number):
+    """
+    page_number(0부터) 페이지의 [(진료번호, 환자 정보), ...]를 반환합니다.
+    아직 받지 않은 페이지는 마지막 커서부터 필요한 만큼만 서버에서 가져옵니다.
+    """
+    needed = (page_number + 1) * PATIENT_PAGE_SIZE
+    while len(cache["page_keys"]) < needed and not cache["exhausted"]:
+        query = patients_ref.order_by_key()
+        if cache["next_cursor"] is not None:
+            query = query.start_at(cache["next_cursor"])
+        fetched = query.limit_to_first(PATIENT_PAGE_SIZE + 1).get() or {}
+        items = [(pid_key, val) for pid_key, val in fetched.items() if isinstance(val, dict)]
+        page_items = items[:PATIENT_PAGE_SIZE]
+        for pid_key, val in page_items:
+            cache["records"][pid_key] = val
+        cache["page_keys"].extend(pid_key for pid_key, _ in page_items)
+        if len(fetched) > PATIENT_PAGE_SIZE:
+            cache["next_cursor"] = list(fetched.keys())[PATIENT_PAGE_SIZE]
+        else:
+            cache["exhausted"] = True
+
+    page_keys = cache["page_keys"][page_number * PATIENT_PAGE_SIZE:needed]
+    return [(pid_key, cache["records"][pid_key]) for pid_key in page_keys if pid_key in cache["records"]]
+
+def has_next_page(cache, page_number):
+    """다음 페이지가 있는지 확인합니다."""
+    return len(cache["page_keys"]) > (page_number + 1) * PATIENT_PAGE_SIZE or not cache["exhausted"]
+
+def _load_all_records(cache, patients_ref):
+    """진료과 검색용: 사용자 환자 목록 전체를 세션당 한 번만 받아 캐시에 넣습니다."""
+    if not cache["all_loaded"]:
+        fetched = patients_ref.get() or {}
+        cache["records"].update({pid_key: val for pid_key, val in fetched.items() if isinstance(val, dict)})
+        cache["total"] = len(fetched); cache["all_loaded"] = True
+
+def _search_by_name(cache, patients_ref, query):
+    """
+    이름 접두어 서버 검색. Firebase 규칙에 환자이름 인덱스가 없어 쿼리가 실패하면
+    (세션에 한 번 기록하고) 사용자 환자 목록 전체(세션당 한 번)에서 접두어로 거릅니다.
+    """
+    if not cache.get("name_index_missing"):
+        try:
+            return patients_ref.order_by_child('환자이름').start_at(query).end_at(query + _PREFIX_END).limit_to_first(PATIENT_SEARCH_LIMIT).get() or {}
+        except Exception:
+            cache["name_index_missing"] = True
+    st.warning('⚠️ Firebase 규칙에 patients의 ".indexOn": ["환자이름"]이 없어 전체 환자 목록에서 이름을 검색합니다. 관리자에게 규칙 추가를 요청하세요.')
+    _load_all_records(cache, patients_ref)
+    return {pid_key: val for pid_key, val in cache["records"].items() if str(val.get('환자이름', '')).startswith(query)}
+
+def search_patients(cache, patients_ref, query, dept=None):
+    """
+    이름/진료번호 접두어로 서버에서 환자를 찾고, 진료과는 bitmask로 거릅니다. 결과는 세션에 보관합니다.
+    진료과만 주면 사용자 환자 목록 전체(세션당 한 번)에서 거릅니다.
+    반환값: 이름순 [(진료번호, 환자 정보), ...]
+    """
+    query = (query or "").strip()
+    search_key = (query, dept)
+    if search_key not in cache["searches"]:
+        found = {}
+        if query:
+            found.update(patients_ref.order_by_key().start_at(query).end_at(query + _PREFIX_END).limit_to_first(PATIENT_SEARCH_LIMIT).get() or {})
+            found.update(_search_by_name(cache, patients_ref, query))
+        elif dept:
+            _load_all_records(cache, patients_ref)
+            found = {pid_key: val for pid_key, val in cache["records"].items() if dept_codes.has_department(val, dept)}
+        found = {pid_key: val for pid_key, val in found.items() if isinstance(val, dict)}
+        cache["records"].update(found)
+        cache["searches"][search_key] = sorted(found, key=lambda pid_key: (found[pid_key].get('환자이름', ''), pid_key))
+
+    results = [(pid_key, cache["records"][pid_key]) for pid_key in cache["searches"][search_key] if pid_key in cache["records"]]
+    if query and dept:
+        results = [(pid_key, val) for pid_key, val in results if dept_codes.has_department(val, dept)]
+    return results
+
+
+# --- 3. 등록 / 삭제 (write-through) ---
+def get_patient(cache, patients_ref, pid_key):
+    """환자 한 명의 정보 (캐시에 없으면 해당 노드만 읽음)"""
+    if pid_key not in cache["records"]:
+        val = patients_ref.child(pid_key).get()
+        if isinstance(val, dict): cache["records"][pid_key] = val
+    return cache["records"].get(pid_key)
+
+def register_patient(cache, patients_ref, name, pid, departments):
+    """
+    환자를 등록(또는 진료과 갱신)하고 캐시에 반영합니다.
+    진료과는 bitmask 하나로 저장하며, 이전 형식 레코드를 갱신하면 진료과 플래그는 지워지고 새 형식으로 바뀝니다.
+    """
+    pid_key = pid.strip()
+    existing = get_patient(cache, patients_ref, pid_key)
+    patient_data = dept_codes.build_patient_record(
+        existing.get("환자이름", name) if existing else name, existing.get("진료번호", pid_key) if existing else pid_key, departments
+    )
+    patients_ref.child(pid_key).set(patient_data)
+
+    if existing is None:
+        if cache["total"] is not None: cache["total"] += 1
+        _invalidate_listing(cache) # 새 환자가 들어갈 페이지 위치가 바뀜
+    else:
+        cache["searches"] = {} # 진료과가 바뀌었을 수 있으므로 검색 결과만 다시 조회
+    cache["records"][pid_key] = patient_data
+    return patient_data
+
+def delete_patients(cache, patients_ref, pid_keys):
+    """환자들을 한 번의 다중 경로 업데이트로 삭제하고 캐시에서도 제거합니다."""
+    pid_keys = list(pid_keys)
+    if not pid_keys:
+        return
+    patients_ref.update({pid_key: None for pid_key in pid_keys})
+    removed = set(pid_keys)
+    for pid_key in removed:
+        if cache["records"].pop(pid_key, None) is not None and cache["total"] is not None: cache["total"] -= 1
+    cache["page_keys"] = [pid_key for pid_key in cache["page_keys"] if pid_key not in removed]
+    for search_key, keys in cache["searches"].items():
+        cache["searches"][search_key] = [pid_key for pid_key in keys if pid_key not in removed]
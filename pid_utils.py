@@ -0,0 +1,39 @@
+# pid_utils.py
+
+import pandas as pd
+
+# 진료번호(PID) 정규화: OCS 시트와 환자 등록 스냅샷 모두 이 함수 하나로 정수 키를 만듭니다.
+# (스타일링과 매칭이 서로 다른 방식으로 PID를 비교하지 않도록 한 곳에 모음)
+# 규칙: 공백 제거 → '.0' 접미사 제거 → 지수 표기(1.02896E+07) 변환 → 숫자만 추출 → 정수 (앞의 0 제거)
+#       숫자가 하나도 없으면 결측(<NA>)
+
+PID_KEY_COLUMN = '_pid'
+
+def canonicalize_pid_series(pid_series):
+    """PID 값 Series를 벡터 연산으로 정규화해 정수 키(Int64, 실패 시 <NA>) Series를 반환합니다."""
+    pid_str = pid_series.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+    # Scientific notation (예: 1.02896E+07) 처리: 변환에 실패하면 기존 문자열 유지
+    is_scientific = pid_str.str.contains('E', case=False, regex=False, na=False)
+    if is_scientific.any():
+        scientific_values = pd.to_numeric(pid_str[is_scientific], errors='coerce').dropna()
+        scientific_values = scientific_values[scientific_values.abs() < 1e18] # int64 범위 밖은 문자열 그대로
+        pid_str.loc[scientific_values.index] = scientific_values.astype('int64').astype(str)
+
+    pid_digits = pid_str.str.replace(r'\D', '', regex=True)
+    return pd.to_numeric(pid_digits.where(pid_digits != ''), errors='coerce').astype('Int64')
+
+def canonicalize_pids(pid_values):
+    """PID 값 목록(리스트/키 목록)을 정규화합니다. 반환값: 입력 순서대로 int 또는 None 리스트"""
+    pid_values = list(pid_values)
+    if not pid_values:
+        return []
+    return [None if pd.isna(pid) else int(pid) for pid in canonicalize_pid_series(pd.Series(pid_values, dtype=object))]
+
+def add_pid_key_column(df, source_column='진료번호'):
+    """DataFrame에 정규화된 정수 PID 키 컬럼('_pid')을 추가합니다."""
+    if source_column in df.columns:
+        df[PID_KEY_COLUMN] = canonicalize_pid_series(df[source_column])
+    else:
+        df[PID_KEY_COLUMN] = pd.Series(pd.NA, index=df.index, dtype='Int64')
+    return df
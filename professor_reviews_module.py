@@ -8,16 +8,22 @@ import pandas as pd
 
 # 기존 유틸리티 모듈 임포트
 from firebase_utils import get_db_refs, sanitize_path
+from hangul_search import build_search_index, search
 
 # Firebase 레퍼런스 초기화
 users_ref, doctor_users_ref, db_ref_func = get_db_refs()
 professor_reviews_ref = db_ref_func("professor_reviews") 
+# 💡 [추가] 교수님별 평점 집계 (평가 수, 평점 합계, 점수별 개수, 최근 등록 시각) - 평가 등록 시 트랜잭션으로 갱신
+# 구조: professor_review_stats/{safe_key} = {count, rating_sum, histogram: {s1..s5}, last_timestamp}
+professor_review_stats_ref = db_ref_func("professor_review_stats")
 # 💡 [추가] 교수님 목록을 저장할 새로운 레퍼런스
 professors_ref = db_ref_func("professors_list")
 
 # 사용자가 선택할 수 있는 과 목록 (config.py 또는 별도 DB에서 가져오는 것이 이상적이나, 여기서는 임시 정의)
 DEPARTMENTS = ["외과", "보철", "보존", "치주", "소치", "관악", "영상", "내과", "교정"] 
 ALL_DEPARTMENTS_OPTION = "모든 과"
+# 후기 목록 한 페이지에 불러올 평가 수 (Firebase 규칙에 professor_reviews/$prof 의 ".indexOn": "timestamp" 필요)
+REVIEWS_PAGE_SIZE = 10
 
 # --- 내부 로직 함수 ---
 
@@ -44,6 +50,14 @@ def load_professor_list():
     return list(data.values()) if data else []
 
 
+@st.cache_resource(max_entries=4)
+def _get_professor_search_index(professor_entries):
+    """교수님 목록((이름, 과) 튜플)으로 이름/초성/과 검색 인덱스를 만듭니다. (목록이 바뀔 때만 다시 생성)"""
+    return build_search_index(
+        [{"name": name, "dept": dept} for name, dept in professor_entries], name_field="name", facet_field="dept"
+    )
+
+
 def _handle_professor_addition(name, dept):
     """새로운 교수님 정보를 Firebase에 추가합니다."""
     if not name or not dept:
@@ -68,6 +82,59 @@ def _handle_professor_addition(name, dept):
     st.rerun()
 
 
+def _empty_review_stats():
+    """빈 평점 집계 (histogram 키는 Firebase가 배열로 바꾸지 않도록 's1'~'s5' 사용)"""
+    return {"count": 0, "rating_sum": 0, "histogram": {f"s{score}": 0 for score in range(1, 6)}, "last_timestamp": ""}
+
+
+def _add_rating_to_stats(stats, rating, timestamp):
+    """집계에 평점 하나를 더합니다."""
+    try: rating = int(rating)
+    except (TypeError, ValueError): return stats
+    stats["count"] = stats.get("count", 0) + 1
+    stats["rating_sum"] = stats.get("rating_sum", 0) + rating
+    histogram = stats.setdefault("histogram", {})
+    histogram[f"s{rating}"] = histogram.get(f"s{rating}", 0) + 1
+    stats["last_timestamp"] = max(stats.get("last_timestamp", ""), timestamp or "")
+    return stats
+
+
+def _build_review_stats(safe_key):
+    """(집계가 없던 기존 교수님용) 전체 평가를 한 번 읽어 집계를 새로 계산합니다."""
+    stats = _empty_review_stats()
+    for review in (professor_reviews_ref.child(safe_key).get() or {}).values():
+        if isinstance(review, dict):
+            _add_rating_to_stats(stats, review.get('rating'), review.get('timestamp', ''))
+    return stats
+
+
+def _load_review_stats(safe_key):
+    """교수님 평점 집계 노드 하나만 읽습니다. 집계가 없으면 기존 평가로 한 번 계산해 저장합니다."""
+    stats = professor_review_stats_ref.child(safe_key).get()
+    if stats is None:
+        stats = professor_review_stats_ref.child(safe_key).transaction(
+            lambda current: current if current is not None else _build_review_stats(safe_key)
+        )
+    return stats or _empty_review_stats()
+
+
+def _fetch_review_page(safe_key, end_timestamp=None, seen_keys=()):
+    """
+    timestamp 순으로 정렬된 평가를 서버에서 최신순 한 페이지만 가져옵니다.
+    end_timestamp(이전 페이지의 가장 오래된 시각)가 주어지면 그 이전 평가를 가져옵니다. (같은 시각의 이미 본 평가는 제외)
+    반환값: (최신순 [(key, 평가), ...], 더 가져올 평가가 있는지 여부)
+    """
+    query = professor_reviews_ref.child(safe_key).order_by_child('timestamp')
+    if end_timestamp is not None:
+        query = query.end_at(end_timestamp)
+    fetch_size = REVIEWS_PAGE_SIZE + len(seen_keys) # 커서 시각과 같은 평가가 다시 포함될 수 있음
+    fetched = query.limit_to_last(fetch_size).get() or {}
+
+    page = [(key, review) for key, review in fetched.items() if key not in seen_keys and isinstance(review, dict)]
+    page.sort(key=lambda item: item[1].get('timestamp', ''), reverse=True)
+    return page[:REVIEWS_PAGE_SIZE], len(fetched) >= fetch_size
+
+
 def _handle_review_submission(professor_name, professor_dept, rating, review_text):
     """익명 평가를 Firebase에 저장합니다."""
     # 고유 키: 이름_과
@@ -89,6 +156,13 @@ def _handle_review_submission(professor_name, professor_dept, rating, review_tex
         # 고유 키 아래에 자동 생성 키로 평가 저장
         safe_key = sanitize_path(unique_key)
         professor_reviews_ref.child(safe_key).push(new_review)
+
+        # 평점 집계 갱신 (집계가 없던 교수님은 방금 등록한 평가를 포함해 전체를 한 번 계산)
+        def _apply_review(current):
+            if current is None: return _build_review_stats(safe_key)
+            return _add_rating_to_stats(current, rating, new_review["timestamp"])
+        professor_review_stats_ref.child(safe_key).transaction(_apply_review)
+        st.session_state.pop(f"review_pages_{safe_key}", None) # 새 평가가 보이도록 불러온 페이지 초기화
         st.success(f"🎉 **{professor_name}** 교수님 ({professor_dept})에 대한 익명 평가가 등록되었습니다.")
         
         st.rerun() 
@@ -101,26 +175,40 @@ def _show_existing_reviews(professor_name, professor_dept):
     """선택된 교수님의 기존 평가를 표시하고 평균 평점을 계산합니다."""
     unique_key = f"{professor_name}_{professor_dept}"
     safe_key = sanitize_path(unique_key)
-    all_reviews = professor_reviews_ref.child(safe_key).get()
+    # 평가 수/평균은 미리 계산된 집계 노드에서 읽습니다.
+    stats = _load_review_stats(safe_key)
     
     full_name = f"{professor_name} 교수님 ({professor_dept})"
 
-    if all_reviews and isinstance(all_reviews, dict):
-        review_list = list(all_reviews.values())
-        
-        ratings = [r.get('rating', 0) for r in review_list if isinstance(r, dict)]
-        avg_rating = sum(ratings) / len(ratings) if ratings else 0
+    if stats.get("count", 0) > 0:
+        avg_rating = stats["rating_sum"] / stats["count"]
 
-        st.subheader(f"✅ {full_name} 평가 결과 (총 {len(ratings)}개)")
+        st.subheader(f"✅ {full_name} 평가 결과 (총 {stats['count']}개)")
         st.markdown(f"**평균 평점: {avg_rating:.2f} / 5.0**")
+        histogram = stats.get("histogram") or {}
+        st.caption(" · ".join(f"{score}점 {histogram.get(f's{score}', 0)}개" for score in range(5, 0, -1)))
         st.markdown("---")
 
-        for review_data in sorted(review_list, key=lambda x: x.get('timestamp', ''), reverse=True):
-            if isinstance(review_data, dict):
-                st.markdown(f"**⭐️ 평점: {review_data.get('rating', 'N/A')}**")
-                st.text(review_data.get('review', '평가 내용 없음'))
-                st.caption(f"등록일: {review_data.get('timestamp', 'N/A')[:10]}")
-                st.divider()
+        # 후기 목록: 최신순 페이지 단위로 불러오고, 불러온 페이지는 세션에 보관 ('더 보기'는 다음 페이지만 요청)
+        pages_key = f"review_pages_{safe_key}"
+        if pages_key not in st.session_state:
+            first_page, has_more = _fetch_review_page(safe_key)
+            st.session_state[pages_key] = {"reviews": first_page, "has_more": has_more}
+        loaded = st.session_state[pages_key]
+
+        for _, review_data in loaded["reviews"]:
+            st.markdown(f"**⭐️ 평점: {review_data.get('rating', 'N/A')}**")
+            st.text(review_data.get('review', '평가 내용 없음'))
+            st.caption(f"등록일: {review_data.get('timestamp', 'N/A')[:10]}")
+            st.divider()
+
+        if loaded["has_more"] and len(loaded["reviews"]) < stats["count"]:
+            if st.button(f"더 보기 ({len(loaded['reviews'])}/{stats['count']})", key=f"load_more_reviews_{safe_key}"):
+                cursor_timestamp = loaded["reviews"][-1][1].get('timestamp', '') if loaded["reviews"] else None
+                seen_keys = {key for key, review in loaded["reviews"] if review.get('timestamp', '') == cursor_timestamp}
+                next_page, has_more = _fetch_review_page(safe_key, cursor_timestamp, seen_keys)
+                loaded["reviews"].extend(next_page); loaded["has_more"] = has_more and bool(next_page)
+                st.rerun()
 
     else:
         st.info(f"아직 {full_name}에 대한 등록된 평가가 없습니다.")
@@ -142,7 +230,7 @@ def show_professor_review_system():
     st.subheader("교수님 후기검색")
     
     # 💡 [변경] 검색 입력 및 과 필터링
-    search_query = st.text_input("이름으로 교수님 검색", key="prof_search_query", placeholder="예: 김철수")
+    search_query = st.text_input("이름으로 교수님 검색", key="prof_search_query", placeholder="예: 김철수, 철수, ㄱㅊㅅ")
     
     col1, col2 = st.columns([1, 2])
     with col1:
@@ -153,25 +241,16 @@ def show_professor_review_system():
             key="dept_filter"
         )
     
-    # 3. 검색 결과 필터링 및 표시
+    # 3. 검색 결과 필터링 및 표시 (이름 부분 일치/접두어/초성 검색 + 과 필터, 인덱스 조회)
     filtered_professors = []
+    dept_facet = None if selected_dept_filter == ALL_DEPARTMENTS_OPTION else selected_dept_filter
     
-    if search_query:
-        search_term = search_query.strip().lower()
-        
-        for prof in all_professors_data:
-            name_match = search_term in prof.get('name', '').lower()
-            dept_match = selected_dept_filter == ALL_DEPARTMENTS_OPTION or prof.get('dept') == selected_dept_filter
-
-            if name_match and dept_match:
-                filtered_professors.append(prof)
-    
-    # 4. 검색 결과 또는 전체 목록 표시
-    if not search_query and selected_dept_filter != ALL_DEPARTMENTS_OPTION:
-        # 검색 없이 과 필터만 사용한 경우
-        for prof in all_professors_data:
-            if prof.get('dept') == selected_dept_filter:
-                 filtered_professors.append(prof)
+    # 4. 검색 결과 또는 과 필터만 사용한 경우의 목록
+    if search_query or dept_facet:
+        professor_index = _get_professor_search_index(
+            tuple((prof.get('name', ''), prof.get('dept', '')) for prof in all_professors_data)
+        )
+        filtered_professors = search(professor_index, search_query, facet=dept_facet, records=all_professors_data)
 
     if not search_query and not filtered_professors:
          st.info(f"현재 등록된 교수님은 총 **{len(all_professors_data)}명**입니다. 검색하거나 과를 선택해 주세요.")
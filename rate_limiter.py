@@ -0,0 +1,124 @@
+# rate_limiter.py
+
+import random
+import smtplib
+import threading
+import time
+from collections import deque
+
+from googleapiclient.errors import HttpError
+
+from config import RATE_LIMITS, RATE_LIMIT_MAX_ATTEMPTS, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX
+
+# SMTP / Google Calendar 호출 속도 제한 (백엔드+계정별 토큰 버킷, 지수 백오프 재시도, 처리량 통계)
+# 버킷 상태는 프로세스 전역에서 공유하므로 여러 세션/스레드가 동시에 전송해도 같은 계정 한도를 나눠 씁니다.
+
+_lock = threading.Lock()
+_buckets = {}   # (backend, account) -> {'tokens', 'rate', 'updated'}
+_stats = {}     # backend -> {'sent': deque(완료 시각), 'retries', 'throttled', 'failed'}
+_THROUGHPUT_WINDOW = 60.0
+
+# --- 1. 토큰 버킷 ---
+def _get_bucket(backend, account):
+    """(잠금 상태에서 호출) 백엔드/계정의 토큰 버킷을 가져오거나 새로 만듭니다."""
+    key = (backend, account)
+    if key not in _buckets:
+        limits = RATE_LIMITS[backend]
+        _buckets[key] = {"tokens": float(limits["burst"]), "rate": float(limits["rate"]), "updated": time.monotonic()}
+    return _buckets[key]
+
+def _get_stats(backend):
+    """(잠금 상태에서 호출) 백엔드 처리량 통계를 가져옵니다."""
+    return _stats.setdefault(backend, {"sent": deque(), "retries": 0, "throttled": 0, "failed": 0})
+
+def acquire(backend, account):
+    """토큰 하나를 얻을 때까지 기다립니다."""
+    while True:
+        with _lock:
+            bucket = _get_bucket(backend, account)
+            now = time.monotonic()
+            bucket["tokens"] = min(float(RATE_LIMITS[backend]["burst"]), bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+            bucket["updated"] = now
+            if bucket["tokens"] >= 1.0:
+                bucket["tokens"] -= 1.0
+                return
+            wait_seconds = (1.0 - bucket["tokens"]) / bucket["rate"]
+        time.sleep(wait_seconds)
+
+def _on_success(backend, account):
+    """성공 시: 처리량 기록, 낮춰 둔 속도를 설정값까지 조금씩 회복"""
+    with _lock:
+        bucket = _get_bucket(backend, account)
+        bucket["rate"] = min(float(RATE_LIMITS[backend]["rate"]), bucket["rate"] * 1.1)
+        _get_stats(backend)["sent"].append(time.monotonic())
+
+def _on_throttled(backend, account):
+    """제한 응답 시: 해당 계정의 속도를 절반으로 낮추고 남은 토큰을 비웁니다."""
+    with _lock:
+        bucket = _get_bucket(backend, account)
+        bucket["rate"] = max(float(RATE_LIMITS[backend]["min_rate"]), bucket["rate"] / 2)
+        bucket["tokens"] = 0.0
+        _get_stats(backend)["throttled"] += 1
+
+
+# --- 2. 재시도 판별 ---
+def is_retryable_error(error):
+    """속도 제한/일시적 오류인지 판별합니다. (HTTP 429·5xx·403 rateLimitExceeded, SMTP 4xx, SMTP 연결 끊김)"""
+    if isinstance(error, HttpError):
+        status = getattr(error.resp, "status", None)
+        try: status = int(status)
+        except (TypeError, ValueError): return False
+        if status == 429 or status >= 500:
+            return True
+        return status == 403 and "ratelimitexceeded" in str(error).lower()
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
+
+def backoff_seconds(attempt):
+    """attempt(0부터)번째 재시도 전 대기 시간: 지수 증가 + 전체 지터"""
+    return random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * (2 ** attempt)))
+
+
+# --- 3. 호출 ---
+def call_with_backoff(backend, account, func, *args, **kwargs):
+    """
+    속도 제한을 지키며 func를 호출합니다. 재시도 가능한 오류는 지수 백오프 후 다시 시도하고,
+    최대 시도 횟수를 넘기거나 재시도할 수 없는 오류면 그대로 예외를 올립니다.
+    """
+    for attempt in range(RATE_LIMIT_MAX_ATTEMPTS):
+        acquire(backend, account)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable_error(e) or attempt == RATE_LIMIT_MAX_ATTEMPTS - 1:
+                with _lock: _get_stats(backend)["failed"] += 1
+                raise
+            _on_throttled(backend, account)
+            with _lock: _get_stats(backend)["retries"] += 1
+            time.sleep(backoff_seconds(attempt))
+            continue
+        _on_success(backend, account)
+        return result
+
+
+# --- 4. 처리량 ---
+def get_throughput(backend=None):
+    """
+    최근 1분간 처리량과 누적 재시도/제한/실패 횟수를 반환합니다.
+    반환 형식: {'smtp': {'per_minute': 42, 'retries': 3, 'throttled': 3, 'failed': 0, 'current_rates': {계정: 초당 요청 수}}, ...}
+    """
+    now = time.monotonic()
+    with _lock:
+        backends = [backend] if backend else list(RATE_LIMITS)
+        throughput = {}
+        for name in backends:
+            stats = _get_stats(name)
+            while stats["sent"] and now - stats["sent"][0] > _THROUGHPUT_WINDOW:
+                stats["sent"].popleft()
+            throughput[name] = {
+                "per_minute": len(stats["sent"]),
+                "retries": stats["retries"], "throttled": stats["throttled"], "failed": stats["failed"],
+                "current_rates": {account: round(bucket["rate"], 2) for (bucket_backend, account), bucket in _buckets.items() if bucket_backend == name},
+            }
+    return throughput[backend] if backend else throughput
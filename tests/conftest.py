@@ -0,0 +1,54 @@
+# tests/conftest.py
+
+import copy
+import os
+import sys
+
+import pytest
+
+# 저장소 루트의 모듈(excel_utils, notification_utils 등)을 테스트에서 바로 불러올 수 있도록 경로에 추가합니다.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeRef:
+    """Firebase Realtime Database 참조의 테스트용 대역 (get/set/update/delete/child/transaction, 값은 dict 트리에 보관)"""
+    def __init__(self, root, path):
+        self.root = root; self.path = [part for part in path.split("/") if part]
+
+    def child(self, path):
+        return FakeRef(self.root, "/".join(self.path + [path]))
+
+    def get(self, shallow=False):
+        node = self.root
+        for part in self.path:
+            if not isinstance(node, dict) or part not in node: return None
+            node = node[part]
+        node = copy.deepcopy(node)
+        return {key: True for key in node} if shallow and isinstance(node, dict) else node
+
+    def set(self, value):
+        if value is None: return self.delete()
+        node = self.root
+        for part in self.path[:-1]: node = node.setdefault(part, {})
+        node[self.path[-1]] = copy.deepcopy(value)
+
+    def update(self, values):
+        for path, value in values.items(): self.child(path).set(value) # None이면 삭제 (다중 경로 업데이트와 같음)
+
+    def delete(self):
+        node = self.root
+        for part in self.path[:-1]:
+            if part not in node: return
+            node = node[part]
+        node.pop(self.path[-1], None)
+
+    def transaction(self, update_func):
+        value = update_func(self.get()); self.set(value)
+        return value
+
+
+@pytest.fixture
+def fake_db():
+    """{'root': 저장된 트리, 'ref': db_ref_func와 같은 형식의 함수}"""
+    root = {}
+    return {"root": root, "ref": lambda path: FakeRef(root, path)}
@@ -0,0 +1,43 @@
+# tests/test_dept_codes.py
+
+import dept_codes
+
+
+# --- 인코딩 / 디코딩 ---
+def test_encode_and_decode_departments():
+    mask = dept_codes.encode_departments(["교정", " 보철 ", "없는과"])
+    assert mask == 17
+    assert dept_codes.decode_mask(mask) == ("보철", "교정")
+    assert dept_codes.encode_departments(None) == 0 and dept_codes.decode_mask(0) == ()
+
+def test_patient_mask_reads_new_and_legacy_records():
+    assert dept_codes.patient_mask({"depts": 16}) == 16
+    assert dept_codes.patient_mask({"보철": True, "치주": "true", "교정": False}) == 129
+    assert dept_codes.patient_mask({"depts": True, "외과": "True"}) == 2 # bool은 bitmask로 보지 않음
+    assert dept_codes.patient_mask("legacy") == 0
+
+def test_has_department():
+    patient = dept_codes.build_patient_record("홍길동", "00000001", ["보존", "치주"])
+    assert dept_codes.has_department(patient, "보존") and dept_codes.has_department(patient, "치주")
+    assert not dept_codes.has_department(patient, "교정")
+    assert not dept_codes.has_department(patient, "임플란트") # 등록할 수 없는 진료과
+    assert dept_codes.patient_departments(patient) == ["보존", "치주"]
+
+def test_sheet_search_mask_follows_the_sheet_map():
+    assert dept_codes.sheet_search_mask("임플란트") == dept_codes.encode_departments(["보철", "치주", "외과"])
+    assert dept_codes.sheet_search_mask("교정") == dept_codes.encode_departments(["교정"])
+
+
+# --- 이전 형식 변환 ---
+def test_migrate_patients(fake_db):
+    patients_ref = fake_db["ref"]("patients")
+    patients_ref.set({
+        "u1": {"00000001": {"환자이름": "a", "보철": True, "교정": "False"}, "00000002": {"환자이름": "b", "depts": 64}},
+        "u2": {"00000003": {"환자이름": "c", "치주": "true"}},
+    })
+    assert dept_codes.migrate_patients(patients_ref, chunk_size=1) == 2
+    assert patients_ref.get() == {
+        "u1": {"00000001": {"환자이름": "a", "depts": 1}, "00000002": {"환자이름": "b", "depts": 64}},
+        "u2": {"00000003": {"환자이름": "c", "depts": 128}},
+    }
+    assert dept_codes.migrate_patients(patients_ref) == 0
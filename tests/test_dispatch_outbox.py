@@ -0,0 +1,48 @@
+# tests/test_dispatch_outbox.py
+
+import dispatch_outbox
+
+EVENT = {"summary": "홍길동 보철 예약", "start": {"dateTime": "2026-10-20T09:00:00+09:00"}}
+
+
+def _plan_item(kind, safe_key="hong_gildong@example_com"):
+    return {"kind": kind, "safe_key": safe_key, "name": "홍길동"}
+
+
+# --- ID ---
+def test_item_ids_separate_students_and_doctors_sharing_an_email_key():
+    student, doctor = _plan_item("학생"), _plan_item("치과의사")
+    assert dispatch_outbox.email_item_id(student) != dispatch_outbox.email_item_id(doctor)
+    assert dispatch_outbox.event_item_id(student, EVENT) != dispatch_outbox.event_item_id(doctor, EVENT)
+    assert dispatch_outbox.email_item_id(student).startswith("student__")
+
+def test_event_item_id_depends_on_summary_and_start():
+    item = _plan_item("학생")
+    later = {**EVENT, "start": {"dateTime": "2026-10-20T10:00:00+09:00"}}
+    assert dispatch_outbox.event_item_id(item, EVENT) == dispatch_outbox.event_item_id(item, dict(EVENT))
+    assert dispatch_outbox.event_item_id(item, EVENT) != dispatch_outbox.event_item_id(item, later)
+
+def test_dispatch_id_uses_upload_content_and_dispatch_kind():
+    assert dispatch_outbox.compute_dispatch_id("abc", True) == dispatch_outbox.compute_dispatch_id("abc", True)
+    assert dispatch_outbox.compute_dispatch_id("abc", True) != dispatch_outbox.compute_dispatch_id("abc", False)
+    assert dispatch_outbox.compute_dispatch_id("abc", True) != dispatch_outbox.compute_dispatch_id("abd", True)
+
+
+# --- 상태 기록 / 조회 ---
+def test_outbox_records_statuses_and_resumes(fake_db):
+    item = _plan_item("학생")
+    outbox = dispatch_outbox.open_outbox(fake_db["ref"], "abc", "ocs_1020.xlsx", True)
+    mail_id = dispatch_outbox.email_item_id(item); event_id = dispatch_outbox.event_item_id(item, EVENT)
+    dispatch_outbox.record_statuses(outbox, item, {mail_id: (dispatch_outbox.STATUS_SENT, None)})
+    dispatch_outbox.record_statuses(outbox, item, {event_id: (dispatch_outbox.STATUS_FAILED, "quota")})
+    assert dispatch_outbox.is_sent(outbox, mail_id) and not dispatch_outbox.is_sent(outbox, event_id)
+
+    # 같은 업로드로 다시 열면 (파일 이름이 달라도) 이전 상태를 이어 씁니다.
+    reopened = dispatch_outbox.open_outbox(fake_db["ref"], "abc", "renamed.xlsx", True)
+    assert dispatch_outbox.is_sent(reopened, mail_id)
+    assert dispatch_outbox.summarize_outbox(fake_db["ref"], "abc", True) == {"sent": 1, "failed": 1, "sending": 0}
+    assert dispatch_outbox.summarize_outbox(fake_db["ref"], "abc", False) is None
+
+    dispatch_outbox.reset_outbox(fake_db["ref"], "abc", True)
+    assert dispatch_outbox.summarize_outbox(fake_db["ref"], "abc", True) is None
+    assert not dispatch_outbox.is_sent(None, mail_id)
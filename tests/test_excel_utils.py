@@ -0,0 +1,43 @@
+# tests/test_excel_utils.py
+
+import pandas as pd
+
+import excel_utils
+
+
+def _ocs_sheet(rows):
+    return pd.DataFrame(rows, columns=['예약일시', '예약시간', '진료번호', '환자명', '예약의사', '진료내역'])
+
+
+# --- 예약시간 변환 ---
+def test_parse_time_minutes():
+    minutes = excel_utils.parse_time_minutes(pd.Series(["09:30", "9:05", " 13:00 ", "abc", None, "24:00"]))
+    assert minutes.tolist() == [570, 545, 780, -1, -1, 1440]
+
+
+# --- ANALYSIS_RULES 기반 분석 ---
+def test_run_analysis_counts_non_professor_patients_by_period():
+    df = _ocs_sheet([
+        ['2026/10/20', '09:00', '1', 'a', '김현태', '검진'],   # 교수님 환자: 제외
+        ['2026/10/20', '09:00', '2', 'b', '홍길동', '검진'],   # 오전
+        ['2026/10/20', '12:50', '3', 'c', '홍길동', '검진'],   # 오전 (경계 포함)
+        ['2026/10/20', '12:55', '4', 'd', '홍길동', '검진'],   # 오전/오후 사이: 제외
+        ['2026/10/20', '13:00', '5', 'e', '홍길동', '검진'],   # 오후
+        ['2026/10/20', '시간미정', '6', 'f', '홍길동', '검진'], # 형식 오류: 제외
+    ])
+    assert excel_utils.run_analysis({"소아치과": df}) == {"소치": {"오전": 2, "오후": 1}}
+
+
+def test_run_analysis_counts_bonding_for_orthodontics():
+    df = _ocs_sheet([
+        ['2026/10/20', '09:00', '1', 'a', '홍길동', 'Bonding'],
+        ['2026/10/20', '09:30', '2', 'b', '홍길동', 'debonding'],
+        ['2026/10/20', '14:00', '3', 'c', '홍길동', '본딩'],
+        ['2026/10/20', '15:00', '4', 'd', '홍길동', '검진'],
+    ])
+    assert excel_utils.run_analysis({"교정": df}) == {"교정": {"오전": 1, "오후": 1}}
+
+
+def test_run_analysis_skips_unmapped_or_incomplete_sheets():
+    df = _ocs_sheet([['2026/10/20', '09:00', '1', 'a', '홍길동', '검진']])
+    assert excel_utils.run_analysis({"임플란트": df, "보존과": df.drop(columns=['진료내역'])}) == {}
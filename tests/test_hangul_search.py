@@ -0,0 +1,40 @@
+# tests/test_hangul_search.py
+
+import hangul_search
+
+PROFESSORS = [
+    {"name": "김철수", "dept": "보철"},
+    {"name": "철수김", "dept": "치주"},
+    {"name": "김철", "dept": "보철"},
+    {"name": "박영희", "dept": "교정"},
+]
+
+def _names(results):
+    return [item["name"] for item in results]
+
+def _index():
+    return hangul_search.build_search_index(PROFESSORS, facet_field="dept")
+
+
+def test_to_choseong():
+    assert hangul_search.to_choseong("김철수 A") == "ㄱㅊㅅ A"
+
+def test_search_ranks_exact_then_prefix_then_substring():
+    index = _index()
+    assert _names(hangul_search.search(index, "김철")) == ["김철", "김철수"]
+    assert _names(hangul_search.search(index, "철수")) == ["철수김", "김철수"]
+    assert _names(hangul_search.search(index, " 김 철 ")) == ["김철", "김철수"] # 공백 무시
+
+def test_search_by_choseong_and_mixed_query():
+    index = _index()
+    assert _names(hangul_search.search(index, "ㄱㅊ")) == ["김철", "김철수"]
+    assert _names(hangul_search.search(index, "ㅊㅅ")) == ["철수김", "김철수"]
+    assert _names(hangul_search.search(index, "ㄱ철ㅅ")) == ["김철수"]
+    assert _names(hangul_search.search(index, "ㄱ수")) == []
+
+def test_search_with_facet_and_records():
+    index = _index()
+    assert _names(hangul_search.search(index, "", facet="보철")) == ["김철수", "김철"]
+    assert _names(hangul_search.search(index, "철", facet="치주")) == ["철수김"]
+    records = [{"name": item["name"], "rating": idx} for idx, item in enumerate(PROFESSORS)]
+    assert hangul_search.search(index, "박", records=records) == [records[3]]
@@ -0,0 +1,85 @@
+# tests/test_notification_utils.py
+
+import pandas as pd
+import pytest
+
+import notification_utils
+
+
+@pytest.fixture(autouse=True)
+def _offline(monkeypatch):
+    """Firebase를 쓰는 이메일 복원/승인 담당자 조회를 테스트용 값으로 바꿉니다."""
+    monkeypatch.setattr(notification_utils, "recover_email", lambda safe_key: f"{safe_key}@example.com")
+    monkeypatch.setattr(notification_utils, "get_approver_lookup", lambda: {}, raising=False)
+
+
+def _ocs_sheet(rows):
+    return pd.DataFrame(rows, columns=['예약일시', '예약시간', '진료번호', '환자명', '예약의사', '진료내역'])
+
+
+# --- 등록 변경분(델타) 반영 ---
+def test_apply_registration_deltas_rematches_only_changed_users():
+    excel_data_dfs = {"보철": _ocs_sheet([
+        ['2026/10/20', '09:00', '00000001', '홍길동', '곽재영', '검진'],
+        ['2026/10/20', '10:00', '00000002', '김철수', '곽재영', '검진'],
+    ])}
+    users_meta = {"u1": {"name": "학생1"}, "u2": {"name": "학생2"}}
+    patients = {"u1": {"00000001": {"환자이름": "홍길동", "보철": True}}}
+    match_state = notification_utils.create_match_state(excel_data_dfs, users_meta, patients, {})
+    matched_users, _ = notification_utils.get_match_results(match_state)
+    assert [user["safe_key"] for user in matched_users] == ["u1"]
+
+    new_patients = {
+        "u1": {"00000001": {"환자이름": "홍길동", "보철": True}},
+        "u2": {"00000002": {"환자이름": "김철수", "보철": True}},
+    }
+    changed_users, changed_pids = notification_utils.apply_registration_deltas(match_state, users_meta, new_patients, {})
+    assert changed_users == {"u2"}
+    assert changed_pids == {"00000002"}
+    matched_users, _ = notification_utils.get_match_results(match_state)
+    assert sorted(user["safe_key"] for user in matched_users) == ["u1", "u2"]
+
+    # 등록을 모두 지운 사용자는 매칭 결과에서 빠집니다.
+    changed_users, changed_pids = notification_utils.apply_registration_deltas(match_state, users_meta, {"u2": new_patients["u2"]}, {})
+    assert changed_users == {"u1"} and changed_pids == {"00000001"}
+    matched_users, _ = notification_utils.get_match_results(match_state)
+    assert [user["safe_key"] for user in matched_users] == ["u2"]
+
+
+def test_apply_registration_deltas_without_changes_is_noop():
+    excel_data_dfs = {"보철": _ocs_sheet([['2026/10/20', '09:00', '00000001', '홍길동', '곽재영', '검진']])}
+    patients = {"u1": {"00000001": {"환자이름": "홍길동", "보철": True}}}
+    match_state = notification_utils.create_match_state(excel_data_dfs, {}, patients, {})
+    before = match_state["user_matches"]["u1"]
+    assert notification_utils.apply_registration_deltas(match_state, {}, {"u1": dict(patients["u1"])}, {}) == (set(), set())
+    assert match_state["user_matches"]["u1"] is before
+
+
+# --- 여러 시트 중복 예약 합치기 ---
+def _matched_rows(rows):
+    return pd.DataFrame(rows, columns=['_pid', '예약일시', '예약시간', '예약의사', '시트', '등록과']).astype({'_pid': 'Int64'})
+
+def test_deduplicate_appointments_merges_sheets_and_departments():
+    df = _matched_rows([
+        [1, '2026/10/20', '09:00', '곽재영', '보철', '보철'],
+        [1, '2026/10/20', '09:00', '곽재영', '임플란트', '보철, 치주'],
+        [1, '2026/10/20', '10:00', '곽재영', '보철', '보철'],
+        [2, '2026/10/20', '09:00', '곽재영', '임플란트', '외과'],
+    ])
+    deduped, merged_rows = notification_utils.deduplicate_appointments(df)
+    assert merged_rows == 1
+    assert deduped['시트'].tolist() == ['보철, 임플란트', '보철', '임플란트']
+    assert deduped['등록과'].tolist() == ['보철, 치주', '보철', '외과']
+
+def test_deduplicate_appointments_keeps_rows_without_pid_key():
+    df = _matched_rows([
+        [None, '2026/10/20', '09:00', '곽재영', '보철', '보철'],
+        [None, '2026/10/20', '09:00', '곽재영', '임플란트', '보철'],
+    ])
+    deduped, merged_rows = notification_utils.deduplicate_appointments(df)
+    assert merged_rows == 0 and len(deduped) == 2
+
+def test_deduplicate_appointments_without_key_columns_is_unchanged():
+    df = pd.DataFrame({'환자명': ['a', 'a']})
+    deduped, merged_rows = notification_utils.deduplicate_appointments(df)
+    assert deduped is df and merged_rows == 0
@@ -0,0 +1,37 @@
+# tests/test_ocs_history.py
+
+import ocs_history
+
+
+# --- 차이 계산 ---
+def test_compute_delta_for_new_changed_and_removed_departments():
+    old = {"소치": {"오전": 3, "오후": 1}, "보존": {"오전": 2, "오후": 2}}
+    new = {"소치": {"오전": 4, "오후": 1}, "교정": {"오전": 1, "오후": 0}}
+    assert ocs_history._compute_delta(old, new) == {
+        "소치": {"오전": 1, "오후": 0, "일수": 0},
+        "보존": {"오전": -2, "오후": -2, "일수": -1},
+        "교정": {"오전": 1, "오후": 0, "일수": 1},
+    }
+
+def test_compute_delta_ignores_unchanged_departments():
+    counts = {"소치": {"오전": 3, "오후": 1}}
+    assert ocs_history._compute_delta(counts, dict(counts)) == {}
+    assert ocs_history._compute_delta(None, {}) == {}
+
+
+# --- 이력/집계 기록 ---
+def test_record_analysis_run_applies_only_the_delta(fake_db):
+    ocs_history.record_analysis_run(fake_db["ref"], "2026-10-20", "a.xlsx", {"소치": {"오전": 3, "오후": 1}})
+    # 같은 날짜를 다시 올리면 차이만 반영되고, 같은 내용이면 집계가 그대로입니다.
+    ocs_history.record_analysis_run(fake_db["ref"], "2026-10-20", "b.xlsx", {"소치": {"오전": 4, "오후": 1}, "교정": {"오전": 1, "오후": 0}})
+    assert ocs_history.record_analysis_run(fake_db["ref"], "2026-10-20", "b.xlsx", {"소치": {"오전": 4, "오후": 1}, "교정": {"오전": 1, "오후": 0}}) == {}
+    ocs_history.record_analysis_run(fake_db["ref"], "2026-10-21", "c.xlsx", {"소치": {"오전": 1, "오후": 1}})
+
+    aggregates = fake_db["root"]["ocs_analysis"]["aggregates"]
+    assert aggregates["weekly"]["2026-W43"] == {"소치": {"오전": 5, "오후": 2, "일수": 2}, "교정": {"오전": 1, "오후": 0, "일수": 1}}
+    assert aggregates["monthly"]["2026-10"] == aggregates["weekly"]["2026-W43"]
+    assert fake_db["root"]["ocs_analysis"]["history"]["2026-10-20"]["file_name"] == "b.xlsx"
+
+    # 진료과가 빠진 결과로 다시 올리면 해당 기간 집계에서도 빠집니다.
+    ocs_history.record_analysis_run(fake_db["ref"], "2026-10-20", "d.xlsx", {"소치": {"오전": 4, "오후": 1}})
+    assert "교정" not in fake_db["root"]["ocs_analysis"]["aggregates"]["weekly"]["2026-W43"]
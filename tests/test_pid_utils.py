@@ -0,0 +1,24 @@
+# tests/test_pid_utils.py
+
+import pandas as pd
+
+from pid_utils import PID_KEY_COLUMN, add_pid_key_column, canonicalize_pid_series, canonicalize_pids
+
+
+def test_canonicalize_pids_normalizes_every_input_form():
+    raw = ["00012345", " 12345.0", "1.2345E+04", "PID-12345", 12345, 12345.0]
+    assert canonicalize_pids(raw) == [12345] * len(raw)
+
+def test_canonicalize_pids_without_digits_is_none():
+    assert canonicalize_pids(["", None, "abc"]) == [None, None, None]
+    assert canonicalize_pids([]) == []
+
+def test_canonicalize_pid_series_returns_nullable_integers():
+    keys = canonicalize_pid_series(pd.Series(["007", "x"]))
+    assert str(keys.dtype) == "Int64"
+    assert keys.iloc[0] == 7 and pd.isna(keys.iloc[1])
+
+def test_add_pid_key_column():
+    df = add_pid_key_column(pd.DataFrame({"진료번호": ["00000042", "1.0E+02"]}))
+    assert df[PID_KEY_COLUMN].tolist() == [42, 100]
+    assert add_pid_key_column(pd.DataFrame({"x": [1]}))[PID_KEY_COLUMN].isna().all()
@@ -0,0 +1,91 @@
+# tests/test_rate_limiter.py
+
+import smtplib
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import rate_limiter
+from config import RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_MAX_ATTEMPTS
+
+
+class FakeClock:
+    """time.monotonic/sleep 대역: sleep하면 시각만 앞으로 옮기고 대기 시간을 기록합니다."""
+    def __init__(self):
+        self.now = 0.0; self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds); self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """버킷/통계를 비우고 시계와 지터를 고정합니다. (지터는 항상 최대 대기 시간)"""
+    fake_clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", fake_clock)
+    monkeypatch.setattr(rate_limiter, "_buckets", {})
+    monkeypatch.setattr(rate_limiter, "_stats", {})
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: high)
+    return fake_clock
+
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+# --- 백오프 / 재시도 판별 ---
+def test_backoff_grows_exponentially_up_to_the_cap(clock):
+    assert [rate_limiter.backoff_seconds(attempt) for attempt in range(4)] == [1.0, 2.0, 4.0, 8.0]
+    assert rate_limiter.backoff_seconds(20) == RATE_LIMIT_BACKOFF_MAX
+
+def test_is_retryable_error():
+    assert rate_limiter.is_retryable_error(_http_error(429))
+    assert rate_limiter.is_retryable_error(_http_error(503))
+    assert not rate_limiter.is_retryable_error(_http_error(404))
+    assert rate_limiter.is_retryable_error(smtplib.SMTPResponseException(421, b"try later"))
+    assert not rate_limiter.is_retryable_error(smtplib.SMTPResponseException(550, b"no such user"))
+    assert rate_limiter.is_retryable_error(smtplib.SMTPServerDisconnected())
+    assert not rate_limiter.is_retryable_error(ValueError("bad input"))
+
+
+# --- 토큰 버킷 / 호출 ---
+def test_acquire_waits_after_the_burst(clock):
+    for _ in range(rate_limiter.RATE_LIMITS["smtp"]["burst"]):
+        rate_limiter.acquire("smtp", "sender")
+    assert clock.sleeps == []
+    rate_limiter.acquire("smtp", "sender")
+    assert clock.sleeps == [1.0 / rate_limiter.RATE_LIMITS["smtp"]["rate"]]
+
+def test_call_with_backoff_retries_and_slows_the_account(clock):
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3: raise smtplib.SMTPServerDisconnected()
+        return "ok"
+
+    assert rate_limiter.call_with_backoff("smtp", "sender", flaky) == "ok"
+    assert len(attempts) == 3
+    # 재시도마다 백오프(1초, 2초) 후, 절반으로 낮아진 속도에 맞춰 다음 토큰을 기다립니다.
+    assert clock.sleeps == [1.0, 1.0, 2.0, 2.0]
+    throughput = rate_limiter.get_throughput("smtp")
+    assert throughput["retries"] == 2 and throughput["throttled"] == 2
+    assert throughput["current_rates"]["sender"] < rate_limiter.RATE_LIMITS["smtp"]["rate"]
+
+def test_call_with_backoff_gives_up(clock):
+    calls = []
+    def not_retryable():
+        calls.append(1); raise ValueError("bad input")
+    with pytest.raises(ValueError):
+        rate_limiter.call_with_backoff("calendar", "user", not_retryable)
+    assert len(calls) == 1
+
+    def always_throttled():
+        calls.append(1); raise _http_error(429)
+    calls.clear()
+    with pytest.raises(HttpError):
+        rate_limiter.call_with_backoff("calendar", "user", always_throttled)
+    assert len(calls) == RATE_LIMIT_MAX_ATTEMPTS
+    assert rate_limiter.get_throughput("calendar")["failed"] == 2
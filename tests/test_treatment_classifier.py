@@ -0,0 +1,33 @@
+# tests/test_treatment_classifier.py
+
+import pandas as pd
+
+import treatment_classifier
+
+BONDING = treatment_classifier.flag_column("bonding")
+
+
+def test_classify_treatments_applies_include_and_exclude_rules():
+    flags = treatment_classifier.classify_treatments(pd.Series(["Bonding", "debonding", "본딩 예정", "검진", None]), "교정")
+    assert flags[BONDING].tolist() == [True, False, True, False, False]
+
+def test_classify_treatments_only_for_listed_departments():
+    flags = treatment_classifier.classify_treatments(pd.Series(["bonding"]), "보철")
+    assert flags[BONDING].tolist() == [False]
+
+def test_add_treatment_flags_and_bold_mask():
+    df = treatment_classifier.add_treatment_flags(pd.DataFrame({"진료내역": ["bonding", "검진"]}), "교정")
+    assert treatment_classifier.flag_columns(df) == [BONDING]
+    assert treatment_classifier.bold_mask(df).tolist() == [True, False]
+
+    df.loc[len(df)] = [" ", " "] # 구분자 행
+    assert treatment_classifier.bold_mask(df).tolist() == [True, False, False]
+
+    no_treatment = treatment_classifier.add_treatment_flags(pd.DataFrame({"x": [1]}), "교정")
+    assert no_treatment[BONDING].tolist() == [False]
+
+def test_is_bold_treatment_matches_the_vector_rules():
+    assert treatment_classifier.is_bold_treatment(" BONDING ", "교정")
+    assert not treatment_classifier.is_bold_treatment("debonding", "교정")
+    assert not treatment_classifier.is_bold_treatment("bonding", "보철")
+    assert not treatment_classifier.is_bold_treatment(None, "교정")
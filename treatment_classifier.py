@@ -0,0 +1,83 @@
+# treatment_classifier.py
+
+import re
+
+import pandas as pd
+
+from config import TREATMENT_CATEGORIES
+
+# 진료내역 분류기: 스타일링(굵게 표시)과 분석(집계 조건)이 같은 규칙을 쓰도록 한 곳에 모읍니다.
+# 정규식은 모듈을 불러올 때 한 번만 컴파일하고, OCS 수집 단계에서 시트마다 한 번의 벡터 연산으로
+# 모든 행에 '_tx_{분류}' 플래그 컬럼을 붙입니다. 이후 단계는 문자열을 다시 검사하지 않고 플래그만 읽습니다.
+
+TREATMENT_FLAG_PREFIX = '_tx_'
+
+def _compile_categories(categories):
+    """설정의 분류 규칙을 {분류: {'include', 'exclude', 'departments', 'bold'}} 형태로 컴파일합니다."""
+    return {
+        name: {
+            "include": re.compile(rule['include'], re.IGNORECASE),
+            "exclude": re.compile(rule['exclude'], re.IGNORECASE) if rule.get('exclude') else None,
+            "departments": set(rule['departments']) if rule.get('departments') is not None else None,
+            "bold": bool(rule.get('bold')),
+        }
+        for name, rule in categories.items()
+    }
+
+_COMPILED_CATEGORIES = _compile_categories(TREATMENT_CATEGORIES)
+BOLD_CATEGORIES = [name for name, rule in _COMPILED_CATEGORIES.items() if rule["bold"]]
+
+def flag_column(category):
+    """분류 플래그 컬럼 이름 (예: 'bonding' -> '_tx_bonding')"""
+    return f"{TREATMENT_FLAG_PREFIX}{category}"
+
+def flag_columns(df):
+    """DataFrame에 들어 있는 분류 플래그 컬럼 목록"""
+    return [col for col in df.columns if str(col).startswith(TREATMENT_FLAG_PREFIX)]
+
+def _applies_to(rule, dept):
+    return rule["departments"] is None or dept in rule["departments"]
+
+
+# --- 1. 벡터 분류 (수집 단계) ---
+def classify_treatments(treatment_series, dept):
+    """진료내역 Series를 분류해 {플래그 컬럼: bool Series} DataFrame을 반환합니다. 해당 진료과에 적용되지 않는 분류는 모두 False."""
+    text = treatment_series.astype(str).str.strip()
+    flags = {}
+    for name, rule in _COMPILED_CATEGORIES.items():
+        if not _applies_to(rule, dept):
+            flags[flag_column(name)] = pd.Series(False, index=treatment_series.index)
+            continue
+        matched = text.str.contains(rule["include"], na=False)
+        if rule["exclude"] is not None:
+            matched &= ~text.str.contains(rule["exclude"], na=False)
+        flags[flag_column(name)] = matched
+    return pd.DataFrame(flags, index=treatment_series.index)
+
+def add_treatment_flags(df, dept):
+    """DataFrame에 분류 플래그 컬럼을 붙입니다. (진료내역 컬럼이 없으면 모두 False)"""
+    treatment = df['진료내역'] if '진료내역' in df.columns else pd.Series("", index=df.index)
+    for col, values in classify_treatments(treatment, dept).items():
+        df[col] = values
+    return df
+
+def bold_mask(df):
+    """플래그 컬럼으로 굵게 표시할 행 마스크를 만듭니다. (구분자 행의 ' ' 등 bool이 아닌 값은 False)"""
+    mask = pd.Series(False, index=df.index)
+    for name in BOLD_CATEGORIES:
+        if flag_column(name) in df.columns:
+            mask |= df[flag_column(name)].eq(True)
+    return mask
+
+
+# --- 2. 단일 값 분류 (증분 재스타일링) ---
+def is_bold_treatment(treatment_value, dept):
+    """진료내역 값 하나가 굵게 표시할 분류에 해당하는지 확인합니다. (이미 저장된 엑셀을 다시 스타일링할 때 사용)"""
+    if treatment_value is None:
+        return False
+    text = str(treatment_value).strip()
+    for name in BOLD_CATEGORIES:
+        rule = _COMPILED_CATEGORIES[name]
+        if _applies_to(rule, dept) and rule["include"].search(text) and not (rule["exclude"] and rule["exclude"].search(text)):
+            return True
+    return False
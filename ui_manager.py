@@ -4,27 +4,39 @@ import streamlit as st
 import pandas as pd
 import io
 import datetime
-from googleapiclient.discovery import build
 import os
 import re
 import bcrypt
 import json
-from google.auth.transport.requests import Request # 💡 토큰 갱신을 위해 추가됨
 
 # local imports
 from config import (
-    DEFAULT_PASSWORD, DEPARTMENTS_FOR_REGISTRATION, PATIENT_DEPT_FLAGS, 
-    SHEET_KEYWORD_TO_DEPARTMENT_MAP, PATIENT_DEPT_TO_SHEET_MAP
+    DEFAULT_PASSWORD, DEPARTMENTS_FOR_REGISTRATION, 
+    SHEET_KEYWORD_TO_DEPARTMENT_MAP, PATIENT_DEPT_TO_SHEET_MAP, ANALYSIS_RULES, PATIENT_PAGE_SIZE, USER_PAGE_SIZE, DISPATCH_JOB_POLL_SECONDS,
+    OCS_PRUNE_IRRELEVANT_SHEETS
 )
 from firebase_utils import (
     get_db_refs, sanitize_path, recover_email, 
-    get_google_calendar_service, save_google_creds_to_firebase, load_google_creds_from_firebase
+    get_google_calendar_service
 )
 import excel_utils
+import batch_utils
+import ocs_cache
+import ocs_state_cache
+import ocs_history
+import approver_routing
+import dispatch_outbox
+import dispatch_jobs
+import upload_io
+import patient_store
+import user_directory
+import dept_codes
 from notification_utils import (
-    is_valid_email, send_email, create_calendar_event, 
-    get_matching_data, run_auto_notifications
+    is_valid_email, send_email, create_calendar_event, load_calendar_service,
+    run_auto_notifications, summarize_dispatch_plan, build_dispatch_plan,
+    create_match_state, apply_registration_deltas, get_match_results
 )
+from notification_templates import render_notification_email, visible_columns, DOCTOR_EMAIL_COLUMNS
 from professor_reviews_module import show_professor_review_system 
 
 # DB 레퍼런스 초기 로드
@@ -65,16 +77,13 @@ def fragment_password_change(firebase_key, ref_object, role_prefix):
             st.error("불일치")
 
 @st.fragment
-def fragment_single_registration(existing_patient_data, patients_ref_for_user):
+def fragment_single_registration(patient_cache, patients_ref_for_user):
     """환자 단일 등록 폼 처리 구역"""
     with st.form("register_form"):
         name = st.text_input("환자명"); pid = st.text_input("진료번호"); selected_departments = st.multiselect("진료과", DEPARTMENTS_FOR_REGISTRATION)
         if st.form_submit_button("등록"):
             if name and pid and selected_departments:
-                pid_key = pid.strip(); new_patient_data = existing_patient_data.get(pid_key, {"환자이름": name, "진료번호": pid}) 
-                for dept_flag in PATIENT_DEPT_FLAGS + ['치주', '원진실']: new_patient_data[dept_flag.lower()] = False
-                for dept in selected_departments: new_patient_data[dept.lower()] = True
-                patients_ref_for_user.child(pid_key).set(new_patient_data)
+                patient_store.register_patient(patient_cache, patients_ref_for_user, name, pid, selected_departments) # 세션 캐시에도 반영
                 st.success("등록 완료"); st.rerun() # 목록 업데이트를 위해 전체 새로고침
             else: st.warning("입력 확인")
 
@@ -85,31 +94,12 @@ def fragment_manual_student_mail(selected_matched_users_data, sender, sender_pw,
         for user_match_info in selected_matched_users_data:
             real_email = user_match_info['email']; df_matched = user_match_info['data']; user_name = user_match_info['name']
             user_number = user_match_info.get('number', '')
-            email_cols = ['환자명', '진료번호', '예약의사', '진료내역', '예약일시', '예약시간', '등록과']
-            df_for_mail = df_matched[[col for col in email_cols if col in df_matched.columns]]
-            rows_as_dict = df_for_mail.to_dict('records')
-            df_html = df_for_mail.to_html(index=False, escape=False)
-            
-            text_lines = []
-            u_num = str(user_number).strip(); u_name = str(user_name).strip()
-            for _, row in df_matched.iterrows():
-                try:
-                    raw_date = str(row.get('예약일시', '')).strip().replace('-', '/').replace('.', '/')
-                    raw_time = str(row.get('예약시간', '')).strip()
-                    date_digits = re.sub(r'[^0-9]', '', raw_date)
-                    mmdd = date_digits[-4:] if len(date_digits) >= 4 else "0000"
-                    time_digits = re.sub(r'[^0-9]', '', raw_time)
-                    hhmm = time_digits.zfill(4) if len(time_digits) <= 4 else time_digits[:4]
-                    line = f"{row.get('예약의사','')},{mmdd},{hhmm},{row.get('환자명','')},{row.get('진료번호','')},{u_num},{u_name}"
-                    text_lines.append(line)
-                except: continue
-            formatted_text_html = "<br>".join(text_lines)
-            email_body = f"""<p>안녕하세요, {user_name}님.</p><p>{file_name} 분석 결과, 내원 예정인 환자 진료 정보입니다.</p>{df_html}
-            <br><br><div style='font-family: sans-serif; font-size: 14px; line-height: 1.6; color: #333;'>{formatted_text_html}</div><p>확인 부탁드립니다.</p>"""
-            try: 
-                send_email(real_email, rows_as_dict, sender, sender_pw, custom_message=email_body, date_str=file_name)
-                st.success(f"**{user_name}**님에게 메일 전송 완료!")
-            except Exception as e: st.error(f"**{user_name}**님에게 메일 전송 실패: {e}")
+            email_body, rows_as_dict = render_notification_email(
+                user_name, user_number, df_matched, f"{file_name} 분석 결과, 내원 예정인 환자 진료 정보입니다."
+            )
+            send_result = send_email(real_email, rows_as_dict, sender, sender_pw, custom_message=email_body, date_str=file_name)
+            if send_result is True: st.success(f"**{user_name}**님에게 메일 전송 완료!")
+            else: st.error(f"**{user_name}**님에게 메일 전송 실패: {send_result}")
 
 @st.fragment
 def fragment_manual_student_calendar(selected_matched_users_data, is_daily):
@@ -118,19 +108,11 @@ def fragment_manual_student_calendar(selected_matched_users_data, is_daily):
         for user_match_info in selected_matched_users_data:
             user_safe_key = user_match_info['safe_key']; user_name = user_match_info['name']; df_matched = user_match_info['data']
             user_number = user_match_info.get('number', '')
-            creds = load_google_creds_from_firebase(user_safe_key) 
-            
-            # 💡 [핵심 추가] 토큰이 만료되었으면 자동으로 새 토큰으로 갱신!
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                    save_google_creds_to_firebase(user_safe_key, creds)
-                except: pass
+            service = load_calendar_service(user_safe_key) # 만료된 토큰은 자동 갱신
 
-            if creds and creds.valid and not creds.expired:
-                successful_adds = 0
+            if service is not None:
+                successful_adds = 0; failed_adds = 0
                 try:
-                    service = build('calendar', 'v3', credentials=creds)
                     for index, row in df_matched.iterrows():
                         reservation_date_raw = row.get('예약일시', ''); reservation_time_raw = row.get('예약시간', '')
                         if reservation_date_raw and reservation_time_raw:
@@ -140,10 +122,13 @@ def fragment_manual_student_calendar(selected_matched_users_data, is_daily):
                                 success = create_calendar_event(
                                     service, row.get('환자명', 'N/A'), row.get('진료번호', ''), row.get('등록과', ''), 
                                     reservation_datetime, row.get('예약의사', 'N/A'), row.get('진료내역', ''), is_daily,
-                                    user_name=user_name, user_number=user_number
+                                    user_name=user_name, user_number=user_number, approver_suffix=row.get('_approver_suffix'),
+                                    calendar_account=user_safe_key
                                 )
                                 if success: successful_adds += 1
-                            except: pass
+                                else: failed_adds += 1
+                            except ValueError: failed_adds += 1 # 예약일시/시간 형식 오류
+                    if failed_adds: st.warning(f"**{user_name}**님 일정 {failed_adds}건 추가 실패.")
                     if successful_adds > 0: st.success(f"**{user_name}**님 캘린더에 {successful_adds}건 추가 완료.")
                     else: st.warning(f"**{user_name}**님 캘린더에 추가된 일정 없음.")
                 except Exception as e: st.error(f"❌ {user_name} 캘린더 오류: {e}")
@@ -153,35 +138,18 @@ def fragment_manual_student_calendar(selected_matched_users_data, is_daily):
 def fragment_manual_doctor_mail(selected_doctors_to_act, sender, sender_pw, db_ref_func):
     """의사 대상 수동 메일 전송 로딩 처리 구역"""
     if st.button("선택된 치과의사에게 메일 보내기", key="manual_send_mail_doctor"):
+        latest_file_name = db_ref_func("ocs_analysis/latest_file_name").get()
         for res in selected_doctors_to_act:
-            df_matched = res['data']; latest_file_name = db_ref_func("ocs_analysis/latest_file_name").get()
+            df_matched = res['data']
             user_name = res['name']; user_number = res.get('number', '')
+            email_body, rows_as_dict = render_notification_email(
+                user_name, user_number, df_matched, f"{latest_file_name}에서 가져온 내원할 환자 정보입니다.",
+                recipient=f"{res['name']} 치과의사님", columns=DOCTOR_EMAIL_COLUMNS
+            )
             
-            email_cols = ['환자명', '진료번호', '예약의사', '진료내역', '예약일시', '예약시간']; 
-            df_for_mail = df_matched[[col for col in email_cols if col in df_matched.columns]]
-            df_html = df_for_mail.to_html(index=False, border=1); rows_as_dict = df_for_mail.to_dict('records')
-            
-            text_lines = []
-            u_num = str(user_number).strip(); u_name = str(user_name).strip()
-            for _, row in df_matched.iterrows():
-                try:
-                    raw_date = str(row.get('예약일시', '')).strip().replace('-', '/').replace('.', '/')
-                    raw_time = str(row.get('예약시간', '')).strip()
-                    date_digits = re.sub(r'[^0-9]', '', raw_date)
-                    mmdd = date_digits[-4:] if len(date_digits) >= 4 else "0000"
-                    time_digits = re.sub(r'[^0-9]', '', raw_time)
-                    hhmm = time_digits.zfill(4) if len(time_digits) <= 4 else time_digits[:4]
-                    line = f"{row.get('예약의사','')},{mmdd},{hhmm},{row.get('환자명','')},{row.get('진료번호','')},{u_num},{u_name}"
-                    text_lines.append(line)
-                except: continue
-            formatted_text_html = "<br>".join(text_lines)
-            email_body = f"""<p>안녕하세요, {res['name']} 치과의사님.</p><p>{latest_file_name}에서 가져온 내원할 환자 정보입니다.</p>{df_html}
-            <br><br><div style='font-family: sans-serif; font-size: 14px; line-height: 1.6; color: #333;'>{formatted_text_html}</div><p>확인 부탁드립니다.</p>"""
-            
-            try: 
-                send_email(res['email'], rows_as_dict, sender, sender_pw, custom_message=email_body, date_str=latest_file_name)
-                st.success(f"**Dr. {res['name']}**에게 메일 전송 완료!")
-            except Exception as e: st.error(f"**Dr. {res['name']}**에게 메일 전송 실패: {e}")
+            send_result = send_email(res['email'], rows_as_dict, sender, sender_pw, custom_message=email_body, date_str=latest_file_name)
+            if send_result is True: st.success(f"**Dr. {res['name']}**에게 메일 전송 완료!")
+            else: st.error(f"**Dr. {res['name']}**에게 메일 전송 실패: {send_result}")
 
 @st.fragment
 def fragment_manual_doctor_calendar(selected_doctors_to_act, is_daily):
@@ -190,19 +158,11 @@ def fragment_manual_doctor_calendar(selected_doctors_to_act, is_daily):
         for res in selected_doctors_to_act:
             user_safe_key = res['safe_key']; user_name = res['name']; df_matched = res['data']
             user_number = res.get('number', '')
-            creds = load_google_creds_from_firebase(user_safe_key) 
-            
-            # 💡 [핵심 추가] 토큰이 만료되었으면 자동으로 새 토큰으로 갱신!
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                    save_google_creds_to_firebase(user_safe_key, creds)
-                except: pass
+            service = load_calendar_service(user_safe_key) # 만료된 토큰은 자동 갱신
 
-            if creds and creds.valid and not creds.expired:
-                successful_adds = 0
+            if service is not None:
+                successful_adds = 0; failed_adds = 0
                 try:
-                    service = build('calendar', 'v3', credentials=creds)
                     for index, row in df_matched.iterrows():
                         reservation_date_raw = row.get('예약일시', ''); reservation_time_raw = row.get('예약시간', '')
                         if reservation_date_raw and reservation_time_raw:
@@ -212,15 +172,38 @@ def fragment_manual_doctor_calendar(selected_doctors_to_act, is_daily):
                                 success = create_calendar_event(
                                     service, row.get('환자명', 'N/A'), row.get('진료번호', ''), res.get('department', 'N/A'), 
                                     reservation_datetime, row.get('예약의사', ''), row.get('진료내역', ''), is_daily,
-                                    user_name=user_name, user_number=user_number
+                                    user_name=user_name, user_number=user_number, approver_suffix=row.get('_approver_suffix'),
+                                    calendar_account=user_safe_key
                                 )
                                 if success: successful_adds += 1
-                            except: pass
+                                else: failed_adds += 1
+                            except ValueError: failed_adds += 1 # 예약일시/시간 형식 오류
+                    if failed_adds: st.warning(f"**Dr. {user_name}**님 일정 {failed_adds}건 추가 실패.")
                     if successful_adds > 0: st.success(f"**Dr. {user_name}**님 캘린더에 {successful_adds}건 추가 완료.")
                     else: st.warning(f"**Dr. {user_name}**님 캘린더에 추가된 일정 없음.")
                 except Exception as e: st.error(f"❌ 오류: {e}")
             else: st.warning(f"⚠️ **Dr. {res['name']}**님은 캘린더 미연동.")
 
+def _show_dispatch_job_status(job):
+    """백그라운드 자동 전송 작업의 진행률/카운터/수신자별 결과를 표시합니다."""
+    counts = job["counts"]
+    st.progress(job["done"] / job["total"] if job["total"] else 1.0, text=f"수신자 {job['done']}/{job['total']}명 처리")
+    col_mail, col_cal, col_skip = st.columns(3)
+    col_mail.metric("메일", f"완료 {counts['emails_ok']} / 실패 {counts['emails_failed']}")
+    col_cal.metric("캘린더", f"완료 {counts['calendars_ok']} / 실패 {counts['calendars_failed']}")
+    col_skip.metric("건너뜀 (이미 전송)", counts["emails_skipped"] + counts["calendars_skipped"])
+    if job["log"]:
+        st.dataframe(pd.DataFrame(job["log"][::-1]), use_container_width=True, height=240)
+
+@st.fragment(run_every=DISPATCH_JOB_POLL_SECONDS)
+def fragment_dispatch_job_progress(job_id):
+    """실행 중인 자동 전송 작업의 진행 상황을 주기적으로 다시 읽어 표시합니다. 작업이 끝나면 화면 전체를 새로고침합니다."""
+    job = dispatch_jobs.get_job(job_id)
+    if job is None or job["status"] != dispatch_jobs.STATUS_RUNNING:
+        st.rerun()
+    st.info(f"⏳ 자동 전송 진행 중 (작업 {job_id}, {job['started_at']} 시작). 다른 화면을 사용해도 전송은 계속됩니다.")
+    _show_dispatch_job_status(job)
+
 
 # --- 1. 세션 상태 초기화 및 전역 UI ---
 
@@ -238,6 +221,7 @@ def init_session_state():
     if 'google_calendar_auth_needed' not in st.session_state: st.session_state.google_calendar_auth_needed = False
     if 'google_creds' not in st.session_state: st.session_state['google_creds'] = {}
     if 'auto_run_confirmed' not in st.session_state: st.session_state.auto_run_confirmed = None 
+    if 'dispatch_job_id' not in st.session_state: st.session_state.dispatch_job_id = None
     if 'current_user_role' not in st.session_state: st.session_state.current_user_role = 'user'
     if 'current_user_dept' not in st.session_state: st.session_state.current_user_dept = None
     if 'delete_patient_confirm' not in st.session_state: st.session_state.delete_patient_confirm = False
@@ -402,12 +386,14 @@ def show_login_and_registration():
                 elif users_ref.child(new_firebase_key).get(): st.error("이미 등록된 이메일입니다.")
                 else:
                     hashed_pw = hash_password(password_input)
-                    users_ref.child(new_firebase_key).set({
+                    new_user = {
                         "name": st.session_state.current_user_name, 
                         "email": new_email_input, 
                         "number": new_number_input, 
                         "password": hashed_pw
-                    })
+                    }
+                    users_ref.child(new_firebase_key).set(new_user)
+                    user_directory.index_account(db_ref_func, "student", new_firebase_key, new_user)
                     st.session_state.update({'current_firebase_key': new_firebase_key, 'found_user_email': new_email_input, 'login_mode': 'user_mode'})
                     st.success("등록 완료"); st.rerun()
             else: st.error("올바른 이메일과 비밀번호를 입력하세요.")
@@ -427,14 +413,16 @@ def show_login_and_registration():
                 if doctor_users_ref is None: st.error("🚨 데이터베이스 연결 오류")
                 else:
                     hashed_pw = hash_password(password_input)
-                    doctor_users_ref.child(new_firebase_key).set({
+                    new_doctor = {
                         "name": new_doctor_name_input, 
                         "email": user_id_input, 
                         "number": new_doc_number_input, 
                         "password": hashed_pw, 
                         "role": 'doctor', 
                         "department": department
-                    })
+                    }
+                    doctor_users_ref.child(new_firebase_key).set(new_doctor)
+                    user_directory.index_account(db_ref_func, "doctor", new_firebase_key, new_doctor)
                     st.session_state.update({'current_firebase_key': new_firebase_key, 'found_user_email': user_id_input, 'current_user_name': new_doctor_name_input, 'current_user_dept': department, 'login_mode': 'doctor_mode'})
                     st.success("등록 완료"); st.rerun()
             else: st.error("모든 정보를 올바르게 입력해주세요.")
@@ -442,6 +430,57 @@ def show_login_and_registration():
 
 # --- 3. 관리자 모드 UI ---
 
+def _show_account_directory(kind, columns):
+    """
+    관리자 계정 목록을 표시하고 선택한 계정 [{'key', 표시 필드...}]을 반환합니다.
+    전체 계정을 읽지 않고 투영 인덱스(user_directory)에서 보이는 페이지/검색 결과만 가져옵니다.
+    """
+    search_col, order_col = st.columns([2, 1])
+    with search_col: account_query = st.text_input("검색 (이름 또는 이메일 앞부분)", key=f"{kind}_account_query")
+    with order_col: order_label = st.selectbox("정렬", ["이름순", "이메일순"], key=f"{kind}_account_order")
+    account_cache = user_directory.get_directory_cache(kind, "name" if order_label == "이름순" else "email")
+    index_total, source_total = user_directory.get_counts(account_cache, db_ref_func)
+    if index_total != source_total:
+        st.warning(f"⚠️ 계정 목록 인덱스({index_total}명)가 실제 계정 수({source_total}명)와 다릅니다. 인덱스를 다시 만들어 주세요.")
+        if st.button("계정 목록 인덱스 다시 만들기", key=f"{kind}_backfill_index_btn"):
+            written_count = user_directory.backfill_index(db_ref_func, kind); st.success(f"✅ {written_count}명 반영 완료"); st.rerun()
+
+    page_state_key = f"{kind}_account_page"
+    if account_query.strip():
+        visible_accounts = user_directory.search_accounts(account_cache, db_ref_func, account_query)
+        st.caption(f"검색 결과 {len(visible_accounts)}명 (전체 {index_total}명)")
+    else:
+        page_number = st.session_state.get(page_state_key, 0)
+        visible_accounts = user_directory.load_page(account_cache, db_ref_func, page_number)
+        if not visible_accounts and page_number > 0:
+            st.session_state[page_state_key] = page_number = 0
+            visible_accounts = user_directory.load_page(account_cache, db_ref_func, 0)
+        st.caption(f"전체 {index_total}명 중 {page_number * USER_PAGE_SIZE + 1 if visible_accounts else 0}-{page_number * USER_PAGE_SIZE + len(visible_accounts)}번째 ({order_label})")
+
+    if not visible_accounts:
+        st.info("검색된 계정 없음" if account_query.strip() else "등록된 계정 없음")
+        return []
+    st.dataframe(pd.DataFrame([val for _, val in visible_accounts])[columns], use_container_width=True)
+    if not account_query.strip():
+        prev_col, next_col = st.columns(2)
+        with prev_col:
+            if page_number > 0 and st.button("◀ 이전", key=f"{kind}_account_prev_page"): st.session_state[page_state_key] = page_number - 1; st.rerun()
+        with next_col:
+            if user_directory.has_next_page(account_cache, page_number) and st.button("다음 ▶", key=f"{kind}_account_next_page"):
+                st.session_state[page_state_key] = page_number + 1; st.rerun()
+    st.markdown("---")
+
+    # 선택은 계정 키로 보관하므로 페이지/검색을 바꿔도 이미 고른 계정이 유지됩니다.
+    records = account_cache["records"]
+    selected_keys = [key for key in st.session_state.get(f"{kind}_account_select", []) if key in records]
+    options = list(dict.fromkeys(selected_keys + [key for key, _ in visible_accounts]))
+    selected_keys = st.multiselect(
+        "메일 발송 또는 삭제할 계정:", options=options, default=selected_keys, key=f"{kind}_account_select",
+        format_func=lambda key: f"{records[key].get('name', '')} ({records[key].get('email', '')})"
+    )
+    return [{"key": key, **records[key]} for key in selected_keys]
+
+
 def show_admin_mode_ui():
     """관리자 모드 (엑셀 업로드, 알림 전송) UI를 표시합니다."""
     st.markdown("---")
@@ -455,7 +494,49 @@ def show_admin_mode_ui():
     
     with tab_excel:
         st.subheader("💻 Excel File Processor")
+        with st.expander("📦 여러 OCS 파일 일괄 처리 (배치 모드)", expanded=False):
+            batch_files = st.file_uploader("OCS 파일 여러 개 업로드 (예: 일주일치 ocs_MMDD.xlsx)", type=["xlsx", "xlsm"], accept_multiple_files=True, key="batch_file_uploader")
+            batch_password = st.text_input("파일 비밀번호 (암호화된 경우, 모든 파일 공통)", type="password", key="batch_password")
+            if batch_files and st.button(f"일괄 처리 실행 ({len(batch_files)}개 파일)", key="batch_run_btn"):
+                batch_progress = st.progress(0.0, text="병렬 처리 시작...")
+                def _on_batch_progress(done_count, total_count, result):
+                    status = "실패" if result["error"] else "완료"
+                    batch_progress.progress(done_count / total_count, text=f"{result['file_name']} {status} ({done_count}/{total_count})")
+
+                batch_patients_data = db_ref("patients").get()
+                batch_results = batch_utils.run_batch_processing(
+                    [(f.name, f.getvalue()) for f in batch_files], batch_password or None,
+                    excel_utils.build_registered_pids(batch_patients_data), progress_callback=_on_batch_progress
+                )
+                merged_matches_df = batch_utils.merge_batch_match_results(batch_results, users_ref.get(), batch_patients_data, doctor_users_ref.get())
+                st.session_state.batch_zip_bytes = batch_utils.build_batch_zip(batch_results, merged_matches_df)
+                for result in batch_results:
+                    if result["error"]: st.error(f"❌ {result['file_name']}: {result['error']}")
+                st.success(f"✅ {len(batch_results)}개 파일 처리 완료 (매칭 행 {len(merged_matches_df)}건)")
+
+            if st.session_state.get('batch_zip_bytes'):
+                st.download_button("일괄 처리 결과 다운로드 (zip)", data=st.session_state.batch_zip_bytes, file_name="ocs_batch_results.zip", mime="application/zip", key="batch_zip_download")
+
+        if ocs_cache.is_cache_enabled():
+            with st.expander("🗂️ 처리 이력 (암호화 캐시)", expanded=False):
+                cached_uploads = ocs_cache.list_cached_uploads()
+                if cached_uploads:
+                    history_options = {f"{m['file_name']} ({m['created_at']})": m['cache_id'] for m in cached_uploads}
+                    selected_history = st.selectbox("처리 이력 선택", list(history_options.keys()), key="ocs_history_select")
+                    history_manifest = ocs_cache.load_manifest(history_options[selected_history])
+                    st.dataframe(pd.DataFrame([{"시트": sh["name"], "행 수": sh["rows"]} for sh in history_manifest["sheets"]]), use_container_width=True)
+                    if st.button("캐시 데이터로 분석 다시 실행", key="ocs_history_reanalyze_btn"):
+                        history_upload = ocs_cache.load_processed_upload(history_manifest["cache_id"])
+                        if history_upload: st.json(excel_utils.run_analysis(history_upload[0]))
+                        else: st.error("캐시를 읽을 수 없습니다.")
+                    elif history_manifest.get("analysis"): st.json(history_manifest["analysis"])
+                else: st.info("저장된 처리 이력이 없습니다.")
+        
         uploaded_file = st.file_uploader("암호화된 Excel 파일을 업로드하세요", type=["xlsx", "xlsm"])
+        prune_sheets = st.checkbox(
+            "필요한 진료과 시트만 처리 (등록 환자·치과의사 계정·분석 대상이 없는 시트는 건너뜀)",
+            value=OCS_PRUNE_IRRELEVANT_SHEETS, key="ocs_prune_sheets"
+        )
         
         if uploaded_file:
             file_name = uploaded_file.name; 
@@ -466,55 +547,160 @@ def show_admin_mode_ui():
                 password = st.text_input("⚠️ 암호화된 파일입니다. 비밀번호를 입력해주세요.", type="password", key="admin_password_file")
                 if not password: st.info("비밀번호 입력 대기 중..."); st.stop()
 
-            try:
-                xl_object, raw_file_io = excel_utils.load_excel(uploaded_file, password)
-                excel_data_dfs_raw, styled_excel_bytes = excel_utils.process_excel_file_and_style(raw_file_io, db_ref_func)
-                analysis_results = excel_utils.run_analysis(excel_data_dfs_raw)
-                
-                if analysis_results and any(analysis_results.values()): 
-                    today_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-                    db_ref("ocs_analysis/latest_result").set(analysis_results)
-                    db_ref("ocs_analysis/latest_date").set(today_date_str)
-                    db_ref("ocs_analysis/latest_file_name").set(file_name)
-                else: st.warning("⚠️ 분석 결과가 비어 있어 Firebase에 저장하지 않았습니다.")
-                
-                st.session_state.last_processed_data = excel_data_dfs_raw; st.session_state.last_processed_file_name = file_name
-
-                if styled_excel_bytes:
-                    output_filename = uploaded_file.name.replace(".xlsx", "_processed.xlsx").replace(".xlsm", "_processed.xlsm")
-                    st.download_button("처리된 엑셀 다운로드", data=styled_excel_bytes, file_name=output_filename, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                    st.success("✅ 파일 처리 완료. 알림 전송 방법을 선택하세요.")
-                else: st.warning("처리할 데이터가 없습니다.")
+            # 등록 스냅샷은 재실행마다 한 번만 읽어 스타일링과 매칭에 함께 사용합니다.
+            all_users_meta = users_ref.get(); all_patients_data = db_ref("patients").get()
+            all_doctors_meta = doctor_users_ref.get()
+
+            # 💡 [최적화] 등록 환자/치과의사가 없는 진료과 시트는 읽지 않습니다. (필요한 진료과가 바뀌면 다시 처리)
+            registered_pids = excel_utils.build_registered_pids(all_patients_data)
+            sheet_relevance = excel_utils.build_sheet_relevance(registered_pids, all_patients_data, all_doctors_meta) if prune_sheets else None
+            sheet_signature = excel_utils.sheet_relevance_signature(sheet_relevance)
+
+            # 💡 [최적화] 같은 파일이면 재실행(rerun) 시 복호화/정렬/스타일링을 다시 하지 않습니다.
+            upload_key = f"{file_name}:{uploaded_file.size}:{sheet_signature}"
+            # 💡 [최적화] 처리된 OCS 상태는 모든 관리자 세션이 공유하는 서버 캐시에 두고, 세션에는 캐시 ID만 보관합니다.
+            ocs_state = ocs_state_cache.get_state(st.session_state.get('ocs_state_id'))
+            if st.session_state.get('last_processed_key') != upload_key or ocs_state is None:
+                try:
+                    # 같은 파일(+비밀번호)을 다른 탭/세션에서 이미 처리했다면 공유 캐시(메모리 → 디스크)에서 바로 가져옵니다.
+                    cache_id = ocs_cache.compute_upload_cache_id(uploaded_file, password, variant=sheet_signature) # 업로드 버퍼를 나눠 읽어 해시 (복사본 없음)
+                    # 전송 기록(outbox)은 시트 선별 방식과 관계없이 업로드 내용 해시로 찾습니다.
+                    upload_id = ocs_cache.compute_upload_cache_id(uploaded_file, password)
+                    ocs_state = ocs_state_cache.get_state(cache_id)
+                    if ocs_state:
+                        st.info("⚡ 이전에 처리한 파일입니다. 캐시된 데이터를 사용합니다.")
+                        st.session_state.ocs_memory_profile = None; st.session_state.ocs_skipped_sheets = None
+                    else:
+                        memory_profile = []; skipped_sheets = []
+                        raw_file_io = excel_utils.load_excel(uploaded_file, password, profile=memory_profile)
+                        excel_data_dfs_raw, styled_excel_file = excel_utils.process_excel_file_and_style(
+                            raw_file_io, db_ref_func, registered_pids, profile=memory_profile,
+                            sheet_relevance=sheet_relevance, skipped_sheets=skipped_sheets
+                        )
+                        if raw_file_io is not uploaded_file: raw_file_io.close() # 복호화 임시 파일 정리
+                        with upload_io.profile_stage(memory_profile, "분석"):
+                            analysis_results = excel_utils.run_analysis(excel_data_dfs_raw)
+                        # 방금 같은 등록 스냅샷으로 스타일링했으므로 매칭 상태도 함께 넣어 전체 재스타일링을 건너뜁니다.
+                        ocs_state = ocs_state_cache.put_state(
+                            cache_id, file_name, excel_data_dfs_raw, styled_excel_file, analysis_results, # 임시 파일째 넘겨 디스크 캐시에 나눠 씀
+                            match_state=create_match_state(excel_data_dfs_raw, all_users_meta, all_patients_data, all_doctors_meta)
+                        )
+                        st.session_state.ocs_memory_profile = memory_profile; st.session_state.ocs_skipped_sheets = skipped_sheets
+                    analysis_results = ocs_state["analysis"]
+                    
+                    # 이력/집계는 업로드한 날이 아니라 파일의 진료 날짜로 기록합니다. (다음 날 스케줄을 미리 올려도 그 날짜로 저장)
+                    schedule_date = excel_utils.get_schedule_date(ocs_state["dfs"], file_name)
+                    if not ocs_history.publish_analysis(db_ref, file_name, analysis_results, date_str=schedule_date):
+                        st.warning("⚠️ 분석 결과가 비어 있어 Firebase에 저장하지 않았습니다.")
                     
-            except ValueError as ve: st.error(f"파일 처리 실패: {ve}"); st.stop()
-            except Exception as e: st.error(f"오류 발생: {e}"); st.stop()
+                    st.session_state.ocs_state_id = cache_id; st.session_state.ocs_upload_id = upload_id
+                    st.session_state.last_processed_file_name = file_name
+                    st.session_state.last_processed_key = upload_key
+                        
+                except ValueError as ve: st.error(f"파일 처리 실패: {ve}"); st.stop()
+                except Exception as e: st.error(f"오류 발생: {e}"); st.stop()
+
+            # 현재 OCS 파일의 매칭 결과를 공유 캐시 항목에 보관하고, 등록 변경분(델타)만 반영합니다.
+            matched_users, matched_doctors_data = [], []
+            excel_data_dfs = ocs_state["dfs"]
+            if excel_data_dfs:
+                with ocs_state["lock"]:
+                    match_state = ocs_state["match_state"]
+                    if match_state is None:
+                        # 디스크 캐시에서 복원한 항목: 저장 당시 등록 상태로 스타일링되어 있으므로 현재 등록 상태로 매칭하고 회색 배경을 전부 다시 반영
+                        match_state = create_match_state(excel_data_dfs, all_users_meta, all_patients_data, all_doctors_meta)
+                        restyled = excel_utils.restyle_registered_pids(
+                            io.BytesIO(ocs_state["styled_bytes"]), None, registered_pids
+                        ) if ocs_state["styled_bytes"] else None
+                        ocs_state_cache.update_entry(st.session_state.ocs_state_id, ocs_state, restyled.getvalue() if restyled else None, match_state)
+                    else:
+                        changed_users, changed_pids = apply_registration_deltas(match_state, all_users_meta, all_patients_data, all_doctors_meta)
+                        if changed_pids and ocs_state["styled_bytes"]:
+                            restyled = excel_utils.restyle_registered_pids(
+                                io.BytesIO(ocs_state["styled_bytes"]), changed_pids, registered_pids
+                            )
+                            ocs_state_cache.update_entry(st.session_state.ocs_state_id, ocs_state, restyled.getvalue())
+                        if changed_users:
+                            st.info(f"🔄 업로드 이후 변경된 등록 정보({len(changed_users)}명, 환자 {len(changed_pids)}건)를 반영했습니다.")
+                    matched_users, matched_doctors_data = get_match_results(match_state)
+
+            styled_excel_bytes = ocs_state["styled_bytes"]
+            if styled_excel_bytes:
+                output_filename = uploaded_file.name.replace(".xlsx", "_processed.xlsx").replace(".xlsm", "_processed.xlsm")
+                st.download_button("처리된 엑셀 다운로드", data=styled_excel_bytes, file_name=output_filename, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                st.success("✅ 파일 처리 완료. 알림 전송 방법을 선택하세요.")
+            else: st.warning("처리할 데이터가 없습니다.")
+            cache_stats = ocs_state_cache.get_cache_stats()
+            st.caption(f"공유 OCS 캐시: {cache_stats['entries']}개 파일, {cache_stats['total_bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB")
+            if st.session_state.get("ocs_skipped_sheets"):
+                st.caption(f"⏭️ 필요 없는 시트 {len(st.session_state.ocs_skipped_sheets)}개 건너뜀 (다운로드 파일에는 원본 그대로 포함): {', '.join(st.session_state.ocs_skipped_sheets)}")
+            if st.session_state.get("ocs_memory_profile"):
+                with st.expander("🧠 단계별 처리 시간/메모리 사용량", expanded=False):
+                    st.dataframe(pd.DataFrame(st.session_state.ocs_memory_profile), use_container_width=True)
             
             st.markdown("---")
             st.subheader("🚀 알림 전송 옵션")
-            col_auto, col_manual = st.columns(2)
+            outbox_counts = dispatch_outbox.summarize_outbox(db_ref_func, st.session_state.ocs_upload_id, is_daily)
+            if outbox_counts and any(outbox_counts.values()):
+                st.info(
+                    f"📮 이 파일의 이전 자동 전송 기록: 완료 {outbox_counts['sent']}건 / 실패 {outbox_counts['failed']}건 / 중단 {outbox_counts['sending']}건. "
+                    "다시 자동 전송하면 완료된 메일/일정은 건너뜁니다."
+                )
+                if st.button("전송 기록 초기화 (처음부터 다시 전송)", key="reset_dispatch_outbox"):
+                    dispatch_outbox.reset_outbox(db_ref_func, st.session_state.ocs_upload_id, is_daily); st.rerun()
+
+            # 백그라운드 자동 전송 작업 (다른 관리자 세션에서 시작한 같은 파일 작업도 표시)
+            dispatch_job_id = dispatch_jobs.find_running_job(file_name, is_daily) or st.session_state.dispatch_job_id
+            dispatch_job = dispatch_jobs.get_job(dispatch_job_id) if dispatch_job_id else None
+            if dispatch_job and dispatch_job["file_name"] == file_name:
+                if dispatch_job["status"] == dispatch_jobs.STATUS_RUNNING:
+                    fragment_dispatch_job_progress(dispatch_job_id)
+                else:
+                    if dispatch_job["status"] == dispatch_jobs.STATUS_DONE: st.success(f"✅ 자동 전송 완료 ({dispatch_job['finished_at']})")
+                    else: st.error(f"❌ 자동 전송 중단: {dispatch_job['error']} (다시 전송하면 완료된 항목은 건너뜁니다)")
+                    _show_dispatch_job_status(dispatch_job)
+                    if st.button("전송 결과 닫기", key="close_dispatch_job"):
+                        st.session_state.dispatch_job_id = None; st.rerun()
+            dispatch_running = bool(dispatch_job and dispatch_job["status"] == dispatch_jobs.STATUS_RUNNING)
+
+            col_auto, col_manual, col_preview = st.columns(3)
 
             with col_auto:
-                if st.button("YES: 자동으로 모든 사용자에게 전송", key="auto_run_yes"):
+                if st.button("YES: 자동으로 모든 사용자에게 전송", key="auto_run_yes", disabled=dispatch_running):
                     st.session_state.auto_run_confirmed = True; st.rerun()
             with col_manual:
                 if st.button("NO: 수동으로 사용자 선택", key="auto_run_no"):
                     st.session_state.auto_run_confirmed = False; st.rerun()
+            with col_preview:
+                if st.button("🔍 미리보기 (전송하지 않음)", key="auto_run_preview"):
+                    st.session_state.auto_run_confirmed = "preview"; st.rerun()
                     
-            if 'last_processed_data' in st.session_state and st.session_state.last_processed_data:
-                
-                all_users_meta = users_ref.get(); all_patients_data = db_ref("patients").get()
-                all_doctors_meta = doctor_users_ref.get()
-                excel_data_dfs = st.session_state.last_processed_data
-                
-                matched_users, matched_doctors_data = get_matching_data(
-                    excel_data_dfs, all_users_meta, all_patients_data, all_doctors_meta
-                )
-
-                if st.session_state.auto_run_confirmed:
+            if excel_data_dfs:
+                if st.session_state.auto_run_confirmed == "preview":
                     st.markdown("---")
-                    st.warning("자동으로 모든 매칭 사용자에게 알림(메일/캘린더)을 전송합니다.")
-                    run_auto_notifications(matched_users, matched_doctors_data, excel_data_dfs, file_name, is_daily, db_ref_func)
-                    st.session_state.auto_run_confirmed = None; st.stop()
+                    st.info("자동 전송 시 실제로 보낼 메일/캘린더 일정을 미리 만들어 보여줍니다. (전송하지 않음)")
+                    dispatch_plan = run_auto_notifications(
+                        matched_users, matched_doctors_data, excel_data_dfs, file_name, is_daily, db_ref_func, dry_run=True,
+                        upload_id=st.session_state.ocs_upload_id
+                    )
+                    plan_stats = dispatch_plan["stats"]
+                    col_r, col_e, col_c, col_t = st.columns(4)
+                    col_r.metric("수신자", plan_stats["recipients"])
+                    col_e.metric("메일", f"{plan_stats['emails']}건 ({plan_stats['email_bytes'] / 1024:.1f} KB)")
+                    col_c.metric("캘린더 일정", plan_stats["calendar_events"])
+                    col_t.metric("계획 생성 시간", f"{plan_stats['build_seconds']:.3f}초")
+                    if plan_stats["skipped_rows"]:
+                        st.caption(f"예약일시/시간 형식 오류로 캘린더에서 제외되는 행: {plan_stats['skipped_rows']}건")
+                    if plan_stats.get("merged_rows"):
+                        st.caption(f"여러 시트에서 중복 매칭되어 하나로 합친 예약: {plan_stats['merged_rows']}건")
+                    st.caption("캘린더 일정은 Google Calendar 계정이 연동된 사용자에게만 전송됩니다.")
+                    st.dataframe(summarize_dispatch_plan(dispatch_plan), use_container_width=True)
+
+                elif st.session_state.auto_run_confirmed:
+                    # 전송은 백그라운드 작업으로 실행하고, 화면은 작업 ID로 진행 상황만 읽습니다.
+                    dispatch_plan = build_dispatch_plan(matched_users, matched_doctors_data, file_name, is_daily, sender, upload_id=st.session_state.ocs_upload_id)
+                    st.session_state.dispatch_job_id = dispatch_jobs.submit_dispatch_job(dispatch_plan, sender, sender_pw, db_ref_func)
+                    st.session_state.auto_run_confirmed = None; st.rerun()
                     
                 elif st.session_state.auto_run_confirmed is False:
                     st.markdown("---")
@@ -543,7 +729,7 @@ def show_admin_mode_ui():
                             
                             for user_match_info in selected_matched_users_data:
                                 st.markdown(f"**수신자:** {user_match_info['name']} ({user_match_info['email']})")
-                                st.dataframe(user_match_info['data'])
+                                st.dataframe(visible_columns(user_match_info['data']))
                             
                             mail_col, calendar_col = st.columns(2)
                             with mail_col:
@@ -575,7 +761,7 @@ def show_admin_mode_ui():
                             
                             for res in selected_doctors_to_act:
                                 st.markdown(f"**수신자:** Dr. {res['name']} ({res['email']})")
-                                st.dataframe(res['data'])
+                                st.dataframe(visible_columns(res['data']))
 
                             mail_col_doc, calendar_col_doc = st.columns(2)
                             with mail_col_doc:
@@ -600,75 +786,93 @@ def show_admin_mode_ui():
             return 
         
         st.subheader("👥 사용자 목록 및 계정 관리")
-        tab_student, tab_doctor, tab_test_mail = st.tabs(["📚 학생 사용자 관리", "🧑‍⚕️ 치과의사 사용자 관리", "📧 테스트 메일 발송"])
-        user_meta = users_ref.get(); user_list = [{"name": u.get('name'), "email": u.get('email'), "number": u.get('number'), "key": k} for k, u in user_meta.items() if u and isinstance(u, dict)] if user_meta else []
-        doctor_meta = doctor_users_ref.get(); doctor_list = [{"name": d.get('name'), "email": d.get('email'), "key": k, "dept": d.get('department')} for k, d in doctor_meta.items() if d and isinstance(d, dict)] if doctor_meta else []
+        tab_student, tab_doctor, tab_test_mail, tab_routing = st.tabs(["📚 학생 사용자 관리", "🧑‍⚕️ 치과의사 사용자 관리", "📧 테스트 메일 발송", "🧭 승인/참조 라우팅"])
 
         with tab_student:
             st.markdown("#### 학생 사용자 목록")
-            if user_list:
-                df_users = pd.DataFrame(user_list); st.dataframe(df_users[['name', 'email', 'number']], use_container_width=True); st.markdown("---")
-                user_options = [f"{u['name']} ({u['email']})" for u in user_list]
-                selected_users_to_act = st.multiselect("메일 발송 또는 삭제할 학생:", options=user_options, key="student_multiselect_act")
-                selected_user_data = [u for u in user_list if f"{u['name']} ({u['email']})" in selected_users_to_act]
-                
-                if selected_user_data:
-                    with st.expander("📧 메일 발송"):
-                        mail_subject = st.text_input("제목", key="student_mail_subject"); mail_body = st.text_area("내용", key="student_mail_body")
-                        if st.button(f"전송 ({len(selected_user_data)}명)", key="send_bulk_student_mail_btn"):
-                            success_count = 0
-                            for user_info in selected_user_data:
-                                try: send_email(user_info['email'], [], sender, sender_pw, custom_message=f"<h4>{mail_subject}</h4><p>{mail_body}</p>", date_str="Admin Test"); success_count += 1
-                                except: pass
-                            st.success(f"✅ {success_count}명 전송 완료")
-                    if st.session_state.get('student_delete_confirm', False) is False:
-                        if st.button("일괄 삭제 준비", key="init_student_delete_btn"): st.session_state.student_delete_confirm = True; st.rerun()
-                    if st.session_state.get('student_delete_confirm', False):
-                        st.warning(f"⚠️ **{len(selected_user_data)}명** 삭제?")
-                        col_yes, col_no = st.columns(2)
-                        if col_yes.button("예", key="confirm_bulk_student_delete_btn"):
-                            for user_info in selected_user_data: users_ref.child(user_info['key']).delete()
-                            st.session_state.student_delete_confirm = False; st.success("삭제 완료"); st.rerun()
-                        if col_no.button("취소", key="cancel_bulk_student_delete_btn"): st.session_state.student_delete_confirm = False; st.rerun()
-            else: st.info("등록된 학생 없음")
+            selected_user_data = _show_account_directory("student", ['name', 'email', 'number'])
+            if selected_user_data:
+                with st.expander("📧 메일 발송"):
+                    mail_subject = st.text_input("제목", key="student_mail_subject"); mail_body = st.text_area("내용", key="student_mail_body")
+                    if st.button(f"전송 ({len(selected_user_data)}명)", key="send_bulk_student_mail_btn"):
+                        success_count = 0
+                        for user_info in selected_user_data:
+                            send_result = send_email(user_info['email'], [], sender, sender_pw, custom_message=f"<h4>{mail_subject}</h4><p>{mail_body}</p>", date_str="Admin Test")
+                            if send_result is True: success_count += 1
+                            else: st.error(f"{user_info['email']} 전송 실패: {send_result}")
+                        st.success(f"✅ {success_count}명 전송 완료")
+                if st.session_state.get('student_delete_confirm', False) is False:
+                    if st.button("일괄 삭제 준비", key="init_student_delete_btn"): st.session_state.student_delete_confirm = True; st.rerun()
+                if st.session_state.get('student_delete_confirm', False):
+                    st.warning(f"⚠️ **{len(selected_user_data)}명** 삭제?")
+                    col_yes, col_no = st.columns(2)
+                    if col_yes.button("예", key="confirm_bulk_student_delete_btn"):
+                        user_directory.delete_accounts(db_ref_func, "student", [user_info['key'] for user_info in selected_user_data])
+                        st.session_state.pop("student_account_select", None)
+                        st.session_state.student_delete_confirm = False; st.success("삭제 완료"); st.rerun()
+                    if col_no.button("취소", key="cancel_bulk_student_delete_btn"): st.session_state.student_delete_confirm = False; st.rerun()
+
+            st.markdown("---")
+            st.subheader("🗜️ 환자 진료과 저장 형식 변환")
+            st.caption("진료과별 T/F 플래그로 저장된 이전 환자 레코드를 진료과 bitmask 하나로 바꿉니다. 변환 전에도 두 형식 모두 정상적으로 읽힙니다.")
+            if st.button("이전 형식 환자 레코드 변환", key="migrate_patient_depts_btn"):
+                migrated_count = dept_codes.migrate_patients(db_ref_func("patients"))
+                st.success(f"✅ {migrated_count}건 변환 완료" if migrated_count else "변환할 이전 형식 레코드가 없습니다.")
 
         with tab_doctor:
             st.markdown("#### 치과의사 사용자 목록")
-            if doctor_list:
-                df_doctors = pd.DataFrame(doctor_list); st.dataframe(df_doctors[['name', 'email', 'dept']], use_container_width=True); st.markdown("---")
-                doctor_options = [f"{d['name']} ({d['email']})" for d in doctor_list]
-                selected_doctors_to_act = st.multiselect("선택:", options=doctor_options, key="doctor_multiselect_act")
-                selected_doctor_data = [d for d in doctor_list if f"{d['name']} ({d['email']})" in selected_doctors_to_act]
-                
-                if selected_doctor_data:
-                    with st.expander("📧 메일 발송"):
-                        mail_subject = st.text_input("제목", key="doctor_mail_subject"); mail_body = st.text_area("내용", key="doctor_mail_body")
-                        if st.button(f"전송 ({len(selected_doctor_data)}명)", key="send_bulk_doctor_mail_btn"):
-                            success_count = 0
-                            for d in selected_doctor_data:
-                                try: send_email(d['email'], [], sender, sender_pw, custom_message=f"<h4>{mail_subject}</h4><p>{mail_body}</p>", date_str="Admin Test"); success_count += 1
-                                except: pass
-                            st.success(f"✅ {success_count}명 전송 완료")
-                    if st.session_state.get('doctor_delete_confirm', False) is False:
-                        if st.button("일괄 삭제 준비", key="init_doctor_delete_btn"): st.session_state.doctor_delete_confirm = True; st.rerun()
-                    if st.session_state.get('doctor_delete_confirm', False):
-                        st.warning(f"⚠️ **{len(selected_doctor_data)}명** 삭제?")
-                        col_yes, col_no = st.columns(2)
-                        if col_yes.button("예", key="confirm_bulk_doctor_delete_btn"):
-                            for d in selected_doctor_data: doctor_users_ref.child(d['key']).delete()
-                            st.session_state.doctor_delete_confirm = False; st.success("삭제 완료"); st.rerun()
-                        if col_no.button("취소", key="cancel_bulk_doctor_delete_btn"): st.session_state.doctor_delete_confirm = False; st.rerun()
-            else: st.info("등록된 치과의사 없음")
+            selected_doctor_data = _show_account_directory("doctor", ['name', 'email', 'department'])
+            if selected_doctor_data:
+                with st.expander("📧 메일 발송"):
+                    mail_subject = st.text_input("제목", key="doctor_mail_subject"); mail_body = st.text_area("내용", key="doctor_mail_body")
+                    if st.button(f"전송 ({len(selected_doctor_data)}명)", key="send_bulk_doctor_mail_btn"):
+                        success_count = 0
+                        for d in selected_doctor_data:
+                            send_result = send_email(d['email'], [], sender, sender_pw, custom_message=f"<h4>{mail_subject}</h4><p>{mail_body}</p>", date_str="Admin Test")
+                            if send_result is True: success_count += 1
+                            else: st.error(f"{d['email']} 전송 실패: {send_result}")
+                        st.success(f"✅ {success_count}명 전송 완료")
+                if st.session_state.get('doctor_delete_confirm', False) is False:
+                    if st.button("일괄 삭제 준비", key="init_doctor_delete_btn"): st.session_state.doctor_delete_confirm = True; st.rerun()
+                if st.session_state.get('doctor_delete_confirm', False):
+                    st.warning(f"⚠️ **{len(selected_doctor_data)}명** 삭제?")
+                    col_yes, col_no = st.columns(2)
+                    if col_yes.button("예", key="confirm_bulk_doctor_delete_btn"):
+                        user_directory.delete_accounts(db_ref_func, "doctor", [d['key'] for d in selected_doctor_data])
+                        st.session_state.pop("doctor_account_select", None)
+                        st.session_state.doctor_delete_confirm = False; st.success("삭제 완료"); st.rerun()
+                    if col_no.button("취소", key="cancel_bulk_doctor_delete_btn"): st.session_state.doctor_delete_confirm = False; st.rerun()
         
         with tab_test_mail:
             st.subheader("📧 테스트 메일 발송")
             test_email_recipient = st.text_input("수신자 이메일", key="test_email_recipient")
             if st.button("발송", key="send_test_mail_btn"):
                 if is_valid_email(test_email_recipient):
-                    try: send_email(test_email_recipient, [], sender, sender_pw, custom_message="<p>테스트 메일입니다.</p>", date_str="Test"); st.success("성공")
-                    except Exception as e: st.error(f"실패: {e}")
+                    send_result = send_email(test_email_recipient, [], sender, sender_pw, custom_message="<p>테스트 메일입니다.</p>", date_str="Test")
+                    if send_result is True: st.success("성공")
+                    else: st.error(f"실패: {send_result}")
                 else: st.error("이메일 형식 확인")
 
+        with tab_routing:
+            st.subheader("🧭 예약의사별 승인/참조 담당자")
+            st.caption("저장하면 배포 없이 다음 매칭/전송부터 바로 적용됩니다.")
+            routing_rules = approver_routing.load_routing_rules()
+            df_routing = pd.DataFrame(
+                [{"예약의사": doctor, "구분": route_type, "담당자": approver} for doctor, (route_type, approver) in routing_rules.items()],
+                columns=["예약의사", "구분", "담당자"]
+            )
+            edited_routing = st.data_editor(
+                df_routing, num_rows="dynamic", use_container_width=True, key="approver_routing_editor",
+                column_config={"구분": st.column_config.SelectboxColumn("구분", options=["승인", "참조"], required=True)}
+            )
+            if st.button("라우팅 저장", key="save_approver_routing_btn"):
+                new_rules = {
+                    str(r["예약의사"]).strip(): (r["구분"] or "승인", str(r["담당자"]).strip())
+                    for r in edited_routing.to_dict("records") if r.get("예약의사") and r.get("담당자")
+                }
+                approver_routing.save_routing_rules(new_rules)
+                st.success(f"✅ {len(new_rules)}개 규칙 저장 완료")
+
 # --- 4. 일반 사용자 모드 UI ---
 
 def show_user_mode_ui(firebase_key, user_name):
@@ -684,26 +888,46 @@ def show_user_mode_ui(firebase_key, user_name):
         st.markdown("---")
         
         st.subheader(f"{user_name}님의 토탈 환자 목록")
-        existing_patient_data = patients_ref_for_user.get()
-        if existing_patient_data is None: existing_patient_data = {}
+        # 💡 [최적화] 전체 목록을 매번 읽지 않고, 보이는 페이지/검색 결과만 서버에서 가져와 세션에 보관합니다.
+        patient_cache = patient_store.get_patient_cache(firebase_key)
+        total_patients = patient_store.get_total_count(patient_cache, patients_ref_for_user)
+
+        search_col, dept_col = st.columns([2, 1])
+        with search_col: patient_query = st.text_input("환자 검색 (이름 또는 진료번호 앞부분)", key="patient_search_query")
+        with dept_col: patient_dept_filter = st.selectbox("진료과", ["전체"] + DEPARTMENTS_FOR_REGISTRATION, key="patient_dept_filter")
+        dept_filter = None if patient_dept_filter == "전체" else patient_dept_filter
+
+        if patient_query.strip() or dept_filter:
+            visible_patients = patient_store.search_patients(patient_cache, patients_ref_for_user, patient_query, dept_filter)
+            st.caption(f"검색 결과 {len(visible_patients)}명 (전체 {total_patients}명)")
+        else:
+            page_number = st.session_state.get('patient_page', 0)
+            visible_patients = patient_store.load_page(patient_cache, patients_ref_for_user, page_number)
+            if not visible_patients and page_number > 0:
+                st.session_state.patient_page = page_number = 0
+                visible_patients = patient_store.load_page(patient_cache, patients_ref_for_user, 0)
+            st.caption(f"전체 {total_patients}명 중 {page_number * PATIENT_PAGE_SIZE + 1 if visible_patients else 0}-{page_number * PATIENT_PAGE_SIZE + len(visible_patients)}번째 (진료번호순)")
         
-        if existing_patient_data:
-            patient_list = list(existing_patient_data.items())
-            valid_patient_list = [item for item in patient_list if isinstance(item[1], dict)]
-            sorted_patient_list = sorted(valid_patient_list, key=lambda item: (
-                0 if item[1].get('소치', False) else 1 if item[1].get('외과', False) else 2 if item[1].get('내과', False) else 3 if item[1].get('교정', False) else 4 if item[1].get('보철', False) else 5 if item[1].get('원진실', False) else 6 if item[1].get('보존', False) else 7, 
-                item[1].get('환자이름', 'zzz')
-            ))
+        if visible_patients:
             cols_count = 3; cols = st.columns(cols_count)
-            for idx, (pid_key, val) in enumerate(sorted_patient_list): 
+            for idx, (pid_key, val) in enumerate(visible_patients): 
                 with cols[idx % cols_count]:
                     with st.container(border=True):
-                         registered_depts = [dept.capitalize() for dept in PATIENT_DEPT_FLAGS if val.get(dept.lower()) is True or val.get(dept.lower()) == 'True']
+                         registered_depts = dept_codes.patient_departments(val)
                          depts_str = ", ".join(registered_depts) if registered_depts else "미지정"
                          info_col, btn_col = st.columns([4, 1])
                          with info_col: st.markdown(f"**{val.get('환자이름', '이름 없음')}** / {pid_key} / {depts_str}")
                          with btn_col:
-                             if st.button("X", key=f"delete_button_{pid_key}"): patients_ref_for_user.child(pid_key).delete(); st.rerun()
+                             if st.button("X", key=f"delete_button_{pid_key}"): patient_store.delete_patients(patient_cache, patients_ref_for_user, [pid_key]); st.rerun()
+
+            if not (patient_query.strip() or dept_filter):
+                prev_col, next_col = st.columns(2)
+                with prev_col:
+                    if page_number > 0 and st.button("◀ 이전", key="patient_prev_page"): st.session_state.patient_page = page_number - 1; st.rerun()
+                with next_col:
+                    if patient_store.has_next_page(patient_cache, page_number) and st.button("다음 ▶", key="patient_next_page"):
+                        st.session_state.patient_page = page_number + 1; st.rerun()
+        elif patient_query.strip() or dept_filter: st.info("검색된 환자 없음")
         else: st.info("등록된 환자 없음")
         st.markdown("---")
 
@@ -714,19 +938,17 @@ def show_user_mode_ui(firebase_key, user_name):
             for line in lines:
                 parts = re.split(r'[\t\s]+', line.strip(), 2)
                 if len(parts) >= 3:
-                    name, pid, depts_str = parts[0], parts[1], parts[2]; pid_key = pid.strip()
+                    name, pid, depts_str = parts[0], parts[1], parts[2]
                     selected_departments = [d.strip() for d in depts_str.replace(",", " ").split()]
-                    current_data = existing_patient_data.get(pid_key, {"환자이름": name, "진료번호": pid_key}) 
-                    for dept_flag in PATIENT_DEPT_FLAGS + ['치주', '원진실']: current_data[dept_flag.lower()] = False
-                    for dept in selected_departments: current_data[dept.lower()] = True
-                    patients_ref_for_user.child(pid_key).set(current_data); success_count += 1
+                    patient_store.register_patient(patient_cache, patients_ref_for_user, name, pid, selected_departments); success_count += 1
             if success_count > 0: st.success(f"🎉 {success_count}명 등록 완료"); st.rerun()
             else: st.error("형식 오류")
 
         st.markdown("---")
         st.subheader("🗑️ 환자 정보 일괄 삭제")
-        if existing_patient_data:
-            patient_options = {f"{val.get('환자이름')} ({pid_key})": pid_key for pid_key, val in existing_patient_data.items() if isinstance(val, dict)}
+        if visible_patients:
+            # 현재 화면(페이지/검색 결과)에 보이는 환자 중에서 선택
+            patient_options = {f"{val.get('환자이름')} ({pid_key})": pid_key for pid_key, val in visible_patients}
             selected_patients_str = st.multiselect("삭제할 환자 선택:", list(patient_options.keys()), key="delete_patient_multiselect")
             patients_to_delete = [patient_options[name] for name in selected_patients_str]
             if patients_to_delete: st.session_state.patients_to_delete = patients_to_delete; st.session_state.delete_patient_confirm = True
@@ -735,12 +957,12 @@ def show_user_mode_ui(firebase_key, user_name):
             if st.session_state.delete_patient_confirm:
                 st.warning(f"⚠️ **{len(st.session_state.patients_to_delete)}명** 삭제?")
                 if st.button("예, 삭제", key="confirm_delete_button"):
-                    for pid_key in st.session_state.patients_to_delete: patients_ref_for_user.child(pid_key).delete()
+                    patient_store.delete_patients(patient_cache, patients_ref_for_user, st.session_state.patients_to_delete)
                     st.session_state.delete_patient_confirm = False; st.session_state.patients_to_delete = []; st.success("삭제 완료"); st.rerun()
 
         st.markdown("---")
         # [최적화] Fragment 구역으로 단일 등록 폼 대체
-        fragment_single_registration(existing_patient_data, patients_ref_for_user)
+        fragment_single_registration(patient_cache, patients_ref_for_user)
 
     with analysis_tab:
         st.header("📈 OCS 분석 결과")
@@ -748,9 +970,20 @@ def show_user_mode_ui(firebase_key, user_name):
         latest_file_name = db_ref_func("ocs_analysis/latest_file_name").get()
         if analysis_results and latest_file_name:
             st.markdown(f"**<h3 style='text-align: left;'>{latest_file_name} 분석 결과</h3>**", unsafe_allow_html=True); st.markdown("---")
-            for dept in ['소치', '보존', '교정']:
+            for dept in ANALYSIS_RULES:
                 if dept in analysis_results: st.subheader(f"{dept}"); st.info(f"오전: {analysis_results[dept]['오전']}명 / 오후: {analysis_results[dept]['오후']}명"); st.markdown("---")
         else: st.info("분석 결과 없음")
+
+        # 💡 [최적화] 미리 계산된 주간/월간 집계 노드 하나만 읽어 추세를 표시합니다.
+        st.subheader("📊 기간별 추세")
+        trend_period = st.radio("집계 단위", ["주간", "월간"], horizontal=True, key="ocs_trend_period")
+        trend_rows = ocs_history.load_trend(db_ref_func, "weekly" if trend_period == "주간" else "monthly")
+        if trend_rows:
+            df_trend = pd.DataFrame(trend_rows)
+            st.line_chart(df_trend.pivot(index="기간", columns="진료과", values="일평균"))
+            st.dataframe(df_trend, use_container_width=True, hide_index=True)
+        else: st.info("누적된 분석 이력이 없습니다.")
+        st.markdown("---")
         
         # [최적화] Fragment 구역으로 비밀번호 변경 대체
         fragment_password_change(firebase_key, users_ref, "u")
@@ -0,0 +1,124 @@
+# upload_io.py
+
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from config import OCS_UPLOAD_MAX_BYTES, OCS_SPOOL_MAX_MEMORY_BYTES, OCS_MEMORY_TRACE
+
+# OCS 업로드 처리(복호화 → 파싱 → 스타일링) 중간 파일을 메모리 한도가 있는 임시 파일로 다루고, 단계별 메모리 사용량을 기록합니다.
+# - SpooledTemporaryFile: OCS_SPOOL_MAX_MEMORY_BYTES까지는 메모리, 넘으면 자동으로 디스크 임시 파일로 전환
+# - 업로드 크기가 OCS_UPLOAD_MAX_BYTES를 넘으면 처리 전에 거부 (ValueError)
+# - 단계별 보고: 소요 시간, 처리 후 프로세스 RSS와 증가량, (OCS_MEMORY_TRACE면) tracemalloc 최대 할당량
+
+CHUNK_SIZE = 1024 * 1024
+_MB = 1024 * 1024
+
+# --- 1. 임시 파일 ---
+def new_spooled_file():
+    """메모리 한도를 넘으면 디스크로 내려가는 임시 파일을 만듭니다."""
+    return tempfile.SpooledTemporaryFile(max_size=OCS_SPOOL_MAX_MEMORY_BYTES, mode="w+b")
+
+def iter_chunks(stream):
+    """스트림을 처음부터 CHUNK_SIZE 단위로 읽습니다. (전체 bytes 복사본을 만들지 않음)"""
+    stream.seek(0)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+    stream.seek(0)
+
+def copy_to_temp_path(stream, suffix=".xlsx"):
+    """
+    스트림을 나눠 읽어 이름 있는 임시 파일에 복사하고 경로를 반환합니다. (다른 프로세스가 경로로 열 수 있도록)
+    사용이 끝나면 호출한 쪽에서 os.remove로 지워야 합니다.
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        for chunk in iter_chunks(stream):
+            f.write(chunk)
+        return f.name
+
+def read_all(stream):
+    """스트림 전체를 bytes로 한 번만 읽고 닫습니다. (공유 캐시/워커 결과처럼 bytes가 꼭 필요한 곳에서만 사용)"""
+    if stream is None:
+        return None
+    try:
+        stream.seek(0)
+        return stream.read()
+    finally:
+        stream.close()
+
+
+# --- 2. 크기 예산 ---
+def stream_size(stream):
+    """스트림 크기 (현재 위치는 처음으로 되돌림)"""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def check_upload_size(size):
+    """업로드 크기가 메모리 예산을 넘으면 ValueError를 발생시킵니다."""
+    if size > OCS_UPLOAD_MAX_BYTES:
+        raise ValueError(
+            f"파일이 너무 큽니다 ({size / _MB:.1f} MB). 최대 {OCS_UPLOAD_MAX_BYTES / _MB:.0f} MB까지 처리할 수 있습니다. "
+            "기간을 나누어 내보낸 뒤 다시 올려주세요."
+        )
+
+
+# --- 3. 단계별 메모리 보고 ---
+_trace_lock = threading.Lock()
+_trace_users = 0
+
+def _current_rss_bytes():
+    """현재 프로세스 RSS (Linux /proc 기준, 읽을 수 없으면 None)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _start_trace():
+    global _trace_users
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _trace_users += 1
+        tracemalloc.reset_peak()
+
+def _stop_trace():
+    global _trace_users
+    with _trace_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _trace_users -= 1
+        if _trace_users == 0:
+            tracemalloc.stop()
+        return peak
+
+@contextmanager
+def profile_stage(profile, stage):
+    """
+    with 블록 하나를 한 단계로 보고 소요 시간과 메모리 사용량을 profile(list)에 추가합니다. profile이 None이면 기록하지 않습니다.
+    기록 형식: {'단계', '시간(초)', 'RSS(MB)', 'RSS 증가(MB)', '최대 할당(MB)'}
+    """
+    if profile is None:
+        yield
+        return
+    started_at = time.perf_counter(); rss_before = _current_rss_bytes()
+    if OCS_MEMORY_TRACE: _start_trace()
+    try:
+        yield
+    finally:
+        peak = _stop_trace() if OCS_MEMORY_TRACE else None
+        rss_after = _current_rss_bytes()
+        profile.append({
+            "단계": stage,
+            "시간(초)": round(time.perf_counter() - started_at, 3),
+            "RSS(MB)": round(rss_after / _MB, 1) if rss_after is not None else None,
+            "RSS 증가(MB)": round((rss_after - rss_before) / _MB, 1) if rss_after is not None and rss_before is not None else None,
+            "최대 할당(MB)": round(peak / _MB, 1) if peak is not None else None,
+        })
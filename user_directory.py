@@ -0,0 +1,190 @@
+# user_directory.py
+
+import streamlit as st
+
+from config import USER_PAGE_SIZE, USER_SEARCH_LIMIT
+
+# 관리자 사용자 관리 화면의 계정 목록 페이지 단위 조회/검색과 세션 캐시
+# - users / doctor_users 노드에는 비밀번호 해시 등 화면에 쓰지 않는 값이 있으므로, 표시할 필드만 담은 투영 인덱스 노드를 따로 둡니다.
+#   users/{key} → users_index/{key}: {name, email, number}, doctor_users/{key} → doctor_users_index/{key}: {name, email, number, department}
+# - 목록: 이름 또는 이메일 순으로 한 페이지씩 인덱스 노드에서 가져옵니다. 검색: 이름/이메일 접두어 Firebase 쿼리
+#   (Firebase 규칙에 users_index, doctor_users_index 의 ".indexOn": ["name", "email"] 필요,
+#    없으면 경고 후 표시 필드만 담긴 인덱스 노드 전체를 세션당 한 번 받아 세션에서 정렬/검색)
+# - 계정 등록/삭제 시 인덱스에도 함께 쓰고(write-through), 인덱스가 생기기 전의 계정은 backfill_index()로 한 번 채웁니다.
+
+DIRECTORIES = {
+    "student": {"source": "users", "index": "users_index", "fields": ("name", "email", "number")},
+    "doctor": {"source": "doctor_users", "index": "doctor_users_index", "fields": ("name", "email", "number", "department")},
+}
+ORDER_FIELDS = ("name", "email")
+_PREFIX_END = "\uf8ff" # 접두어 검색 범위 끝 (Firebase 권장 방식)
+
+def _index_ref(db_ref_func, kind):
+    return db_ref_func(DIRECTORIES[kind]["index"])
+
+def project_account(kind, account):
+    """계정 레코드에서 인덱스에 넣을 표시 필드만 꺼냅니다. (정렬/검색이 되도록 모두 문자열)"""
+    return {field: "" if account.get(field) is None else str(account.get(field)) for field in DIRECTORIES[kind]["fields"]}
+
+
+# --- 1. 세션 캐시 ---
+def get_directory_cache(kind, order_by="name"):
+    """계정 종류별 목록 세션 캐시를 가져옵니다. (정렬 기준이 바뀌면 목록 구성만 새로 만듦)"""
+    cache = st.session_state.get(f"user_directory_{kind}")
+    if not cache:
+        cache = {"kind": kind, "order_by": order_by, "records": {}, "page_keys": [], "next_cursor": None, "exhausted": False,
+                 "searches": {}, "total": None, "source_total": None}
+        st.session_state[f"user_directory_{kind}"] = cache
+    if cache["order_by"] != order_by:
+        cache["order_by"] = order_by; _invalidate_listing(cache)
+    return cache
+
+def _invalidate_listing(cache):
+    """목록 페이지/검색 결과 구성만 초기화합니다. (이미 받은 계정 데이터는 유지)"""
+    cache["page_keys"] = []; cache["next_cursor"] = None; cache["exhausted"] = False; cache["searches"] = {}
+
+def reset_directory_cache(kind):
+    """인덱스를 다시 만든 뒤 등 세션 캐시를 모두 버립니다."""
+    st.session_state.pop(f"user_directory_{kind}", None)
+
+
+def _load_index_locally(cache, db_ref_func):
+    """정렬 쿼리를 쓸 수 없을 때: 인덱스 노드 전체(표시 필드만)를 세션당 한 번 받아 둡니다."""
+    if cache.get("local_records") is None:
+        fetched = _index_ref(db_ref_func, cache["kind"]).get() or {}
+        cache["local_records"] = {key: val for key, val in fetched.items() if isinstance(val, dict)}
+        cache["records"].update(cache["local_records"])
+    return cache["local_records"]
+
+def _warn_index_missing(cache):
+    st.warning(
+        f'⚠️ Firebase 규칙에 {DIRECTORIES[cache["kind"]]["index"]}의 ".indexOn": ["name", "email"]이 없어 '
+        "계정 목록 전체를 받아 정렬/검색합니다. 규칙을 추가하면 페이지 단위로 가져옵니다."
+    )
+
+
+# --- 2. 조회 ---
+def get_counts(cache, db_ref_func):
+    """(인덱스 계정 수, 원본 계정 수) — 키만 가져오는 shallow 조회를 세션당 한 번만 수행. 다르면 backfill이 필요합니다."""
+    if cache["total"] is None:
+        cache["total"] = len(_index_ref(db_ref_func, cache["kind"]).get(shallow=True) or {})
+    if cache["source_total"] is None:
+        cache["source_total"] = len(db_ref_func(DIRECTORIES[cache["kind"]]["source"]).get(shallow=True) or {})
+    return cache["total"], cache["source_total"]
+
+def load_page(cache, db_ref_func, page_number):
+    """
+    page_number(0부터) 페이지의 [(계정 키, 표시 필드), ...]를 정렬 기준 순으로 반환합니다.
+    아직 받지 않은 페이지는 마지막 커서부터 필요한 만큼만 인덱스 노드에서 가져옵니다.
+    인덱스 규칙이 없어 쿼리가 실패하면 경고 후 인덱스 노드 전체를 받아 세션에서 정렬합니다.
+    """
+    order_by = cache["order_by"]; index_ref = _index_ref(db_ref_func, cache["kind"])
+    needed = (page_number + 1) * USER_PAGE_SIZE
+    try:
+        _fetch_pages(cache, index_ref, order_by, needed)
+    except Exception:
+        cache["index_missing"] = True
+    if cache.get("index_missing"):
+        _warn_index_missing(cache)
+        if not cache["exhausted"]:
+            local_records = _load_index_locally(cache, db_ref_func)
+            cache["page_keys"] = sorted(local_records, key=lambda key: (local_records[key].get(order_by, ""), key))
+            cache["exhausted"] = True
+
+    page_keys = cache["page_keys"][page_number * USER_PAGE_SIZE:needed]
+    return [(key, cache["records"][key]) for key in page_keys if key in cache["records"]]
+
+def _fetch_pages(cache, index_ref, order_by, needed):
+    """목록이 needed개가 될 때까지 마지막 커서부터 한 페이지씩 서버에서 가져옵니다. (인덱스 규칙이 없으면 쿼리 오류 발생)"""
+    while len(cache["page_keys"]) < needed and not cache["exhausted"] and not cache.get("index_missing"):
+        query = index_ref.order_by_child(order_by)
+        already_listed = 0
+        if cache["next_cursor"] is not None:
+            query = query.start_at(cache["next_cursor"])
+            # 같은 이름이 여러 명이면 커서 값과 같은 계정이 이미 목록에 있으므로 그만큼 더 받아 건너뜁니다.
+            already_listed = sum(1 for key in cache["page_keys"] if cache["records"][key].get(order_by) == cache["next_cursor"])
+        fetched = query.limit_to_first(USER_PAGE_SIZE + already_listed + 1).get() or {}
+        listed = set(cache["page_keys"])
+        items = [(key, val) for key, val in fetched.items() if isinstance(val, dict) and key not in listed]
+        page_items = items[:USER_PAGE_SIZE]
+        for key, val in page_items:
+            cache["records"][key] = val
+        cache["page_keys"].extend(key for key, _ in page_items)
+        if len(items) > USER_PAGE_SIZE:
+            cache["next_cursor"] = items[USER_PAGE_SIZE][1].get(order_by, "")
+        else:
+            cache["exhausted"] = True
+
+def has_next_page(cache, page_number):
+    """다음 페이지가 있는지 확인합니다."""
+    return len(cache["page_keys"]) > (page_number + 1) * USER_PAGE_SIZE or not cache["exhausted"]
+
+def search_accounts(cache, db_ref_func, query):
+    """이름/이메일 접두어로 인덱스 노드에서 계정을 찾습니다. 결과는 세션에 보관하며 정렬 기준 순으로 반환합니다."""
+    query = (query or "").strip()
+    if query not in cache["searches"]:
+        index_ref = _index_ref(db_ref_func, cache["kind"]); found = {}
+        if not cache.get("index_missing"):
+            try:
+                for field in ORDER_FIELDS:
+                    found.update(index_ref.order_by_child(field).start_at(query).end_at(query + _PREFIX_END).limit_to_first(USER_SEARCH_LIMIT).get() or {})
+            except Exception:
+                cache["index_missing"] = True
+        if cache.get("index_missing"):
+            _warn_index_missing(cache)
+            local_records = _load_index_locally(cache, db_ref_func)
+            found = {key: val for key, val in local_records.items() if any(str(val.get(field, "")).startswith(query) for field in ORDER_FIELDS)}
+        found = {key: val for key, val in found.items() if isinstance(val, dict)}
+        cache["records"].update(found)
+        cache["searches"][query] = sorted(found, key=lambda key: (found[key].get(cache["order_by"], ""), key))
+    return [(key, cache["records"][key]) for key in cache["searches"][query] if key in cache["records"]]
+
+
+# --- 3. 등록 / 삭제 (write-through) ---
+def index_account(db_ref_func, kind, key, account):
+    """계정을 원본 노드에 쓴 뒤 호출해 인덱스에도 표시 필드를 반영합니다."""
+    projected = project_account(kind, account)
+    _index_ref(db_ref_func, kind).child(key).set(projected)
+    cache = st.session_state.get(f"user_directory_{kind}")
+    if cache:
+        cache["records"][key] = projected; _invalidate_listing(cache) # 새 계정이 들어갈 페이지 위치가 바뀜
+        if cache.get("local_records") is not None: cache["local_records"][key] = projected
+        cache["total"] = cache["source_total"] = None # 신규/재등록 여부와 관계없이 다음 조회 때 다시 셈
+
+def delete_accounts(db_ref_func, kind, keys):
+    """선택한 계정 키들을 원본/인덱스 노드에서 각각 한 번의 다중 경로 업데이트로 삭제하고 캐시에서도 제거합니다."""
+    keys = list(keys)
+    if not keys:
+        return
+    updates = {key: None for key in keys}
+    db_ref_func(DIRECTORIES[kind]["source"]).update(updates)
+    _index_ref(db_ref_func, kind).update(updates)
+    cache = st.session_state.get(f"user_directory_{kind}")
+    if not cache:
+        return
+    removed = set(keys)
+    for key in removed:
+        cache["records"].pop(key, None)
+        if cache.get("local_records") is not None: cache["local_records"].pop(key, None)
+    cache["total"] = cache["source_total"] = None
+    cache["page_keys"] = [key for key in cache["page_keys"] if key not in removed]
+    for query, found_keys in cache["searches"].items():
+        cache["searches"][query] = [key for key in found_keys if key not in removed]
+
+
+# --- 4. 인덱스 채우기 ---
+def backfill_index(db_ref_func, kind, chunk_size=500):
+    """
+    원본 노드 전체를 한 번 읽어 인덱스 노드를 다시 만듭니다. (원본에 없는 인덱스 항목은 삭제)
+    다중 경로 업데이트를 chunk_size개 단위로 보냅니다. 반환값: 인덱스에 쓴 계정 수
+    """
+    source = db_ref_func(DIRECTORIES[kind]["source"]).get() or {}
+    index_ref = _index_ref(db_ref_func, kind)
+    updates = {key: project_account(kind, account) for key, account in source.items() if isinstance(account, dict)}
+    written = len(updates)
+    updates.update({key: None for key in (index_ref.get(shallow=True) or {}) if key not in updates})
+    items = list(updates.items())
+    for start in range(0, len(items), chunk_size):
+        index_ref.update(dict(items[start:start + chunk_size]))
+    reset_directory_cache(kind)
+    return written